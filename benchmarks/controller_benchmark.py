@@ -0,0 +1,113 @@
+"""
+Throughput of ``CygdbController`` against the fake gdb, no gdb build needed.
+
+Replays a recorded transcript (cygdb_server/fake_gdb.py) through ``Process`` and the
+MI parser: ``cy run`` to the breakpoint, then repeated ``cy cont`` and cold frame
+reads. Only the server side is measured, so the numbers are stable enough to compare
+with a baseline the way run_benchmarks.py does:
+
+    python benchmarks/controller_benchmark.py --save-baseline
+    python benchmarks/controller_benchmark.py --repeat 1000    # 1000x the variables per frame
+"""
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from run_benchmarks import BENCHMARKS_FOLDER, compare, percentile, print_table, PERCENTILES
+
+SERVER_FOLDER = BENCHMARKS_FOLDER.parent / "cygdb_server"
+sys.path.insert(0, str(SERVER_FOLDER))
+
+import gdb_usage  # noqa: E402
+from breakpoints import Breakpoint  # noqa: E402
+from gdb_interface import CygdbController  # noqa: E402
+
+BASELINE_PATH = BENCHMARKS_FOLDER / "controller_baseline.json"
+TRANSCRIPT = SERVER_FOLDER / "transcripts" / "demo_project.json"
+PYX = BENCHMARKS_FOLDER.parent / "demo_project" / "monte_carlo_simulation.pyx"
+
+
+class ControllerBenchmark:
+    def __init__(self, transcript=TRANSCRIPT, delay=0.0, repeat=1, pad=0):
+        self.fake_gdb = (f"{sys.executable} {SERVER_FOLDER / 'fake_gdb.py'} --transcript {transcript} "
+                         f"--delay {delay} --repeat {repeat} --pad {pad}")
+        self.samples = defaultdict(list)
+
+    def measure(self, name, function):
+        usage = gdb_usage.start()
+        start = time.perf_counter()
+        result = function()
+        self.samples[name].append(dict(seconds=time.perf_counter() - start, round_trips=usage.round_trips,
+                                       commands=usage.commands, bytes_read=usage.bytes_read,
+                                       records_parsed=usage.records_parsed))
+        return result
+
+    def session(self, continues, frames):
+        cygdb = CygdbController()
+        bp = cygdb.breakpoints.add(Breakpoint("monte_carlo_simulation", 37, PYX, mode="debug_info"))
+        bp.resolved_lineno = 37
+        self.measure("spawn", lambda: cygdb.spawn_gdb(self.fake_gdb))
+        try:
+            self.measure("add_breakpoints", cygdb.add_breakpoints)
+            self.measure("run", cygdb.run)
+            for _ in range(continues):
+                self.measure("cont", cygdb.cont)
+            for _ in range(frames):
+                # a new generation, so the frame is read from gdb rather than the cache
+                cygdb.invalidate_handles()
+                self.measure("frame", cygdb.get_frame)
+        finally:
+            cygdb.exit_gdb()
+
+    def summary(self):
+        results = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = [sample["seconds"] for sample in samples]
+            result = dict(calls=len(samples), response_bytes=0)
+            for p in PERCENTILES:
+                result[f"p{p}"] = percentile(latencies, p)
+            for key in ("round_trips", "commands", "bytes_read", "records_parsed"):
+                result[key] = max(sample[key] for sample in samples)
+            results[name] = result
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript", type=Path, default=TRANSCRIPT)
+    parser.add_argument("--iterations", type=int, default=5, help="fake gdb sessions")
+    parser.add_argument("--continues", type=int, default=20, help="cy cont per session")
+    parser.add_argument("--frames", type=int, default=20, help="cold frame reads per session")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds the fake gdb waits before every reply")
+    parser.add_argument("--repeat", type=int, default=1, help="multiply the variables of cy locals/globals")
+    parser.add_argument("--pad", type=int, default=0, help="bytes of log output added to every reply")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", type=Path, help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    benchmark = ControllerBenchmark(args.transcript, args.delay, args.repeat, args.pad)
+    for _ in range(args.iterations):
+        benchmark.session(args.continues, args.frames)
+    results = benchmark.summary()
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()))
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
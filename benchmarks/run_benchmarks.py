@@ -0,0 +1,158 @@
+"""
+Latency benchmarks of the debug server against demo_project.
+
+Drives the full session flow (setFileToDebug, setBreakpoints, compileFiles, Launch,
+Frame, repeated Continue) against a running server, several times over, and reports
+per endpoint the p50/p95/p99 latency, the gdb round trips and the bytes of gdb output
+parsed (from the X-Gdb-* headers the server adds to every response).
+
+The results are compared with a stored baseline, a metric that got worse by more than
+the tolerance is a regression and makes the run fail:
+
+    python benchmarks/run_benchmarks.py --save-baseline    # record benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py                    # compare against it
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BENCHMARKS_FOLDER = Path(__file__).resolve().parent
+BASELINE_PATH = BENCHMARKS_FOLDER / "baseline.json"
+
+SOURCE = "run_file.py"
+FILE_TO_DEBUG = "monte_carlo_simulation.pyx"
+BREAKPOINTS = [34, 40]
+
+PERCENTILES = (50, 95, 99)
+# a latency percentile has to be this much slower than the baseline to count as a
+# regression, and by at least MIN_LATENCY_DELTA seconds so that noise in fast endpoints doesn't
+LATENCY_TOLERANCE = 0.25
+MIN_LATENCY_DELTA = 0.005
+# round trips and bytes are deterministic, any increase is a regression
+COUNT_TOLERANCE = 0.0
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Recorder:
+    def __init__(self, server_url):
+        import requests
+        self.session = requests.Session()
+        self.server_url = server_url.rstrip("/") + "/"
+        self.samples = defaultdict(list)
+
+    def call(self, method, endpoint, payload=None, name=None):
+        start = time.perf_counter()
+        resp = self.session.request(method, self.server_url + endpoint,
+                                    data=None if payload is None else json.dumps(payload))
+        seconds = time.perf_counter() - start
+        resp.raise_for_status()
+        self.samples[name or endpoint].append(dict(
+            seconds=seconds,
+            round_trips=int(resp.headers.get("X-Gdb-Round-Trips", 0)),
+            commands=int(resp.headers.get("X-Gdb-Commands", 0)),
+            bytes_read=int(resp.headers.get("X-Gdb-Bytes-Read", 0)),
+            gdb_seconds=float(resp.headers.get("X-Gdb-Seconds", 0)),
+            response_bytes=len(resp.content),
+        ))
+        return resp.json()
+
+    def session_flow(self, continues):
+        self.call("POST", "setFileToDebug", dict(source=SOURCE))
+        self.call("POST", "setBreakpoints", dict(source=FILE_TO_DEBUG, breakpoints=BREAKPOINTS))
+        self.call("GET", "compileFiles")
+        progress = self.call("POST", "Launch")
+        # the first /Frame of a stop reads it from gdb, the next ones are cached
+        self.call("GET", "Frame")
+        self.call("GET", "Frame", name="Frame (cached)")
+        for _ in range(continues):
+            if progress.get("ended"):
+                break
+            progress = self.call("GET", "Continue")
+            self.call("GET", "Frame")
+
+    def summary(self):
+        results = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [sample["seconds"] for sample in samples]
+            result = dict(calls=len(samples))
+            for p in PERCENTILES:
+                result[f"p{p}"] = percentile(latencies, p)
+            for key in ("round_trips", "commands", "bytes_read", "response_bytes"):
+                result[key] = max(sample[key] for sample in samples)
+            result["gdb_seconds_p50"] = percentile([sample["gdb_seconds"] for sample in samples], 50)
+            results[endpoint] = result
+        return results
+
+
+def compare(results, baseline):
+    """Regressions of ``results`` against ``baseline`` as human readable lines."""
+    regressions = []
+    for endpoint, result in sorted(results.items()):
+        base = baseline.get(endpoint)
+        if base is None:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}"
+            if base.get(key) is None or result.get(key) is None:
+                continue
+            delta = result[key] - base[key]
+            if delta > MIN_LATENCY_DELTA and result[key] > base[key] * (1 + LATENCY_TOLERANCE):
+                regressions.append(f"{endpoint} {key}: {base[key] * 1000:.1f} ms -> {result[key] * 1000:.1f} ms")
+        for key in ("round_trips", "bytes_read"):
+            if key in base and result[key] > base[key] * (1 + COUNT_TOLERANCE):
+                regressions.append(f"{endpoint} {key}: {base[key]} -> {result[key]}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'endpoint':<18}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'round trips':>13}{'gdb bytes':>11}{'resp bytes':>12}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<18}{result['calls']:>6}{result['p50'] * 1000:>10.1f}{result['p95'] * 1000:>10.1f}"
+              f"{result['p99'] * 1000:>10.1f}{result['round_trips']:>13}{result['bytes_read']:>11}"
+              f"{result['response_bytes']:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:3456/")
+    parser.add_argument("--iterations", type=int, default=5, help="times the whole session flow is run")
+    parser.add_argument("--continues", type=int, default=5, help="/Continue calls per session")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", type=Path, help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    recorder = Recorder(args.server)
+    for _ in range(args.iterations):
+        recorder.session_flow(args.continues)
+    results = recorder.summary()
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()))
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
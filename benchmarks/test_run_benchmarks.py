@@ -0,0 +1,17 @@
+from run_benchmarks import compare, percentile
+
+
+def test_percentiles_are_nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 95, 99)] == [50, 95, 99]
+    assert percentile([0.3], 99) == 0.3
+    assert percentile([], 50) is None
+
+
+def test_only_real_slowdowns_are_regressions():
+    baseline = {"Continue": dict(p50=0.100, p95=0.150, p99=0.200, round_trips=2, bytes_read=4000),
+                "Frame": dict(p50=0.001, p95=0.002, p99=0.003, round_trips=1, bytes_read=900)}
+    results = {"Continue": dict(p50=0.110, p95=0.300, p99=0.210, round_trips=3, bytes_read=4000),
+               "Frame": dict(p50=0.003, p95=0.004, p99=0.005, round_trips=1, bytes_read=900),
+               "Launch": dict(p50=1.0, p95=1.0, p99=1.0, round_trips=5, bytes_read=1)}
+    assert compare(results, baseline) == ["Continue p95: 150.0 ms -> 300.0 ms", "Continue round_trips: 2 -> 3"]
@@ -1,14 +1,36 @@
+import asyncio
+import contextvars
+import json
 import logging
+import os
 import subprocess as sp
 import textwrap
+import threading
+import time
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import uvicorn
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
-from gdb_interface import CygdbController
+from buffer_reader import BufferReadError, write_npy
+from build_cache import BuildCache
+from dap_server import serve_tcp
+import gdb_usage
+import metrics
+import mi_parser as mi
+from debug_info import DebugInfo
+from events import EventBus
+from folder_sync import BUFFERS_FOLDER, TRACES_FOLDER, sync_folder
+from frame_cache import frame_delta
+from gdb_pool import GdbPool, fingerprint
+from jobs import JobRunner
+from parallel_build import EVENT_PREFIX, UNSUPPORTED
+from sessions import DEFAULT_SESSION, InvalidSessionError, SessionLimitError, SessionRegistry, locked
+from startup import Startup, find_executable, preload
+from trace_reader import TRACE_SUFFIX, TraceError, TraceReader, summarize, user_functions, user_records
 
 logger = logging.getLogger(__name__)
 
@@ -16,25 +38,28 @@ MOUNTED_PROJECT_FOLDER = "/project_folder"
 
 WORKING_FOLDER = "./working_folder"
 
+# working folders of sessions other than the default one
+SESSIONS_FOLDER = "./sessions"
 
-def recopy_mounted_folder_to_working_folder():
-    cmd = f"rm -rdf {WORKING_FOLDER}"
-    print(cmd)
-    sp.call(cmd.split())
+# gdb-side commands (cy snapshot, ...), sourced by the generated command file
+GDB_EXTENSIONS_PATH = Path(__file__).resolve().parent / "gdb_extensions.py"
+# run with the debug interpreter to build changed modules in parallel
+PARALLEL_BUILD_PATH = Path(__file__).resolve().parent / "parallel_build.py"
+# longest /Launch waits for a gdb the pool is already starting before starting its own
+GDB_POOL_WAIT = 120
 
-    cmd = f"cp -r {MOUNTED_PROJECT_FOLDER}/ {WORKING_FOLDER}"
-    print(cmd)
-    sp.call(cmd.split())
 
+def recopy_mounted_folder_to_working_folder(keep_build_outputs=False, working_folder=WORKING_FOLDER):
+    report = sync_folder(MOUNTED_PROJECT_FOLDER, working_folder, keep_build_outputs)
+    print(f"synced {MOUNTED_PROJECT_FOLDER} to {working_folder}: {report.as_dict()}")
+    return report
 
-recopy_mounted_folder_to_working_folder()
 
-
-def make_command_file(path_to_debug_info, prefix_code=''):
+def make_command_file(path_to_debug_info, prefix_code='', working_folder=WORKING_FOLDER):
     debug_files = [debug_file.as_posix() for debug_file in
-                   Path(WORKING_FOLDER, path_to_debug_info, "cython_debug", ).glob("cython_debug_info_*")]
+                   Path(working_folder, path_to_debug_info, "cython_debug", ).glob("cython_debug_info_*")]
 
-    gdb_cy_configure_path = Path(WORKING_FOLDER, "cython_debug", "gdb_configuration_file")
+    gdb_cy_configure_path = Path(working_folder, "cython_debug", "gdb_configuration_file")
     gdb_cy_configure_path.parent.mkdir(exist_ok=True)
     f = gdb_cy_configure_path.open("w")
     try:
@@ -67,7 +92,7 @@ def make_command_file(path_to_debug_info, prefix_code=''):
             end
             '''))
 
-        path = Path(WORKING_FOLDER, path_to_debug_info, "cython_debug", "interpreter")
+        path = Path(working_folder, path_to_debug_info, "cython_debug", "interpreter")
         assert path.exists()
         interpreter_file = path.open()
         try:
@@ -87,33 +112,153 @@ def make_command_file(path_to_debug_info, prefix_code=''):
                     "stripped). Some functionality may not work (properly).\\n")
             end
 
-            source .cygdbinit
         '''))
+        f.write("source %s\n" % GDB_EXTENSIONS_PATH.as_posix())
+        f.write("source .cygdbinit\n")
     finally:
         f.close()
 
     return gdb_cy_configure_path
 
 
-def cythonize_files(python_debug_executable_path="/usr/bin/python3-dbg"):
+def run_parallel_build(python_debug_executable_path, sources, workers=None, working_folder=WORKING_FOLDER, job=None):
+    """
+    Build ``sources`` with parallel_build.py, one module per worker. Output is printed
+    as it arrives, per-module events are collected from a pipe of their own. Returns
+    (output, events, returncode).
+    """
+    read_events, write_events = os.pipe()
+    cmd = [python_debug_executable_path, PARALLEL_BUILD_PATH.as_posix(),
+           "--workers", str(workers or build_workers()), "--events-fd", str(write_events), "--only"] + sources
+    print(" ".join(cmd))
+    try:
+        proc = sp.Popen(cmd, cwd=working_folder, stdout=sp.PIPE, stderr=sp.STDOUT, start_new_session=True,
+                        pass_fds=(write_events,))
+    except BaseException:
+        os.close(read_events)
+        raise
+    finally:
+        os.close(write_events)
+    if job is not None:
+        job.attach(proc)
+    output, events = [], []
+    event_reader = threading.Thread(target=read_build_events, args=(read_events, events, output, job), daemon=True)
+    event_reader.start()
+    for line in iter(proc.stdout.readline, b""):
+        line = line.decode(errors="replace")
+        print(line, end="")
+        output.append(line)
+        if job is not None:
+            job.log(line)
+    returncode = proc.wait()
+    event_reader.join()
+    return "".join(output), events, returncode
+
+
+def read_build_events(fd, events, output, job=None):
+    """Collect parallel_build.py's events until every process holding the pipe exited."""
+    with os.fdopen(fd, "rb") as pipe:
+        for line in pipe:
+            line = line.decode(errors="replace")
+            try:
+                event = json.loads(line[len(EVENT_PREFIX):]) if line.startswith(EVENT_PREFIX) else None
+            except ValueError:
+                event = None
+            if event is None:
+                # not an event after all, keep it with the build output
+                output.append(line)
+                continue
+            events.append(event)
+            if job is not None:
+                job.event("build", event)
+            if event["event"] == "module":
+                print(f"built {event['name']}: success={event['success']} "
+                      f"cythonize={event.get('cythonize', 0):.2f}s compile={event.get('compile', 0):.2f}s "
+                      f"link={event.get('link', 0):.2f}s")
+
+
+def build_workers():
+    return int(os.environ.get("CYGDB_BUILD_WORKERS", 0)) or os.cpu_count() or 1
+
+
+def cythonize_files(python_debug_executable_path="/usr/bin/python3-dbg", breakpoint_layout=None, workers=None,
+                    working_folder=WORKING_FOLDER, job=None):
     """
     Start the Cython debugger. This tells gdb to import the Cython and Python
     extensions (libcython.py and libpython.py) and it enables gdb's pending
     breakpoints.
-    """
 
+    Modules whose inputs hash the same as in the last successful build are skipped,
+    see build_cache.py. The others are built in parallel by parallel_build.py, or by
+    ``setup.py build_ext`` when it can't make sense of setup.py. Returns the build
+    output, whether it succeeded and a report of which modules were built or cached
+    and how long each stage took.
+    """
+    start = time.perf_counter()
+    build_cache = BuildCache(working_folder)
+    keys = build_cache.module_keys(python_debug_executable_path, breakpoint_layout)
+    changed, cached = build_cache.plan(keys)
+    report = dict(built=changed, cached=cached, modules=[])
+    print("build cache hits: ", cached, "to build: ", changed)
+    cached_modules = [dict(name=name, status="cached", seconds=0.0) for name in cached]
+    if not changed:
+        report["seconds"] = time.perf_counter() - start
+        report["modules"] = cached_modules
+        return "All modules are up to date\n", True, report
+
+    build_cache.prepare(keys, changed, cached)
+    sources = [keys[name][0].relative_to(build_cache.working_folder).as_posix() for name in changed]
+    output, events, returncode = run_parallel_build(python_debug_executable_path, sources, workers, working_folder,
+                                                    job)
+    if returncode == UNSUPPORTED:
+        return setup_py_build(python_debug_executable_path, build_cache, keys, changed, cached_modules,
+                              report, start, job)
+
+    results = {event["name"]: event for event in events if event["event"] == "module"}
+    report["workers"] = next((event["workers"] for event in events if event["event"] == "plan"), None)
+    report["modules"] = [dict(name=name, status="built" if result["success"] else "failed",
+                              seconds=result.get("seconds", 0.0), cythonize=result.get("cythonize", 0.0),
+                              compile=result.get("compile", 0.0), link=result.get("link", 0.0))
+                         for name, result in sorted(results.items())] + cached_modules
+    report["seconds"] = time.perf_counter() - start
+
+    built = [name for name in changed if results.get(name, {}).get("success")]
+    build_cache.record(keys, built)
+    build_cache.forget([name for name in changed if name not in built])
+    if returncode != 0 or "Error compiling Cython file" in output:
+        return output, False, report
+    return output, True, report
+
+
+def setup_py_build(python_debug_executable_path, build_cache, keys, changed, cached_modules, report, start,
+                   job=None):
     BUILD_CMD = f"{python_debug_executable_path} setup.py build_ext --inplace"
     print(BUILD_CMD)
-    build_outputs = sp.run(BUILD_CMD.split(" "), cwd=WORKING_FOLDER, stdout=sp.PIPE, stderr=sp.PIPE)
-
-    stdout = build_outputs.stdout.decode()
-    stderr = build_outputs.stderr.decode()
+    build_start = time.perf_counter()
+    build_outputs = sp.Popen(BUILD_CMD.split(" "), cwd=build_cache.working_folder, stdout=sp.PIPE, stderr=sp.PIPE,
+                             start_new_session=True)
+    if job is not None:
+        job.attach(build_outputs)
+    stdout, stderr = build_outputs.communicate()
+    build_seconds = time.perf_counter() - build_start
+
+    stdout = stdout.decode()
+    stderr = stderr.decode()
+    if job is not None:
+        job.log(stdout + stderr)
     print("stdout", stdout)
     print("stderr", stderr)
-    if "Error compiling Cython file" in stderr or "doesn't match any files" in stderr:
-        return stderr, False
+    # a single setup.py run builds every changed module, they share its wall time
+    report["modules"] = [dict(name=name, status="built", seconds=build_seconds) for name in changed] + \
+                        cached_modules
+    report["seconds"] = time.perf_counter() - start
+    if "Error compiling Cython file" in stderr or "doesn't match any files" in stderr \
+            or build_outputs.returncode != 0:
+        build_cache.forget(changed)
+        return stderr, False, report
 
-    return stdout, True
+    build_cache.record(keys, changed)
+    return stdout, True, report
 
 
 class Config(BaseModel):
@@ -124,27 +269,114 @@ class Config(BaseModel):
 app = FastAPI()
 
 
+slow_log = metrics.SlowLog.from_environment()
+
+
+@app.middleware("http")
+async def report_gdb_usage(request: Request, call_next):
+    """
+    Tell clients (and the benchmarks) what a request cost in gdb round trips and
+    output, and count it in the metrics.
+    """
+    usage = gdb_usage.start()
+    spans = metrics.start_trace() if slow_log is not None else None
+    start = time.perf_counter()
+    response = await call_next(request)
+    seconds = time.perf_counter() - start
+    response.headers.update(usage.headers())
+    # the route's endpoint, the path would make a label value per session and handle
+    endpoint = request.scope.get("endpoint")
+    handler = endpoint.__name__ if endpoint is not None else "unmatched"
+    if slow_log is not None:
+        slow_log.write(handler, seconds, spans, method=request.method, path=request.url.path,
+                       status=response.status_code, gdb=dict(round_trips=usage.round_trips,
+                                                            bytes_read=usage.bytes_read,
+                                                            seconds=round(usage.seconds, 6)))
+    metrics.HTTP_SECONDS.observe(seconds, handler=handler, method=request.method, status=response.status_code)
+    metrics.HTTP_ROUND_TRIPS.observe(usage.round_trips, handler=handler)
+    metrics.HTTP_BYTES_READ.observe(usage.bytes_read, handler=handler)
+    return response
+
+
+def record_build(report, success):
+    metrics.BUILDS.inc(result="success" if success else "failure")
+    metrics.BUILD_SECONDS.observe(report["seconds"], stage="total")
+    for module in report["modules"]:
+        metrics.BUILT_MODULES.inc(status=module["status"])
+        for stage in ("cythonize", "compile", "link"):
+            if stage in module:
+                metrics.BUILD_SECONDS.observe(module[stage], stage=stage)
+
+
 class CythonServer:
-    def __init__(self):
+    def __init__(self, working_folder=WORKING_FOLDER, session_id=DEFAULT_SESSION, events=None):
+        self.working_folder = working_folder
+        self.session_id = session_id
+        self.events = events
         self.gdb_executable_path = None
         self.gdb_configuration_file = None
         self.python_debug_executable_path = None
         self.file_path = None
         self.debug_path = None
         self.cygdb = None
+        # the requested trace (path, functions, variables), set before or while gdb runs
+        self.trace = None
+        self.gdb_pool = GdbPool(size=int(os.environ.get("CYGDB_GDB_POOL_SIZE", 1)))
+
+    def new_controller(self, breakpoint_mode="print"):
+        # pexpect and regex are imported by the startup thread, not at server import
+        from gdb_interface import CygdbController
+        cygdb = CygdbController()
+        cygdb.breakpoint_mode = breakpoint_mode
+        cygdb.debug_info = DebugInfo(Path(self.working_folder, self.debug_path, "cython_debug"))
+        return cygdb
 
     def file_to_debug(self, file_path):
-        self.file_path = Path(WORKING_FOLDER, file_path).as_posix()
+        self.file_path = Path(self.working_folder, file_path).as_posix()
+        self.prepare_gdb_pool()
         # return self.setup_files()
 
-    def setup_files(self):
+    def launch_command(self):
+        return [self.gdb_executable_path, "--nx", "--interpreter=mi3", "--quiet", '-command',
+                self.gdb_configuration_file.as_posix(),
+                "--args",
+                self.python_debug_executable_path,
+                self.file_path]
+
+    def gdb_fingerprint(self, cmd):
+        debug_folder = Path(self.working_folder, self.debug_path, "cython_debug")
+        return fingerprint(cmd, [self.gdb_configuration_file, GDB_EXTENSIONS_PATH] +
+                           sorted(debug_folder.glob("cython_debug_info_*")))
+
+    def prepare_gdb_pool(self):
+        """Start gdb for the next /Launch in the background, once there is something to debug."""
+        if self.file_path is None or self.gdb_configuration_file is None:
+            return
+        cmd = self.launch_command()
+        self.gdb_pool.prepare(cmd, self.gdb_fingerprint(cmd))
+
+    def breakpoint_layout(self):
+        """{absolute .pyx path: user lines with an injected print} for the build cache."""
+        if self.cygdb is None:
+            return {}
+        return {path.resolve().as_posix(): list(index.insertions)
+                for path, index in self.cygdb.line_indexes.indexes.items()}
+
+    def setup_files(self, workers=None, job=None):
         if self.debug_path and self.python_debug_executable_path:
-            output, successful_compile = cythonize_files(self.python_debug_executable_path)
+            output, successful_compile, report = cythonize_files(self.python_debug_executable_path,
+                                                                 self.breakpoint_layout(), workers,
+                                                                 self.working_folder, job)
+            record_build(report, successful_compile)
+            if report["built"]:
+                self.gdb_pool.invalidate()
             if successful_compile:
-                self.gdb_configuration_file = make_command_file(self.debug_path)
-            return output, successful_compile
+                self.gdb_configuration_file = make_command_file(self.debug_path,
+                                                                working_folder=self.working_folder)
+                self.prepare_gdb_pool()
+            return output, successful_compile, report
 
-    def format_progress(self, resp):
+    def format_progress(self, resp, include_hits=False):
         if len(resp) == 0:
             resp = {
                 "ended": True
@@ -157,62 +389,283 @@ class CythonServer:
                     "lineno": resp[-1]["lineno"]
                 }
             }
+        if include_hits:
+            resp["hits"] = self.cygdb.breakpoints.hits()
+        self.publish("stop", resp)
         return resp
 
-    def continue_debugger(self):
+    def publish(self, name, payload):
+        if self.events is not None:
+            self.events.publish(name, self.session_id, payload)
+
+    def on_gdb_record(self, record):
+        # the program shares gdb's terminal, its stdout and stderr arrive as non-MI lines;
+        # empty ones are mostly the prints injected for breakpoints
+        if record.kind == mi.OUTPUT and record.text.strip():
+            self.publish("output", dict(text=mi.strip_ansi(record.text)))
+
+    def continue_debugger(self, include_hits=False):
         resp = self.cygdb.cont()
-        return self.format_progress(resp)
+        return self.format_progress(resp, include_hits)
+
+    async def continue_debugger_async(self, include_hits=False):
+        resp = await self.cygdb.cont_async()
+        return self.format_progress(resp, include_hits)
 
-    def cythonize_files(self):
-        output, successful_compile = self.setup_files()
+    def cythonize_files(self, workers=None, job=None):
+        output, successful_compile, report = self.setup_files(workers, job)
         if not successful_compile:
             return {
                 "success": False,
-                "output": output
+                "output": output,
+                "build": report
             }
         else:
             return {
                 "success": True,
-                "output": output
+                "output": output,
+                "build": report
             }
 
-    def run_debugger(self):
-        self.cmd = [self.gdb_executable_path, "--nx", "--interpreter=mi3", "--quiet", '-command',
-                    self.gdb_configuration_file.as_posix(),
-                    "--args",
-                    self.python_debug_executable_path,
-                    self.file_path]
+    def run_debugger(self, include_hits=False):
+        self.start_gdb()
+        resp = self.cygdb.run()
+        return self.format_progress(resp, include_hits)
+
+    async def run_debugger_async(self, include_hits=False):
+        # starting gdb and setting breakpoints is short and blocking, running is not
+        await asyncio.get_event_loop().run_in_executor(None, contextvars.copy_context().run, self.start_gdb)
+        resp = await self.cygdb.run_async()
+        return self.format_progress(resp, include_hits)
+
+    def start_gdb(self):
+        self.cmd = self.launch_command()
 
         print(" ".join(self.cmd))
-        self.cygdb.spawn_gdb(self.cmd)
+        gdb = self.gdb_pool.acquire(self.cmd, self.gdb_fingerprint(self.cmd), timeout=GDB_POOL_WAIT)
+        if gdb is None:
+            self.cygdb.spawn_gdb(self.cmd)
+        else:
+            self.cygdb.gdb = gdb
+        self.cygdb.gdb.channel.listeners.append(self.on_gdb_record)
 
         self.cygdb.add_breakpoints()
-        resp = self.cygdb.run()
-        return self.format_progress(resp)
+        if self.trace is not None:
+            try:
+                self.trace["reply"] = self.cygdb.start_trace(self.trace["path"], self.trace["functions"],
+                                                             self.trace["variables"])
+            except TraceError as e:
+                print("cy trace-start failed: ", e)
+                self.trace["error"] = str(e)
 
     def restart_debugger(self):
-        recopy_mounted_folder_to_working_folder()
+        report = recopy_mounted_folder_to_working_folder(working_folder=self.working_folder)
         self.cygdb.exit_gdb()
         self.cygdb.clear_all()
         self.cygdb.gdb.start_new_process()
+        return report
+
+    def restart_in_session(self, include_hits=False, workers=None):
+        """
+        Run the program again in the live gdb: only the inferior is killed, breakpoints
+        and loaded symbols stay, and only modules whose sources changed are rebuilt
+        and imported again.
+        """
+        start = time.perf_counter()
+        self.cygdb.kill_inferior()
+        report = recopy_mounted_folder_to_working_folder(True, self.working_folder)
+        self.cygdb.reinject_prints()
+        output, successful_compile, build = self.setup_files(workers)
+        resp = {
+            "sync": report.as_dict(),
+            "build": build
+        }
+        if not successful_compile:
+            resp.update(success=False, output=output)
+            return resp
+        debug_folder = Path(self.working_folder, self.debug_path, "cython_debug")
+        reimport = [Path(debug_folder, f"cython_debug_info_{name}").as_posix() for name in build["built"]]
+        resp.update(self.format_progress(self.cygdb.rerun(reimport), include_hits))
+        resp.update(success=True, seconds=time.perf_counter() - start)
+        return resp
 
+    def set_breakpoints(self, source, breakpoints, mode="print"):
+        full_path = Path(self.working_folder, source).as_posix()
+        if mode == "debug_info":
+            # breakpoints come from the debug info, so an existing session keeps running
+            # and only the breakpoints of this source are swapped
+            if self.cygdb is None or self.cygdb.breakpoint_mode != mode:
+                self.cygdb = self.new_controller(mode)
+            valid_breakpoints = self.cygdb.replace_breakpoints(source, breakpoints, full_path)
+            return {
+                "source": source,
+                "breakpoints": breakpoints,
+                "mode": mode,
+                "valid_breakpoints": valid_breakpoints,
+                "resolved": [bp.as_dict() for bp in self.cygdb.breakpoints],
+            }
 
-cython_server = CythonServer()
-cython_server.python_debug_executable_path = "/usr/bin/python3.8-dbg"
-cython_server.gdb_executable_path = "/usr/local/bin/gdb"
+        self.cygdb = self.new_controller(mode)
+        valid_breakpoints = []
+        for lineno in breakpoints:
+            valid = self.cygdb.add_prints_to_file(
+                filename=source,
+                lineno=lineno,
+                full_path=full_path
+            )
+            print(full_path)
+            if valid:
+                valid_breakpoints.append(lineno)
+
+        return {
+            "source": source,
+            "breakpoints": breakpoints
+        }
+
+    def trace_path(self):
+        path = Path(self.working_folder, TRACES_FOLDER, self.session_id + TRACE_SUFFIX).resolve()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def close(self):
+        if self.cygdb is not None and self.cygdb.gdb is not None:
+            self.cygdb.exit_gdb()
+        self.gdb_pool.close()
+
+
+event_bus = EventBus()
+cython_server = CythonServer(events=event_bus)
 cython_server.debug_path = "."
 
 
+def new_session_server(working_folder):
+    server = CythonServer(working_folder, working_folder.parent.name, event_bus)
+    server.debug_path = cython_server.debug_path
+    server.python_debug_executable_path = cython_server.python_debug_executable_path
+    server.gdb_executable_path = cython_server.gdb_executable_path
+    recopy_mounted_folder_to_working_folder(working_folder=working_folder)
+    return server
+
+
+sessions = SessionRegistry(new_session_server, SESSIONS_FOLDER,
+                           max_sessions=int(os.environ.get("CYGDB_MAX_SESSIONS", 4)),
+                           idle_timeout=float(os.environ.get("CYGDB_SESSION_IDLE_SECONDS", 1800)))
+sessions.add(DEFAULT_SESSION, cython_server, WORKING_FOLDER)
+
+
+def get_session(session_id):
+    startup.wait()
+    try:
+        return sessions.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no session {session_id}")
+
+
+async def wait_for_startup():
+    if not startup.wait(0):
+        await asyncio.get_event_loop().run_in_executor(None, startup.wait)
+
+
+async def get_session_async(session_id):
+    await wait_for_startup()
+    try:
+        return sessions.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no session {session_id}")
+
+
+jobs = JobRunner(max_workers=int(os.environ.get("CYGDB_JOB_WORKERS", 4)),
+                 notify=lambda job, name, payload: event_bus.publish(name, job.session_id, payload))
+
+
+def discover_executables():
+    cython_server.python_debug_executable_path = find_executable(
+        ["python3.8-dbg", "python3-dbg"], ["/usr/bin/python3.8-dbg"], "CYGDB_PYTHON_DBG")
+    cython_server.gdb_executable_path = find_executable(["gdb"], ["/usr/local/bin/gdb"], "CYGDB_GDB")
+    return dict(python=cython_server.python_debug_executable_path, gdb=cython_server.gdb_executable_path)
+
+
+startup = Startup()
+startup.add_stage("sync", lambda: recopy_mounted_folder_to_working_folder().as_dict())
+startup.add_stage("executables", discover_executables)
+startup.add_stage("imports", lambda: preload("pexpect", "regex", "gdb_interface"))
+
+
+@app.on_event("startup")
+def start_background_initialization():
+    startup.start()
+
+
+@app.on_event("startup")
+async def start_debug_adapter():
+    # editors speaking the Debug Adapter Protocol connect here, next to the REST routes
+    port = os.environ.get("CYGDB_DAP_PORT")
+    if port:
+        await serve_tcp(get_session_async, "0.0.0.0", int(port), event_bus)
+        print(f"debug adapter listening on port {port}")
+
+
+@app.get("/ready")
+async def ready():
+    return dict(startup.as_dict(), gdb_pool=cython_server.gdb_pool.as_dict())
+
+
+@app.get("/sessions")
+async def list_sessions():
+    return sessions.as_list()
+
+
+@app.post("/sessions")
+def create_session(session_id: Optional[str] = Body(None, embed=True)):
+    startup.wait()
+    try:
+        session = sessions.create(session_id)
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except InvalidSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.as_dict()
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    try:
+        sessions.remove(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no session {session_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "session_id": session_id
+    }
+
+
+# Every debugging route is served for the default session at /X and for any other
+# session at /sessions/{session_id}/X.
 @app.get("/Restart")
-def restart():
-    global cython_server
-    cython_server.restart_debugger()
-    return
+@app.get("/sessions/{session_id}/Restart")
+def restart(in_session: bool = False, hits: bool = False, session_id: str = DEFAULT_SESSION):
+    session = get_session(session_id)
+    with session.lock:
+        server = session.server
+        if in_session and server.cygdb is not None and server.cygdb.gdb is not None \
+                and server.cygdb.gdb.proc.isalive():
+            return server.restart_in_session(include_hits=hits)
+        report = server.restart_debugger()
+        return {
+            "sync": report.as_dict()
+        }
 
 
 @app.post("/setFileToDebug")
-def set_file_to_debug(source: str = Body(..., embed=True)):
-    cython_server.file_to_debug(source)
+@app.post("/sessions/{session_id}/setFileToDebug")
+def set_file_to_debug(source: str = Body(..., embed=True), session_id: str = DEFAULT_SESSION):
+    session = get_session(session_id)
+    with session.lock:
+        session.server.file_to_debug(source)
     return {
         "success": True,
         "source": source,
@@ -220,68 +673,304 @@ def set_file_to_debug(source: str = Body(..., embed=True)):
 
 
 @app.post("/hello")
-def hello(hello: str = Body(...), test: str = Body(...)):
+async def hello(hello: str = Body(...), test: str = Body(...)):
     return "Hello: " + hello
 
 
 @app.get("/hello")
-def hello():
+async def hello():
     return "Working"
 
 
 @app.get("/compileFiles")
-def compile_files():
-    return cython_server.cythonize_files()
+@app.get("/sessions/{session_id}/compileFiles")
+async def compile_files(workers: Optional[int] = None, background: bool = False,
+                        session_id: str = DEFAULT_SESSION):
+    session = await get_session_async(session_id)
+
+    def compile_job(job):
+        with session.lock:
+            return session.server.cythonize_files(workers, job)
+
+    job = jobs.submit("compile", compile_job, session_id)
+    if background:
+        return job.as_dict()
+    await asyncio.wrap_future(job.future)
+    if job.result is None:
+        return {
+            "success": False,
+            "output": job.error or job.state,
+            "job_id": job.job_id
+        }
+    return job.result
 
 
 @app.post("/setBreakpoints")
-def set_breakpoints(source: str = Body(...), breakpoints: List[int] = Body(...)):
-    cython_server.cygdb = CygdbController()
-    valid_breakpoints = []
-    for lineno in breakpoints:
-        valid = cython_server.cygdb.add_prints_to_file(
-            filename=source,
-            lineno=lineno,
-            full_path=Path(WORKING_FOLDER, source).as_posix()
-        )
-        print(Path(WORKING_FOLDER, source).as_posix())
-        if valid:
-            valid_breakpoints.append(lineno)
-
-    return {
-        "source": source,
-        "breakpoints": breakpoints
-    }
+@app.post("/sessions/{session_id}/setBreakpoints")
+def set_breakpoints(source: str = Body(...), breakpoints: List[int] = Body(...), mode: str = Body("print"),
+                    session_id: str = DEFAULT_SESSION):
+    session = get_session(session_id)
+    with session.lock:
+        return session.server.set_breakpoints(source, breakpoints, mode)
 
 
 @app.post("/Launch")
-def run_debugger():
-    return cython_server.run_debugger()
+@app.post("/sessions/{session_id}/Launch")
+async def run_debugger(hits: bool = False, session_id: str = DEFAULT_SESSION):
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        return await server.run_debugger_async(include_hits=hits)
 
 
 @app.get("/Continue")
-def continue_debugger():
-    return cython_server.continue_debugger()
+@app.get("/sessions/{session_id}/Continue")
+async def continue_debugger(hits: bool = False, session_id: str = DEFAULT_SESSION):
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        return await server.continue_debugger_async(include_hits=hits)
 
 
 @app.get("/Frame")
-def get_frame():
-    return cython_server.cygdb.frame
+@app.get("/sessions/{session_id}/Frame")
+async def get_frame(since: Optional[int] = None, thread: Optional[int] = None,
+                    session_id: str = DEFAULT_SESSION):
+    """
+    The frame of the current stop, in the thread the program stopped in or in
+    ``thread``. With ``since``, a stop generation a previous response reported, only
+    the locals and globals that changed since then.
+    """
+    session = await get_session_async(session_id)
+    cygdb = session.server.cygdb
+    if cygdb is None:
+        return None
+    # a frame already read for this stop is served without waiting for whatever the session is doing
+    frame = cygdb.frames.get(cygdb.generation, thread)
+    if frame is None:
+        if cygdb.gdb is None or (cygdb.frame is None and thread is None):
+            return cygdb.frame
+        async with locked(session) as server:
+            frame = await server.cygdb.get_frame_async(thread)
+    if since is not None:
+        previous = cygdb.frames.get(since, thread)
+        if previous is not None:
+            return frame_delta(previous, frame)
+    return frame
+
+
+@app.get("/Variables/{handle}")
+@app.get("/sessions/{session_id}/Variables/{handle}")
+async def get_variable_children(handle: str, offset: int = 0, limit: int = 100, session_id: str = DEFAULT_SESSION):
+    """A page of the children of a variable, by the handle /Frame gave it."""
+    from gdb_interface import HandleExpired, InvalidHandle
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        try:
+            return await server.cygdb.children_async(handle, offset, limit)
+        except InvalidHandle as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except HandleExpired as e:
+            raise HTTPException(status_code=410, detail=str(e))
 
 
-@app.post("/installRequirements")
-def install_requirements(requirements: str = Body(..., embed=True)):
+@app.get("/Buffer/{name}")
+@app.get("/sessions/{session_id}/Buffer/{name}")
+async def read_buffer(name: str, slice: str = "", output: str = "stats", session_id: str = DEFAULT_SESSION):
+    """
+    A typed memoryview or NumPy array of the current stop, read with bulk memory reads.
+    ``slice`` is numpy-like ("0:1000:10", "5,:"); ``output`` is ``stats`` (count, min,
+    max, mean, NaN count), ``raw`` (the items as C-ordered bytes) or ``npy`` (a file in
+    the working folder).
+    """
+    if output not in ("stats", "raw", "npy"):
+        raise HTTPException(status_code=400, detail=f"unknown output {output}, use stats, raw or npy")
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        if server.cygdb is None or server.cygdb.gdb is None:
+            raise HTTPException(status_code=409, detail="the debugger isn't running")
+        start = time.perf_counter()
+        try:
+            view, raw = await server.cygdb.read_buffer_async(name, slice)
+        except BufferReadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    read_seconds = time.perf_counter() - start
+    if output == "raw":
+        return Response(view.to_bytes(raw), media_type="application/octet-stream", headers={
+            "X-Buffer-Dtype": view.dtype,
+            "X-Buffer-Shape": ",".join(map(str, view.shape)),
+        })
+    resp = dict(name=name, slice=slice, bytes_read=len(raw), read_seconds=read_seconds, **view.as_dict())
+    # large buffers take a moment to go through, keep the loop serving other requests
+    loop = asyncio.get_event_loop()
+    if output == "npy":
+        path = Path(server.working_folder, BUFFERS_FOLDER, "".join(c if c.isalnum() else "_" for c in name) + ".npy")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        resp.update(path=str(path), bytes_written=await loop.run_in_executor(None, write_npy, path, view, raw))
+    else:
+        try:
+            resp["stats"] = await loop.run_in_executor(None, view.stats, raw)
+        except BufferReadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    resp["seconds"] = time.perf_counter() - start
+    return resp
+
+
+@app.post("/Trace/start")
+@app.post("/sessions/{session_id}/Trace/start")
+async def start_trace(functions: List[str] = Body(...), locals: List[str] = Body([]),
+                      session_id: str = DEFAULT_SESSION):
+    """
+    Record every line the Cython ``functions`` (``module:function`` or names) run, with
+    the values of ``locals``, inside gdb and without stopping. Before /Launch the trace
+    starts with the program.
+    """
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        trace = dict(path=server.trace_path().as_posix(), functions=functions, variables=locals)
+        if server.cygdb is None or server.cygdb.gdb is None:
+            preview = dict(functions=[], invalid=[])
+            debug_info = server.cygdb.debug_info if server.cygdb is not None else None
+            if debug_info is not None and debug_info.files():
+                # compiled already, so a trace that would find nothing can be refused now
+                preview = debug_info.trace_functions(functions)
+                if not preview["functions"]:
+                    raise HTTPException(status_code=400, detail=f"no Cython functions {functions}")
+            # an earlier run's file isn't this trace's
+            Path(trace["path"]).unlink(missing_ok=True)
+            trace["reply"] = preview
+            server.trace = trace
+            return dict(user_reply(server, preview), path=trace["path"], pending=True)
+        try:
+            trace["reply"] = await server.cygdb.start_trace_async(trace["path"], functions, locals)
+        except TraceError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        server.trace = trace
+        return dict(user_reply(server, trace["reply"]), pending=False)
+
+
+def trace_user_line(server):
+    """Maps traced lines to the user's source, None when they are the user's already."""
+    return server.cygdb.user_trace_line() if server.cygdb is not None else None
+
+
+def user_reply(server, reply):
+    user_line = trace_user_line(server)
+    if user_line is None:
+        return reply
+    return dict(reply, functions=user_functions(reply["functions"], user_line))
+
+
+def current_trace(server):
+    if server.trace is None:
+        raise HTTPException(status_code=409, detail="no trace was started")
+    if not Path(server.trace["path"]).exists():
+        raise HTTPException(status_code=409, detail=server.trace.get("error", "the trace hasn't started yet"))
+    return server.trace
+
+
+async def flush_idle_trace(session, trace):
+    """
+    Have gdb write out what it holds of the trace, unless another request has the
+    session: the program may be running then, and gdb flushes when it stops anyway.
+    """
+    if "stopped" in trace or not session.lock.acquire(blocking=False):
+        return
+    try:
+        cygdb = session.server.cygdb
+        if cygdb is not None and cygdb.gdb is not None:
+            await cygdb.flush_trace_async()
+    except TraceError as e:
+        print("cy trace-flush failed: ", e)
+    finally:
+        session.lock.release()
+
+
+@app.get("/Trace")
+@app.get("/sessions/{session_id}/Trace")
+async def stream_trace(offset: int = 0, limit: int = 10000, output: str = "records",
+                       session_id: str = DEFAULT_SESSION):
+    """
+    The trace from ``offset``, which is 0 or the ``offset`` a previous response gave:
+    decoded ``records``, or the ``raw`` bytes of the file. gdb writes lines out every
+    half second while the program runs and whenever it stops, poll again for more.
+    Lines are the user's, in print mode the injected prints are left out.
+    """
+    if output not in ("records", "raw"):
+        raise HTTPException(status_code=400, detail=f"unknown output {output}, use records or raw")
+    session = await get_session_async(session_id)
+    # the file is only appended to, reading it doesn't need the session
+    trace = current_trace(session.server)
+    await flush_idle_trace(session, trace)
+    if output == "raw":
+        with open(trace["path"], "rb") as fp:
+            fp.seek(offset)
+            data = fp.read()
+        return Response(data, media_type="application/octet-stream",
+                        headers={"X-Trace-Offset": str(offset + len(data))})
+    reader = trace.setdefault("reader", TraceReader(trace["path"]))
+    try:
+        records, next_offset = await asyncio.get_event_loop().run_in_executor(None, reader.read, offset, limit)
+    except TraceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    user_line = trace_user_line(session.server)
+    if user_line is not None:
+        records = list(user_records(records, user_line))
+    return dict(records=records, offset=next_offset, running="stopped" not in trace)
+
+
+@app.get("/Trace/summary")
+@app.get("/sessions/{session_id}/Trace/summary")
+async def trace_summary(session_id: str = DEFAULT_SESSION):
+    """Coverage of the traced functions, line frequencies and per-thread counts so far."""
+    session = await get_session_async(session_id)
+    trace = current_trace(session.server)
+    await flush_idle_trace(session, trace)
+    functions = trace.get("reply", {}).get("functions", [])
+    return await asyncio.get_event_loop().run_in_executor(None, summarize, trace["path"], functions,
+                                                          trace_user_line(session.server))
+
+
+@app.post("/Trace/stop")
+@app.post("/sessions/{session_id}/Trace/stop")
+async def stop_trace(session_id: str = DEFAULT_SESSION):
+    """Stop tracing and close the trace file, then summarize it."""
+    session = await get_session_async(session_id)
+    async with locked(session) as server:
+        trace = current_trace(server)
+        if server.cygdb is not None and server.cygdb.gdb is not None and "stopped" not in trace:
+            try:
+                trace["stopped"] = await server.cygdb.stop_trace_async()
+            except TraceError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    functions = trace.get("reply", {}).get("functions", [])
+    summary = await asyncio.get_event_loop().run_in_executor(None, summarize, trace["path"], functions,
+                                                             trace_user_line(server))
+    return dict(trace.get("stopped", {}), summary=summary)
+
+
+def pip_install(requirements, job):
     user_requirements_file = Path("user_requirements.txt")
     if user_requirements_file.exists():
         user_requirements_file.unlink()
     user_requirements_file.write_text(requirements)
-    pip_install_cmd = f"python3.8-dbg -m pip install -r user_requirements.txt --force --no-cache"
-    print(pip_install_cmd)
-    build_outputs = sp.run(pip_install_cmd.split(), stdout=sp.PIPE, stderr=sp.PIPE)
-
-    stdout = build_outputs.stdout.decode()
-    stderr = build_outputs.stderr.decode()
-    return_code = build_outputs.returncode
+    # into the interpreter the program runs with
+    pip_install_cmd = [cython_server.python_debug_executable_path, "-m", "pip", "install", "-r",
+                       "user_requirements.txt", "--force", "--no-cache"]
+    print(" ".join(pip_install_cmd))
+    build_outputs = sp.Popen(pip_install_cmd, stdout=sp.PIPE, stderr=sp.PIPE, start_new_session=True)
+    job.attach(build_outputs)
+    stderr = []
+    stderr_reader = threading.Thread(target=lambda: stderr.extend(build_outputs.stderr), daemon=True)
+    stderr_reader.start()
+    stdout = []
+    for line in iter(build_outputs.stdout.readline, b""):
+        line = line.decode(errors="replace")
+        stdout.append(line)
+        job.log(line)
+    return_code = build_outputs.wait()
+    stderr_reader.join()
+
+    stdout = "".join(stdout)
+    stderr = b"".join(stderr).decode(errors="replace")
 
     if return_code != 0:
         return dict(
@@ -295,5 +984,62 @@ def install_requirements(requirements: str = Body(..., embed=True)):
     )
 
 
+@app.post("/installRequirements")
+async def install_requirements(requirements: str = Body(..., embed=True), background: bool = False):
+    await wait_for_startup()
+    job = jobs.submit("pip install", lambda job: pip_install(requirements, job))
+    if background:
+        return job.as_dict()
+    await asyncio.wrap_future(job.future)
+    if job.result is None:
+        return dict(
+            success=False,
+            output=job.error or job.state
+        )
+    return job.result
+
+
+@app.get("/events")
+@app.get("/sessions/{session_id}/events")
+async def event_stream(session_id: str = DEFAULT_SESSION, last_event_id: Optional[int] = Header(None)):
+    """
+    Server-Sent Events: "stop" (the /Launch and /Continue payload), "output" (program
+    output), "build" (per-module compile progress), "job" and "job-output".
+    """
+    return StreamingResponse(event_bus.stream(session_id, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters and histograms in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return jobs.as_list()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, output: bool = False):
+    try:
+        return jobs.get(job_id).as_dict(include_output=output)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no job {job_id}")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    try:
+        job = jobs.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no job {job_id}")
+    return {
+        "cancelled": job.cancel(),
+        "job": job.as_dict()
+    }
+
+
 if __name__ == '__main__':
     uvicorn.run(app, host="0.0.0.0", port=3456)
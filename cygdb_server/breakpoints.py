@@ -0,0 +1,119 @@
+"""
+Breakpoints requested through ``/setBreakpoints``, indexed by where gdb reports them.
+
+gdb reports stops in line numbers of the ``.pyx`` after prints were injected, so the
+registry is keyed by (module stem, corrected line) and re-keyed whenever a file's
+line index changes. Matching a stop is a dict lookup however many breakpoints there are.
+"""
+import time
+from pathlib import Path
+
+
+class Breakpoint:
+    def __init__(self, filename, lineno, full_path, type="file", mode="print"):
+        self.type = type
+        self.filename = filename
+        self.lineno = str(lineno)
+        self.full_path = full_path
+        # "print" breakpoints stop on an injected print(), "debug_info" ones are placed
+        # from the Cython debug info on resolved_lineno without touching the source
+        self.mode = mode
+        self.resolved_lineno = None
+        self.hit_count = 0
+        self.last_hit = None
+
+    def __getitem__(self, key):
+        # breakpoints used to be plain dicts
+        return getattr(self, key)
+
+    def as_dict(self):
+        return dict(
+            type=self.type,
+            filename=self.filename,
+            lineno=self.lineno,
+            full_path=str(self.full_path),
+            mode=self.mode,
+            resolved_lineno=self.resolved_lineno,
+            hit_count=self.hit_count,
+            last_hit=self.last_hit
+        )
+
+
+class BreakpointRegistry:
+    def __init__(self, line_indexes):
+        self.line_indexes = line_indexes
+        self.breakpoints = []
+        self._paths = set()
+        self._by_location = {}
+        self._by_line = {}
+        self._index_versions = None
+
+    def __iter__(self):
+        return iter(self.breakpoints)
+
+    def __len__(self):
+        return len(self.breakpoints)
+
+    def add(self, breakpoint):
+        self.breakpoints.append(breakpoint)
+        self._paths.add(Path(breakpoint.full_path))
+        self._index_versions = None
+        return breakpoint
+
+    def remove(self, filename):
+        """Drop every breakpoint in ``filename`` (any suffix)."""
+        stem = Path(filename).stem
+        self.breakpoints = [breakpoint for breakpoint in self.breakpoints if breakpoint.filename != stem]
+        self._paths = set(Path(breakpoint.full_path) for breakpoint in self.breakpoints)
+        self.invalidate()
+
+    def invalidate(self):
+        """Re-key on the next lookup, e.g. after breakpoints were resolved."""
+        self._index_versions = None
+
+    def clear(self):
+        self.breakpoints = []
+        self._paths = set()
+        self._by_location = {}
+        self._by_line = {}
+        self._index_versions = None
+
+    def corrected_line(self, breakpoint):
+        if breakpoint.mode == "debug_info":
+            return str(breakpoint.resolved_lineno or breakpoint.lineno)
+        return str(self.line_indexes.get(breakpoint.full_path).corrected(breakpoint.lineno))
+
+    def _current_versions(self):
+        versions = {}
+        for path in self._paths:
+            index = self.line_indexes.get(path)
+            versions[path] = (id(index), index.version)
+        return versions
+
+    def _ensure_index(self):
+        versions = self._current_versions()
+        if versions == self._index_versions:
+            return
+        self._by_location = {}
+        self._by_line = {}
+        for breakpoint in self.breakpoints:
+            lineno = self.corrected_line(breakpoint)
+            self._by_location[(breakpoint.filename, lineno)] = breakpoint
+            self._by_line.setdefault(lineno, []).append(breakpoint)
+        self._index_versions = versions
+
+    def lookup(self, filename, lineno):
+        """The breakpoint at ``filename`` (any suffix) and ``lineno`` as gdb reports it, or None."""
+        self._ensure_index()
+        return self._by_location.get((Path(filename).stem, str(lineno)))
+
+    def lookup_line(self, lineno):
+        self._ensure_index()
+        return self._by_line.get(str(lineno), [])
+
+    def record_hit(self, breakpoint):
+        breakpoint.hit_count += 1
+        breakpoint.last_hit = time.time()
+
+    def hits(self):
+        return [breakpoint.as_dict() for breakpoint in self.breakpoints]
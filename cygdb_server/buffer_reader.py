@@ -0,0 +1,269 @@
+"""
+Typed memoryviews and NumPy arrays of the debugged program, read as bytes.
+
+gdb reports a buffer's data pointer, shape, strides and item type (``cy buffer-info``)
+and copies the bytes a slice spans to a file in one bulk read (``cy dump-memory``).
+Everything else, slicing, ``.npy`` files and summary stats, happens here. NumPy is
+used when it is installed, imported the first time a buffer is read so the server
+doesn't wait for it at startup; without it the same results come from ``struct``.
+"""
+import ast
+import itertools
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+from contextlib import contextmanager
+
+numpy = None
+numpy_imported = False
+
+# PEP 3118 item codes: numpy kind
+FORMAT_KINDS = {
+    "?": "b",
+    "b": "i", "h": "i", "i": "i", "l": "i", "q": "i", "n": "i",
+    "B": "u", "H": "u", "I": "u", "L": "u", "Q": "u", "N": "u",
+    "e": "f", "f": "f", "d": "f", "g": "f",
+    "Zf": "c", "Zd": "c", "Zg": "c",
+}
+# (numpy kind, itemsize): struct code, for reading items without numpy
+STRUCT_CODES = {
+    ("b", 1): "?",
+    ("i", 1): "b", ("i", 2): "h", ("i", 4): "i", ("i", 8): "q",
+    ("u", 1): "B", ("u", 2): "H", ("u", 4): "I", ("u", 8): "Q",
+    ("f", 2): "e", ("f", 4): "f", ("f", 8): "d",
+}
+NATIVE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+
+class BufferReadError(Exception):
+    pass
+
+
+def load_numpy():
+    """The numpy module, None when it isn't installed."""
+    global numpy, numpy_imported
+    if not numpy_imported:
+        numpy_imported = True
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+    return numpy
+
+
+def numpy_dtype(info):
+    """The numpy type string ("<f8", ...) of the items of a ``cy buffer-info`` buffer."""
+    itemsize = info["itemsize"]
+    if "dtype" in info:
+        order, kind = info["dtype"][0], info["dtype"][1]
+        if order in "=|":
+            order = NATIVE_ORDER
+    else:
+        code = info["format"]
+        order = NATIVE_ORDER
+        if code[:1] in "@=<>!":
+            order = ">" if code[0] in ">!" else "<" if code[0] == "<" else NATIVE_ORDER
+            code = code[1:]
+        kind = FORMAT_KINDS.get(code)
+        if kind is None:
+            raise BufferReadError(f"items of format {info['format']!r} can't be read")
+    return f"{order}{kind}{itemsize}"
+
+
+def parse_slices(spec, ndim):
+    """
+    "0:100:2,5" as one slice or index per dimension; missing dimensions are taken
+    whole. An empty spec is the whole buffer.
+    """
+    items = [item.strip() for item in spec.split(",")] if spec and spec.strip() else []
+    if len(items) > ndim:
+        raise BufferReadError(f"{len(items)} indices given for {ndim} dimensions")
+    slices = []
+    for item in items:
+        try:
+            if ":" not in item:
+                slices.append(int(item))
+                continue
+            parts = [int(part) if part.strip() else None for part in item.split(":")]
+        except ValueError:
+            raise BufferReadError(f"invalid slice {item!r}")
+        if len(parts) > 3:
+            raise BufferReadError(f"invalid slice {item!r}")
+        slices.append(slice(*parts))
+    return slices + [slice(None)] * (ndim - len(items))
+
+
+class BufferView:
+    """
+    Items at ``data + offset + sum(index * stride)`` for every index within ``shape``,
+    the same model as a NumPy array over the inferior's memory.
+    """
+
+    def __init__(self, data, dtype, shape, strides, offset=0):
+        self.data = data
+        self.dtype = dtype
+        self.itemsize = int(dtype[2:])
+        self.shape = list(shape)
+        self.strides = list(strides)
+        self.offset = offset
+
+    @classmethod
+    def from_info(cls, info):
+        if "error" in info:
+            raise BufferReadError(info["error"])
+        return cls(int(info["data"], 16), numpy_dtype(info), info["shape"], info["strides"])
+
+    @property
+    def size(self):
+        return math.prod(self.shape)
+
+    def sliced(self, spec):
+        offset, shape, strides = self.offset, [], []
+        for item, length, stride in zip(parse_slices(spec, len(self.shape)), self.shape, self.strides):
+            if isinstance(item, int):
+                index = item + length if item < 0 else item
+                if not 0 <= index < length:
+                    raise BufferReadError(f"index {item} out of range for length {length}")
+                offset += index * stride
+                continue
+            start, stop, step = item.indices(length)
+            offset += start * stride
+            shape.append(len(range(start, stop, step)))
+            strides.append(stride * step)
+        return BufferView(self.data, self.dtype, shape, strides, offset)
+
+    def extent(self):
+        """(first, end) byte offsets from ``data`` of the memory the items lie in."""
+        if 0 in self.shape:
+            return self.offset, self.offset
+        low = self.offset + sum(min(0, (n - 1) * s) for n, s in zip(self.shape, self.strides))
+        high = self.offset + sum(max(0, (n - 1) * s) for n, s in zip(self.shape, self.strides))
+        return low, high + self.itemsize
+
+    def rebased(self, first):
+        """The same items in a copy of the memory that starts at ``first``."""
+        return BufferView(self.data + first, self.dtype, self.shape, self.strides, self.offset - first)
+
+    def positions(self):
+        """Byte offset of every item in C order."""
+        for index in itertools.product(*(range(n) for n in self.shape)):
+            yield self.offset + sum(i * s for i, s in zip(index, self.strides))
+
+    def to_array(self, raw):
+        """The items as a NumPy array over ``raw``, without copying them."""
+        np = load_numpy()
+        return np.ndarray(self.shape, np.dtype(self.dtype), buffer=raw, offset=self.offset, strides=self.strides)
+
+    def to_bytes(self, raw):
+        """The items as one C-contiguous block."""
+        if load_numpy() is not None:
+            return self.to_array(raw).tobytes()
+        return b"".join(raw[position:position + self.itemsize] for position in self.positions())
+
+    def items(self, raw):
+        code = STRUCT_CODES.get((self.dtype[1], self.itemsize))
+        if code is None:
+            raise BufferReadError(f"items of type {self.dtype} need numpy")
+        item = struct.Struct(self.dtype[0] + code)
+        return (item.unpack_from(raw, position)[0] for position in self.positions())
+
+    def stats(self, raw):
+        """Count, min, max and mean of the items, leaving NaNs out and counting them."""
+        if load_numpy() is not None:
+            return array_stats(self.to_array(raw))
+        count, nan_count, total, low, high = 0, 0, 0, None, None
+        for value in self.items(raw):
+            count += 1
+            if value != value:
+                nan_count += 1
+                continue
+            total += value
+            low = value if low is None or value < low else low
+            high = value if high is None or value > high else high
+        valid = count - nan_count
+        return dict(count=count, nan_count=nan_count, min=low, max=high,
+                    mean=total / valid if valid else None)
+
+    def as_dict(self):
+        return dict(address=f"0x{self.data + self.offset:x}", dtype=self.dtype,
+                    shape=self.shape, strides=self.strides, size=self.size)
+
+
+def array_stats(array):
+    np = load_numpy()
+    nan_count = 0
+    if array.dtype.kind in "fc":
+        nans = np.isnan(array)
+        nan_count = int(nans.sum())
+        array = array[~nans]
+    stats = dict(count=int(array.size) + nan_count, nan_count=nan_count, min=None, max=None, mean=None)
+    if array.size:
+        if array.dtype.kind != "c":
+            stats.update(min=array.min().item(), max=array.max().item())
+        mean = array.mean(dtype=np.complex128 if array.dtype.kind == "c" else np.float64).item()
+        stats["mean"] = str(mean) if isinstance(mean, complex) else mean
+    return stats
+
+
+def npy_header(dtype, shape):
+    """Version 1.0 ``.npy`` header for a C-ordered array."""
+    header = f"{{'descr': '{dtype}', 'fortran_order': False, 'shape': {tuple(shape)!r}, }}"
+    # the data starts at a multiple of 64 bytes, the header ends with a newline
+    header += " " * (-(10 + len(header) + 1) % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def write_npy(path, view, raw):
+    data = view.to_bytes(raw)
+    with open(path, "wb") as f:
+        f.write(npy_header(view.dtype, view.shape))
+        f.write(data)
+    return len(data)
+
+
+def read_npy_header(path):
+    """(dtype, shape) from a ``.npy`` header, for tests and clients without numpy."""
+    with open(path, "rb") as f:
+        prefix = f.read(10)
+        header = f.read(struct.unpack("<H", prefix[8:10])[0]).decode("latin1")
+    header = ast.literal_eval(header)
+    return header["descr"], list(header["shape"])
+
+
+def parse_gdb_json(resp, command):
+    if resp.error is not None:
+        raise BufferReadError(f"{command} failed: {resp.error}")
+    try:
+        payload = json.loads(resp.stream_text())
+    except ValueError:
+        raise BufferReadError(f"{command} printed no JSON: {resp.stream_text()!r}")
+    if "error" in payload:
+        raise BufferReadError(payload["error"])
+    return payload
+
+
+def buffer_info_command(name):
+    if "\n" in name or not name.strip():
+        raise BufferReadError(f"invalid variable name {name!r}")
+    return f"cy buffer-info {name}"
+
+
+def dump_command(view, path):
+    """``cy dump-memory`` for exactly the bytes ``view``'s items lie in."""
+    first, end = view.extent()
+    return f"cy dump-memory 0x{view.data + first:x} {end - first} {path}"
+
+
+@contextmanager
+def dump_file():
+    """Path of a file for gdb to dump memory to, removed afterwards."""
+    fd, path = tempfile.mkstemp(prefix="cygdb-buffer-", suffix=".bin")
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        os.unlink(path)
@@ -0,0 +1,135 @@
+"""
+Content-hash cache for the Cython build of the working folder.
+
+Each ``.pyx`` gets a key hashed from its source, the project's ``.pxd`` files and
+``setup.py``, the breakpoint prints injected into it, the compiler flags and the
+Cython version of the debug interpreter. A module whose key matches the last
+successful build, and whose outputs still exist, doesn't need to be built again.
+"""
+import hashlib
+import json
+import os
+import subprocess as sp
+import time
+from pathlib import Path
+
+CACHE_FILE_NAME = ".cygdb_build_cache.json"
+IGNORED_FOLDERS = ("build", "cython_debug", "__pycache__")
+FLAG_VARIABLES = ("CC", "CFLAGS", "CPPFLAGS", "LDFLAGS", "LDSHARED")
+
+_cython_versions = {}
+
+
+def cython_version(python_executable):
+    if python_executable not in _cython_versions:
+        output = sp.run([python_executable, "-c", "import Cython; print(Cython.__version__)"],
+                        stdout=sp.PIPE, stderr=sp.PIPE)
+        _cython_versions[python_executable] = output.stdout.decode().strip()
+    return _cython_versions[python_executable]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_sources(folder, suffix):
+    sources = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if d not in IGNORED_FOLDERS and not d.startswith(".")]
+        sources.extend(Path(root, name) for name in files if name.endswith(suffix))
+    return sorted(sources)
+
+
+def module_name(folder, pyx_path):
+    return ".".join(pyx_path.relative_to(folder).with_suffix("").parts)
+
+
+class BuildCache:
+    def __init__(self, working_folder):
+        self.working_folder = Path(working_folder)
+        self.cache_path = self.working_folder / CACHE_FILE_NAME
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            self.entries = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        self.cache_path.write_text(json.dumps(self.entries, indent=1, sort_keys=True))
+
+    def module_keys(self, python_executable, breakpoint_layout=None):
+        """{module name: (pyx path, key)} for every .pyx in the working folder."""
+        breakpoint_layout = breakpoint_layout or {}
+        shared = hashlib.sha256()
+        for pxd in find_sources(self.working_folder, ".pxd"):
+            shared.update(str(pxd.relative_to(self.working_folder)).encode())
+            shared.update(file_digest(pxd).encode())
+        setup_py = self.working_folder / "setup.py"
+        if setup_py.exists():
+            shared.update(file_digest(setup_py).encode())
+        for variable in FLAG_VARIABLES:
+            shared.update(f"{variable}={os.environ.get(variable, '')}".encode())
+        shared.update(python_executable.encode())
+        shared.update(cython_version(python_executable).encode())
+        shared = shared.hexdigest()
+
+        keys = {}
+        for pyx in find_sources(self.working_folder, ".pyx"):
+            key = hashlib.sha256(shared.encode())
+            key.update(file_digest(pyx).encode())
+            layout = breakpoint_layout.get(pyx.resolve().as_posix(), [])
+            key.update(json.dumps(sorted(layout)).encode())
+            keys[module_name(self.working_folder, pyx)] = (pyx, key.hexdigest())
+        return keys
+
+    def outputs_exist(self, name, pyx):
+        stem = pyx.with_suffix("").name
+        built = any(pyx.parent.glob(f"{stem}*.so")) or any(pyx.parent.glob(f"{stem}*.pyd"))
+        debug_info = Path(self.working_folder, "cython_debug", f"cython_debug_info_{name}")
+        return built and debug_info.exists()
+
+    def plan(self, keys):
+        """Split modules into the ones that must be built and the ones that are cache hits."""
+        changed, cached = [], []
+        for name, (pyx, key) in sorted(keys.items()):
+            if self.entries.get(name) == key and self.outputs_exist(name, pyx):
+                cached.append(name)
+            else:
+                changed.append(name)
+        return changed, cached
+
+    def prepare(self, keys, changed, cached):
+        """
+        Make setuptools' own timestamp checks agree with the plan: outputs of cached
+        modules are touched so they look up to date, the generated C of changed ones is
+        removed so it gets regenerated.
+        """
+        now = time.time()
+        for name in cached:
+            pyx = keys[name][0]
+            for output in [pyx.with_suffix(".c"), pyx.with_suffix(".cpp")] + \
+                    sorted(pyx.parent.glob(f"{pyx.with_suffix('').name}*.so")):
+                if output.exists():
+                    os.utime(output, (now, now))
+        for name in changed:
+            pyx = keys[name][0]
+            for generated in (pyx.with_suffix(".c"), pyx.with_suffix(".cpp")):
+                if generated.exists():
+                    generated.unlink()
+
+    def record(self, keys, names):
+        for name in names:
+            self.entries[name] = keys[name][1]
+        self.save()
+
+    def forget(self, names):
+        for name in names:
+            self.entries.pop(name, None)
+        self.save()
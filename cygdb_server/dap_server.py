@@ -0,0 +1,425 @@
+"""
+Debug Adapter Protocol front end.
+
+Editors that speak DAP connect over TCP or stdio instead of calling the REST routes
+one action at a time. Messages are JSON behind a ``Content-Length`` header. Requests
+are answered as soon as they are handled, and a ``stopped`` event goes out as soon
+as gdb's stop is parsed. The stackTrace, scopes and variables requests that follow
+a stop are all answered from the frame read at that stop, so a stop costs one
+``cy snapshot`` however many of them the editor sends.
+
+    python dap_server.py --port 4711
+    python dap_server.py --stdio
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import traceback
+from pathlib import Path
+
+from sessions import DEFAULT_SESSION, locked
+
+LOCALS_REFERENCE = 1
+GLOBALS_REFERENCE = 2
+# variables with children get references from here on, numbered anew every stop
+FIRST_CHILD_REFERENCE = 1000
+# children sent when the editor doesn't ask for a page
+DEFAULT_PAGE = 100
+SEQUENCE_TYPES = ("list", "tuple")
+
+
+class AdapterError(Exception):
+    pass
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_message(message):
+    body = json.dumps(message, default=str).encode()
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+async def read_message(reader):
+    """The next message, or None once the client is gone. ProtocolError if it can't be framed."""
+    length = None
+    headers = False
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if headers:
+                break
+            continue
+        headers = True
+        name, _, value = line.decode(errors="replace").partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise ProtocolError(f"invalid Content-Length {value.strip()!r}")
+    if length is None or length < 0:
+        raise ProtocolError("message without a Content-Length")
+    try:
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class DebugAdapter:
+    def __init__(self, get_session, write, events=None):
+        """
+        ``get_session(session_id)`` is a coroutine returning the session to debug in,
+        ``write(data)`` sends bytes to the editor and ``events`` is the EventBus the
+        program's output is forwarded from.
+        """
+        self.get_session = get_session
+        self.write = write
+        self.events = events
+        self.seq = 0
+        self.session = None
+        self.mode = "debug_info"
+        self.compile = True
+        self.project_root = None
+        self.run_task = None
+        self.output_task = None
+        self.closed = False
+        self.reset_references(None)
+
+    def send(self, message):
+        self.seq += 1
+        message["seq"] = self.seq
+        self.write(encode_message(message))
+
+    def respond(self, request, body=None, success=True, message=None):
+        response = dict(type="response", request_seq=request.get("seq"), command=request.get("command"),
+                        success=success, body=body or {})
+        if message is not None:
+            response["message"] = message
+        self.send(response)
+
+    def event(self, name, body=None):
+        self.send(dict(type="event", event=name, body=body or {}))
+
+    async def serve(self, reader):
+        """Handle requests in order until the editor disconnects."""
+        try:
+            while not self.closed:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                if message.get("type") == "request":
+                    await self.handle(message)
+        except ConnectionError:
+            pass
+        except ProtocolError as e:
+            # the next message can't be found either, drop the connection
+            print(f"closing the debug adapter connection: {e}")
+        finally:
+            await self.close()
+
+    async def handle(self, request):
+        handler = getattr(self, "on_" + request.get("command", ""), None)
+        if handler is None:
+            self.respond(request, success=False, message=f"unsupported request {request.get('command')}")
+            return
+        try:
+            body = await handler(request.get("arguments") or {})
+        except Exception as e:
+            if not isinstance(e, AdapterError):
+                traceback.print_exc()
+            self.respond(request, success=False, message=str(e))
+            return
+        self.respond(request, body)
+
+    def require_session(self):
+        if self.session is None:
+            raise AdapterError("launch first")
+        return self.session
+
+    # paths: the editor's copy of the project against the session's working folder
+
+    def working_path(self, path):
+        """The path in the working folder of a file the editor names."""
+        if self.project_root is not None:
+            try:
+                return Path(path).relative_to(self.project_root).as_posix()
+            except ValueError:
+                pass
+        return path
+
+    def editor_path(self, path):
+        working_folder = Path(self.require_session().working_folder).resolve()
+        try:
+            relative = Path(path).resolve().relative_to(working_folder)
+        except ValueError:
+            return path
+        return (Path(self.project_root) / relative).as_posix() if self.project_root else path
+
+    # starting and stopping
+
+    async def on_initialize(self, args):
+        # the editor sends its breakpoints after initialized, which follows this response
+        asyncio.get_event_loop().call_soon(self.event, "initialized")
+        return dict(supportsConfigurationDoneRequest=True, supportsTerminateRequest=True)
+
+    async def on_launch(self, args):
+        self.session = await self.get_session(args.get("sessionId", DEFAULT_SESSION))
+        self.mode = args.get("breakpointMode", self.mode)
+        self.compile = args.get("compile", self.compile)
+        self.project_root = args.get("projectRoot")
+        if self.events is not None and self.output_task is None:
+            self.output_task = asyncio.ensure_future(self.forward_output())
+        async with locked(self.session) as server:
+            server.file_to_debug(self.working_path(args["program"]))
+            # breakpoints from the debug info need it built before they are set
+            if self.mode == "debug_info" and self.compile:
+                await self.build(server)
+        return {}
+
+    async def build(self, server):
+        result = await asyncio.get_event_loop().run_in_executor(None, server.cythonize_files)
+        if not result["success"]:
+            self.event("output", dict(category="stderr", output=str(result["output"])))
+            raise AdapterError("the build failed")
+
+    async def on_setBreakpoints(self, args):
+        source = args["source"].get("path") or args["source"]["name"]
+        lines = [breakpoint["line"] for breakpoint in args.get("breakpoints", [])] or args.get("lines", [])
+        async with locked(self.require_session()) as server:
+            resp = server.set_breakpoints(self.working_path(source), lines, self.mode)
+        valid = resp.get("valid_breakpoints", lines)
+        return dict(breakpoints=[dict(verified=line in valid, line=line) for line in lines])
+
+    async def on_configurationDone(self, args):
+        async def launch(server):
+            if self.mode == "print" and self.compile:
+                await self.build(server)
+            if server.cygdb is None:
+                server.cygdb = server.new_controller(self.mode)
+            return (await server.run_debugger_async())["ended"]
+
+        self.start_run(launch, "breakpoint")
+        return {}
+
+    async def on_continue(self, args):
+        async def cont(server):
+            return (await server.continue_debugger_async())["ended"]
+
+        self.start_run(cont, "breakpoint")
+        return dict(allThreadsContinued=True)
+
+    async def on_next(self, args):
+        async def next_line(server):
+            return not await server.cygdb.next_async()
+
+        self.start_run(next_line, "step")
+        return {}
+
+    async def on_stepIn(self, args):
+        async def step(server):
+            return not await server.cygdb.step_async()
+
+        self.start_run(step, "step")
+        return {}
+
+    def start_run(self, action, reason):
+        """Resume the program in the background; the response goes out before it stops."""
+        session = self.require_session()
+        if self.run_task is not None and not self.run_task.done():
+            raise AdapterError("the program is already running")
+        self.run_task = asyncio.ensure_future(self.run_until_stop(session, action, reason))
+
+    async def run_until_stop(self, session, action, reason):
+        try:
+            async with locked(session) as server:
+                ended = await action(server)
+        except Exception as e:
+            traceback.print_exc()
+            self.event("output", dict(category="stderr", output=f"{e}\n"))
+            self.event("terminated")
+            return
+        if ended:
+            self.event("terminated")
+        else:
+            self.event("stopped", dict(reason=reason, threadId=self.thread_id(), allThreadsStopped=True))
+
+    async def on_disconnect(self, args):
+        self.closed = True
+        await self.stop_debugging()
+        return {}
+
+    async def on_terminate(self, args):
+        await self.stop_debugging()
+        self.event("terminated")
+        return {}
+
+    async def stop_debugging(self):
+        if self.run_task is not None and not self.run_task.done():
+            self.run_task.cancel()
+        if self.session is None:
+            return
+        async with locked(self.session) as server:
+            if server.cygdb is not None and server.cygdb.gdb is not None:
+                server.cygdb.exit_gdb()
+                server.cygdb.gdb = None
+
+    async def close(self):
+        if self.output_task is not None:
+            self.output_task.cancel()
+        if self.run_task is not None and not self.run_task.done():
+            self.run_task.cancel()
+
+    async def forward_output(self):
+        subscription = self.events.subscribe(self.session.session_id)
+        try:
+            while True:
+                event = await subscription.queue.get()
+                if event.name == "output":
+                    self.event("output", dict(category="stdout", output=event.payload["text"]))
+        finally:
+            self.events.unsubscribe(subscription)
+
+    # inspecting a stop
+
+    async def current_frame(self):
+        """The frame of the current stop, read from gdb by the first request that needs it."""
+        session = self.require_session()
+        cygdb = session.server.cygdb
+        if cygdb is None or cygdb.gdb is None:
+            raise AdapterError("the program isn't running")
+        frame = cygdb.frames.get(cygdb.generation)
+        if frame is None:
+            async with locked(session) as server:
+                frame = await server.cygdb.get_frame_async()
+        if frame.generation != self.references_generation:
+            self.reset_references(frame.generation)
+        return frame
+
+    def thread_id(self):
+        cygdb = self.session.server.cygdb
+        frame = cygdb.frame if cygdb is not None else None
+        return frame.thread_id if frame is not None and frame.thread_id is not None else 1
+
+    async def on_threads(self, args):
+        return dict(threads=[dict(id=self.thread_id(), name="main thread")])
+
+    async def on_stackTrace(self, args):
+        frame = await self.current_frame()
+        trace = list(reversed(frame.trace or []))
+        start = args.get("startFrame", 0)
+        levels = args.get("levels") or len(trace)
+        stack_frames = []
+        for index, entry in enumerate(trace[start:start + levels], start):
+            path = entry.get("file_parent", "") + entry["filename"]
+            stack_frames.append(dict(
+                id=index,
+                name=entry["function_or_object"],
+                source=dict(name=entry["filename"], path=self.editor_path(path)),
+                # in print mode, the line without the injected prints
+                line=int(entry.get("user_lineno", entry["lineno"])),
+                column=1
+            ))
+        return dict(stackFrames=stack_frames, totalFrames=len(trace))
+
+    async def on_scopes(self, args):
+        frame = await self.current_frame()
+        # cy snapshot reads the variables of the innermost frame only
+        if args.get("frameId", 0) != 0:
+            return dict(scopes=[])
+        return dict(scopes=[
+            dict(name="Locals", presentationHint="locals", variablesReference=LOCALS_REFERENCE,
+                 namedVariables=len(frame.local_variables or []), expensive=False),
+            dict(name="Globals", variablesReference=GLOBALS_REFERENCE,
+                 namedVariables=len(frame.global_variables or []), expensive=False),
+        ])
+
+    async def on_variables(self, args):
+        from gdb_interface import HandleExpired, InvalidHandle
+        frame = await self.current_frame()
+        reference = args["variablesReference"]
+        start, count = args.get("start", 0), args.get("count")
+        if reference in (LOCALS_REFERENCE, GLOBALS_REFERENCE):
+            variables = frame.local_variables if reference == LOCALS_REFERENCE else frame.global_variables
+            variables = (variables or [])[start:start + count if count else None]
+        else:
+            handle = self.handles.get(reference)
+            if handle is None:
+                raise AdapterError(f"unknown variable reference {reference}")
+            async with locked(self.session) as server:
+                try:
+                    children = await server.cygdb.children_async(handle, start, count or DEFAULT_PAGE)
+                except (HandleExpired, InvalidHandle) as e:
+                    raise AdapterError(str(e))
+            if "error" in children:
+                raise AdapterError(children["error"])
+            variables = children["children"]
+        return dict(variables=[self.dap_variable(variable) for variable in variables])
+
+    def reset_references(self, generation):
+        self.references_generation = generation
+        self.handles = {}
+        self.references = {}
+
+    def dap_variable(self, variable):
+        resp = dict(name=variable["name"], value=str(variable.get("value")), type=variable.get("type"),
+                    variablesReference=0)
+        handle = variable.get("handle")
+        if handle is not None:
+            if handle not in self.references:
+                reference = FIRST_CHILD_REFERENCE + len(self.references)
+                self.references[handle] = reference
+                self.handles[reference] = handle
+            resp["variablesReference"] = self.references[handle]
+            children = "indexedVariables" if variable.get("type") in SEQUENCE_TYPES else "namedVariables"
+            resp[children] = variable.get("child_count") or 0
+        return resp
+
+
+async def serve_tcp(get_session, host, port, events=None):
+    async def on_client(reader, writer):
+        adapter = DebugAdapter(get_session, writer.write, events)
+        try:
+            await adapter.serve(reader)
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_client, host, port)
+
+
+async def serve_stdio(get_session, events=None):
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    out = os.fdopen(os.dup(1), "wb", buffering=0)
+    # stdout carries the protocol, everything the server prints goes to stderr
+    os.dup2(2, 1)
+    await DebugAdapter(get_session, out.write, events).serve(reader)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Debug Adapter Protocol server for Cython programs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4711)
+    parser.add_argument("--stdio", action="store_true", help="talk DAP over stdin/stdout instead of TCP")
+    args = parser.parse_args()
+
+    import Cygdb_server
+    Cygdb_server.startup.start()
+    loop = asyncio.get_event_loop()
+    if args.stdio:
+        loop.run_until_complete(serve_stdio(Cygdb_server.get_session_async, Cygdb_server.event_bus))
+        return
+    loop.run_until_complete(serve_tcp(Cygdb_server.get_session_async, args.host, args.port,
+                                      Cygdb_server.event_bus))
+    print(f"debug adapter listening on {args.host}:{args.port}")
+    loop.run_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Reader for the ``cython_debug/cython_debug_info_*`` files Cython writes with
+``gdb_debug=True``. They map every ``.pyx`` line to the C lines generated for it,
+which is enough to put breakpoints on the C code without touching the source.
+"""
+from bisect import bisect_left
+from pathlib import Path
+from xml.etree import ElementTree
+
+
+class CythonModuleInfo:
+    def __init__(self, name, filename, c_filename):
+        self.name = name
+        self.filename = filename
+        self.c_filename = c_filename
+        # {cython lineno: [c linenos]}
+        self.lines = {}
+        # {qualified name: (name, cname, first lineno)}
+        self.functions = {}
+        self.sorted_lines = []
+
+    def resolve(self, lineno):
+        """
+        The line gdb can actually stop on for ``lineno`` and its first C line. A line
+        Cython emitted no code for resolves to the nearest line it did, preferring
+        the following one on a tie. None when the module has no code at all.
+        """
+        lineno = int(lineno)
+        if lineno in self.lines:
+            return lineno, min(self.lines[lineno])
+        if not self.sorted_lines:
+            return None
+        position = bisect_left(self.sorted_lines, lineno)
+        candidates = self.sorted_lines[max(position - 1, 0):position + 1]
+        nearest = min(candidates, key=lambda candidate: (abs(candidate - lineno), -candidate))
+        return nearest, min(self.lines[nearest])
+
+    def function_lines(self, qualified_name):
+        """Every line with code from the start of the function up to the next function."""
+        start = self.functions[qualified_name][2]
+        following = [lineno for _, _, lineno in self.functions.values() if lineno > start]
+        end = min(following) if following else None
+        return [lineno for lineno in self.sorted_lines if lineno >= start and (end is None or lineno < end)]
+
+
+def parse_debug_info_file(path):
+    modules = {}
+    root = ElementTree.parse(str(path)).getroot()
+    for module in root:
+        # newer Cython writes module_name instead of name
+        name = module.get("name") or module.get("module_name")
+        info = CythonModuleInfo(name, module.get("filename"), module.get("c_filename"))
+        functions = module.find("Functions")
+        for function in (functions if functions is not None else []):
+            # skip utility code such as View.MemoryView, its line numbers are for other files
+            if not function.get("qualified_name", "").startswith(name + "."):
+                continue
+            info.functions[function.get("qualified_name")] = (
+                function.get("name"),
+                function.get("cname"),
+                int(function.get("lineno")),
+            )
+        mapping = module.find("LineNumberMapping")
+        for marker in (mapping if mapping is not None else []):
+            # older Cython writes cython_lineno, newer src_lineno + src_path
+            lineno = marker.get("cython_lineno") or marker.get("src_lineno")
+            src_path = marker.get("src_path")
+            if src_path is not None and src_path != info.filename:
+                continue
+            c_linenos = [int(c_lineno) for c_lineno in marker.get("c_linenos").split()]
+            info.lines.setdefault(int(lineno), []).extend(c_linenos)
+        info.sorted_lines = sorted(info.lines)
+        modules[info.name] = info
+    return modules
+
+
+class DebugInfo:
+    """All modules in a ``cython_debug`` folder, re-read when a debug info file changes."""
+
+    def __init__(self, debug_folder):
+        self.debug_folder = Path(debug_folder)
+        self.modules = {}
+        self._stamps = None
+
+    def files(self):
+        return sorted(self.debug_folder.glob("cython_debug_info_*"))
+
+    def stamps(self):
+        stamps = {}
+        for path in self.files():
+            stat = path.stat()
+            stamps[path.name] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def refresh(self):
+        stamps = self.stamps()
+        if stamps == self._stamps:
+            return self
+        modules = {}
+        for path in self.files():
+            modules.update(parse_debug_info_file(path))
+        self.modules = modules
+        self._stamps = stamps
+        return self
+
+    def module(self, name):
+        self.refresh()
+        return self.modules.get(name)
+
+    def trace_functions(self, specs):
+        """
+        The functions and lines ``cy trace-start`` will trace for ``specs``
+        (``module:function`` or names), in the shape of its reply, before gdb runs.
+        """
+        self.refresh()
+        payload = dict(functions=[], invalid=[])
+        for spec in specs:
+            module_name, _, name = spec.rpartition(":")
+            found = [(module, qualified_name) for module in self.modules.values() if module_name in ("", module.name)
+                     for qualified_name, function in module.functions.items() if name in (function[0], qualified_name)]
+            if not found:
+                payload["invalid"].append(spec)
+            for module, qualified_name in found:
+                payload["functions"].append(dict(module=module.name, filename=module.filename,
+                                                 function=module.functions[qualified_name][0],
+                                                 lines=module.function_lines(qualified_name)))
+        return payload
@@ -0,0 +1,100 @@
+"""
+Events pushed to clients over Server-Sent Events at ``/events``.
+
+Anything can publish, from any thread: stops, program output, build progress and
+job output. Every subscriber has its own queue on the event loop that serves it, and
+a short history lets a client that reconnects with ``Last-Event-ID`` catch up.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+# a subscriber that falls this far behind loses its oldest events
+QUEUE_SIZE = 1000
+KEEP_ALIVE_SECONDS = 15
+
+
+class Event:
+    def __init__(self, event_id, name, session_id, payload):
+        self.event_id = event_id
+        self.name = name
+        self.session_id = session_id
+        self.payload = payload
+        self.time = time.time()
+
+    def format(self):
+        data = dict(self.payload, session_id=self.session_id, time=self.time)
+        return f"id: {self.event_id}\nevent: {self.name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscription:
+    def __init__(self, loop, session_id):
+        self.loop = loop
+        self.session_id = session_id
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.dropped = 0
+
+    def wants(self, event):
+        # events without a session (pip install, ...) go to everyone
+        return event.session_id is None or event.session_id == self.session_id
+
+    def put(self, event):
+        """Runs on the subscriber's loop."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class EventBus:
+    def __init__(self, history=200):
+        self.subscriptions = set()
+        self.history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, name, session_id=None, payload=None):
+        with self._lock:
+            event = Event(next(self._ids), name, session_id, payload or {})
+            self.history.append(event)
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.put, event)
+                except RuntimeError:
+                    # the subscriber's loop is closed
+                    self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self, session_id, last_event_id=None):
+        subscription = Subscription(asyncio.get_event_loop(), session_id)
+        with self._lock:
+            self.subscriptions.add(subscription)
+            if last_event_id is not None:
+                for event in self.history:
+                    if event.event_id > last_event_id and subscription.wants(event):
+                        subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.discard(subscription)
+
+    async def stream(self, session_id, last_event_id=None):
+        """Server-Sent Events text for ``session_id`` until the client goes away."""
+        subscription = self.subscribe(session_id, last_event_id)
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event.format()
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+A stand-in for gdb that replays recorded GDB/MI transcripts, and the recorder that
+makes them.
+
+``Process`` can launch it in place of the custom gdb build, so the MI parser and
+``CygdbController`` can be measured and tested on any Linux box, without gdb,
+Python 2 or ``python3.8-dbg``:
+
+    python fake_gdb.py --transcript transcripts/demo_project.json [--delay 0.01] [--repeat 100]
+
+Every console command gets the output recorded for it: the next recording of the same
+command, the last one once they are used up, or a recording of the same ``cy``
+subcommand with other arguments. Commands that were never recorded get the error gdb
+gives for an unknown command. gdb's own arguments are accepted and ignored.
+
+Transcripts are recorded by putting the recorder between the server and the real gdb,
+e.g. with ``CYGDB_GDB`` pointing at a script that runs:
+
+    python fake_gdb.py record OUTPUT.json -- /usr/local/bin/gdb "$@"
+"""
+import argparse
+import json
+import os
+import re
+import select
+import sys
+import time
+from pathlib import Path
+
+from mi_parser import parse_cstring
+
+TRANSCRIPT_VERSION = 1
+CONSOLE_COMMAND_PATTERN = re.compile(r'^(\d*)-interpreter-exec console (".*")$')
+MI_COMMAND_PATTERN = re.compile(r"^(\d*)(-\S.*)$")
+RESULT_PATTERN = re.compile(r"^(\d*)\^(\w+)")
+TOKEN_PATTERN = re.compile(r"^\d+(?=[\^*+=])")
+# commands whose console output is a list of variables, --repeat makes them longer
+REPEATABLE_COMMANDS = ("cy locals", "cy globals")
+
+
+def parse_command(line):
+    """(token, command) of a line the server sent, or None for anything else."""
+    match = CONSOLE_COMMAND_PATTERN.match(line)
+    if match is not None:
+        return match.group(1), parse_cstring(match.group(2), 0)[0]
+    match = MI_COMMAND_PATTERN.match(line)
+    if match is not None:
+        return match.group(1), match.group(2)
+    return None
+
+
+def subcommand(command):
+    """``cy children 0x10 0 100`` -> ``cy children``"""
+    return " ".join(command.split()[:2])
+
+
+class Transcript:
+    def __init__(self, startup=None, exchanges=None):
+        self.startup = startup or []
+        self.exchanges = exchanges or []
+        self._replayed = {}
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text())
+        return cls(data["startup"], data["exchanges"])
+
+    def save(self, path):
+        data = dict(version=TRANSCRIPT_VERSION, startup=self.startup, exchanges=self.exchanges)
+        Path(path).write_text(json.dumps(data, indent=1))
+
+    def output_for(self, command):
+        """The recorded output lines for ``command``, None if it was never recorded."""
+        for matches in (lambda recorded: recorded == command,
+                        lambda recorded: subcommand(recorded) == subcommand(command)):
+            recordings = [exchange["output"] for exchange in self.exchanges if matches(exchange["command"])]
+            if recordings:
+                index = self._replayed.get(command, 0)
+                self._replayed[command] = index + 1
+                return recordings[min(index, len(recordings) - 1)]
+        return None
+
+
+class Replayer:
+    def __init__(self, transcript, delay=0.0, stop_delay=0.0, repeat=1, pad=0, out=None):
+        """
+        ``delay`` is added before every reply, ``stop_delay`` to commands that run the
+        program. ``repeat`` multiplies the variables ``cy locals``/``cy globals`` list and
+        ``pad`` adds a log record of that many bytes to every reply.
+        """
+        self.transcript = transcript
+        self.delay = delay
+        self.stop_delay = stop_delay
+        self.repeat = repeat
+        self.pad = pad
+        self.out = out if out is not None else sys.stdout
+
+    def reply_lines(self, token, command):
+        output = self.transcript.output_for(command)
+        if output is None:
+            if command.startswith("-"):
+                output = ["^done"]
+            else:
+                escaped = command.replace("\\", "\\\\").replace('"', '\\"')
+                output = [f'^error,msg="Undefined command: \\"{escaped}\\".  Try \\"help\\"."']
+        if self.repeat > 1 and subcommand(command) in REPEATABLE_COMMANDS:
+            console = [line for line in output if line.startswith("~")]
+            output = console * (self.repeat - 1) + output
+        if self.pad:
+            output = [f'&"{"." * self.pad}\\n"'] + output
+        return [f"{token}{line}" if line.startswith("^") else line for line in output]
+
+    def reply(self, token, command):
+        lines = self.reply_lines(token, command)
+        if self.delay:
+            time.sleep(self.delay)
+        stops = [i for i, line in enumerate(lines) if line.startswith("*stopped")]
+        if self.stop_delay and stops:
+            # everything up to the stop goes out first, as if the program took a while to get there
+            self.write(lines[:stops[0]])
+            time.sleep(self.stop_delay)
+            lines = lines[stops[0]:]
+        self.write(lines + ["(gdb) "])
+
+    def write(self, lines):
+        self.out.write("".join(line + "\n" for line in lines))
+        self.out.flush()
+
+    def run(self, lines):
+        self.write(self.transcript.startup + ["(gdb) "])
+        for line in lines:
+            parsed = parse_command(line.strip())
+            if parsed is None:
+                continue
+            token, command = parsed
+            if command in ("-gdb-exit", "quit"):
+                self.write([f"{token}^exit"])
+                return
+            self.reply(token, command)
+
+
+class Recorder:
+    """Splits a live gdb session into per-command exchanges the way CommandChannel does."""
+
+    def __init__(self, path):
+        self.path = path
+        self.transcript = Transcript()
+        self.pending = []
+        self._input = ""
+        self._output = ""
+        self._started = False
+
+    def feed_input(self, text):
+        self._input += text
+        *lines, self._input = self._input.split("\n")
+        for line in lines:
+            parsed = parse_command(line.strip())
+            if parsed is not None:
+                self._started = True
+                self.pending.append(dict(token=parsed[0], command=parsed[1], output=[], running=False,
+                                         stopped=False))
+
+    def feed_output(self, text):
+        self._output += text
+        *lines, self._output = self._output.split("\n")
+        for line in lines:
+            self.add_line(line.rstrip("\r"))
+
+    def add_line(self, line):
+        if line.strip() == "(gdb)":
+            # libcython prints where a resumed command stopped after *stopped, the prompt ends it
+            if self.pending and self.pending[0]["stopped"]:
+                self.finish(self.pending[0])
+            return
+        result = RESULT_PATTERN.match(line)
+        if result is not None:
+            # as in CommandChannel, a later result ends the stopped commands before it
+            while self.pending and self.pending[0]["stopped"] and self.pending[0]["token"] != result.group(1):
+                self.finish(self.pending[0])
+        if not self.pending:
+            if not self._started:
+                self.transcript.startup.append(line)
+            elif self.transcript.exchanges:
+                # late async output belongs to the command that caused it
+                self.transcript.exchanges[-1]["output"].append(line)
+            return
+        exchange = self.pending[0]
+        exchange["output"].append(TOKEN_PATTERN.sub("", line))
+        if result is not None and result.group(2) == "running":
+            exchange["running"] = True
+        elif result is not None:
+            self.finish(exchange)
+        elif line.startswith("*stopped") and exchange["running"]:
+            exchange["stopped"] = True
+
+    def finish(self, exchange):
+        self.pending.remove(exchange)
+        self.transcript.exchanges.append(dict(command=exchange["command"], output=exchange["output"]))
+        # gdb is killed rather than asked to quit, keep the file current
+        self.transcript.save(self.path)
+
+
+def record(path, cmd):
+    import pexpect
+    recorder = Recorder(path)
+    child = pexpect.spawn(cmd[0], cmd[1:], echo=False)
+    stdin, stdout = sys.stdin.fileno(), sys.stdout.buffer
+    while True:
+        ready, _, _ = select.select([stdin, child.child_fd], [], [])
+        if child.child_fd in ready:
+            try:
+                chunk = child.read_nonblocking(65536, timeout=0)
+            except pexpect.exceptions.TIMEOUT:
+                chunk = b""
+            except pexpect.exceptions.EOF:
+                break
+            stdout.write(chunk)
+            stdout.flush()
+            recorder.feed_output(chunk.decode(errors="replace"))
+        if stdin in ready:
+            data = os.read(stdin, 65536)
+            if not data:
+                break
+            child.send(data)
+            recorder.feed_input(data.decode(errors="replace"))
+    recorder.transcript.save(path)
+    child.close(force=True)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["record"]:
+        if len(argv) < 4 or argv[2] != "--":
+            sys.exit("usage: fake_gdb.py record OUTPUT -- GDB [ARGS...]")
+        record(argv[1], argv[3:])
+        return
+    parser = argparse.ArgumentParser(description="Replay a recorded gdb/MI transcript")
+    parser.add_argument("--transcript", default=os.environ.get("CYGDB_FAKE_GDB_TRANSCRIPT"))
+    parser.add_argument("--delay", type=float, default=float(os.environ.get("CYGDB_FAKE_GDB_DELAY", 0)),
+                        help="seconds before every reply")
+    parser.add_argument("--stop-delay", type=float, default=0.0,
+                        help="seconds the program 'runs' for cy run, cy cont, ...")
+    parser.add_argument("--repeat", type=int, default=1, help="multiply the variables of cy locals/globals")
+    parser.add_argument("--pad", type=int, default=0, help="add a log record of this many bytes to every reply")
+    # gdb's own arguments (--nx, -command FILE, --args ...) don't matter here
+    args, _ = parser.parse_known_args(argv)
+    if args.transcript is None:
+        sys.exit("fake_gdb.py: no --transcript given")
+    replayer = Replayer(Transcript.load(args.transcript), args.delay, args.stop_delay, args.repeat, args.pad)
+    replayer.run(sys.stdin)
+
+
+if __name__ == '__main__':
+    main()
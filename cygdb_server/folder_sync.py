@@ -0,0 +1,135 @@
+"""
+Incremental copy of the mounted project folder into the working folder.
+
+A file is copied only when its size or mtime differ from the working copy and, for
+files of the same size, their contents differ too. Files removed from the project are
+removed from the working folder, except build outputs (generated C, extension modules,
+``build/``, ``cython_debug/``, the build cache) which are kept as long as the ``.pyx``
+they were built from didn't change, and what the server itself writes there (buffer
+dumps, trace files), which is always kept.
+"""
+import os
+import shutil
+import time
+from pathlib import Path
+
+from build_cache import CACHE_FILE_NAME, file_digest
+
+BUILD_FOLDERS = ("build", "cython_debug")
+BUILD_SUFFIXES = (".c", ".cpp", ".so", ".pyd", ".html")
+# .npy files written by /Buffer, inside the session's working folder
+BUFFERS_FOLDER = "buffers"
+# trace files of cy trace-start, one per session in its working folder
+TRACES_FOLDER = "traces"
+SERVER_FOLDERS = (BUFFERS_FOLDER, TRACES_FOLDER)
+
+
+class SyncReport:
+    def __init__(self):
+        self.copied = []
+        self.deleted = []
+        self.unchanged = 0
+        self.bytes_copied = 0
+        self.hashed = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return dict(
+            files_synced=len(self.copied),
+            bytes_synced=self.bytes_copied,
+            files_deleted=len(self.deleted),
+            files_unchanged=self.unchanged,
+            files_hashed=self.hashed,
+            seconds=self.seconds
+        )
+
+
+def list_files(folder):
+    """{relative posix path: os.stat_result} of every file under ``folder``."""
+    files = {}
+    for root, dirs, names in os.walk(folder):
+        for name in names:
+            path = Path(root, name)
+            try:
+                files[path.relative_to(folder).as_posix()] = path.stat()
+            except FileNotFoundError:
+                # dangling symlink
+                continue
+    return files
+
+
+def build_source(relative_path):
+    """
+    The .pyx a build output was generated from, None if it isn't a build output, ""
+    if it is kept whatever the sources are.
+    """
+    path = Path(relative_path)
+    if path.parts[0] in BUILD_FOLDERS + SERVER_FOLDERS or path.name == CACHE_FILE_NAME:
+        return ""
+    if path.suffix not in BUILD_SUFFIXES:
+        return None
+    # demo.c, demo.cpython-38d-x86_64-linux-gnu.so
+    return path.with_name(path.name.split(".")[0] + ".pyx").as_posix()
+
+
+def same_file(source_path, source_stat, destination_stat, destination_path, report):
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    if source_stat.st_mtime_ns == destination_stat.st_mtime_ns:
+        return True
+    report.hashed += 1
+    if file_digest(source_path) != file_digest(destination_path):
+        return False
+    # same contents, take the mtime over so the next sync doesn't hash it again
+    shutil.copystat(source_path, destination_path)
+    return True
+
+
+def sync_folder(source, destination, keep_build_outputs=False):
+    """
+    Make ``destination`` a copy of ``source``, touching as little as possible. With
+    ``keep_build_outputs`` the outputs of changed sources are kept too, for callers
+    that leave it to the build cache to tell whether they are still current.
+    """
+    start = time.perf_counter()
+    source, destination = Path(source), Path(destination)
+    report = SyncReport()
+    destination.mkdir(parents=True, exist_ok=True)
+    source_files = list_files(source)
+    destination_files = list_files(destination)
+
+    changed_sources = set()
+    for relative_path, source_stat in sorted(source_files.items()):
+        source_path, destination_path = source / relative_path, destination / relative_path
+        destination_stat = destination_files.get(relative_path)
+        if destination_stat is not None and \
+                same_file(source_path, source_stat, destination_stat, destination_path, report):
+            report.unchanged += 1
+            continue
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source_path, destination_path)
+        report.copied.append(relative_path)
+        report.bytes_copied += source_stat.st_size
+        if relative_path.endswith(".pyx") and not keep_build_outputs:
+            changed_sources.add(relative_path)
+
+    for relative_path in sorted(destination_files):
+        if relative_path in source_files:
+            continue
+        pyx = build_source(relative_path)
+        if pyx == "" or (pyx is not None and pyx in source_files and pyx not in changed_sources):
+            continue
+        (destination / relative_path).unlink()
+        report.deleted.append(relative_path)
+
+    remove_empty_folders(destination, source)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def remove_empty_folders(destination, source):
+    for root, dirs, names in os.walk(destination, topdown=False):
+        path = Path(root)
+        if path != destination and not names and not any(path.iterdir()) \
+                and not (source / path.relative_to(destination)).is_dir():
+            path.rmdir()
@@ -0,0 +1,88 @@
+"""
+Frames of the latest stops, by stop generation and thread.
+
+The program can't change while it is stopped, so a frame read once for a
+generation is the answer to every later ``/Frame`` for it. Frames of a few earlier
+generations are kept too, for clients that only want what changed since the stop
+they last saw.
+"""
+import threading
+from collections import OrderedDict
+
+
+class FrameCache:
+    def __init__(self, size=16):
+        self.size = size
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, generation, thread_id=None):
+        """The frame of ``thread_id`` at ``generation``, None for the thread the program stopped in."""
+        with self._lock:
+            frame = self.frames.get((generation, thread_id))
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return frame
+
+    def put(self, generation, thread_id, frame):
+        with self._lock:
+            self.frames[(generation, thread_id)] = frame
+            self.frames.move_to_end((generation, thread_id))
+            while len(self.frames) > self.size:
+                self.frames.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.frames.clear()
+
+    def as_dict(self):
+        return dict(size=self.size, frames=len(self.frames), hits=self.hits, misses=self.misses)
+
+
+def variable_state(variable):
+    # handles are per generation, an unchanged variable gets a new one every stop
+    return variable.get("type"), variable.get("value"), variable.get("child_count"), variable.get("address")
+
+
+def variables_delta(old, new):
+    """
+    What a client holding ``old`` needs to know to have ``new``. A variable whose
+    preview was truncated counts as changed, the change may be past the cut.
+    """
+    old_states = {variable["name"]: variable_state(variable) for variable in old}
+    new_names = {variable["name"] for variable in new}
+    delta = dict(changed=[], removed=sorted(name for name in old_states if name not in new_names), handles={})
+    for variable in new:
+        if variable.get("truncated") or old_states.get(variable["name"]) != variable_state(variable):
+            delta["changed"].append(variable)
+        elif "handle" in variable:
+            delta["handles"][variable["name"]] = variable["handle"]
+    return delta
+
+
+def frame_delta(old, new):
+    """
+    ``new`` as the difference from ``old``: changed locals and globals and the names
+    of the removed ones; the trace and hit counts only when they changed.
+    """
+    delta = dict(
+        delta=True,
+        since=old.generation,
+        generation=new.generation,
+        filename=new.filename,
+        lineno=new.lineno,
+        function_name=new.function_name,
+        thread_id=new.thread_id,
+        breakpoint=new.breakpoint,
+        local_variables=variables_delta(old.local_variables or [], new.local_variables or []),
+        global_variables=variables_delta(old.global_variables or [], new.global_variables or []),
+    )
+    if new.trace != old.trace:
+        delta["trace"] = new.trace
+    if new.breakpoint_hits != old.breakpoint_hits:
+        delta["breakpoint_hits"] = new.breakpoint_hits
+    return delta
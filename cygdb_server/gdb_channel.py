@@ -0,0 +1,274 @@
+"""
+Token-correlated command channel to a gdb running with ``--interpreter=mi3``.
+
+Every command is sent as ``<token>-interpreter-exec console "<command>"`` so gdb
+tags its result record with the same token. Several commands can be in flight at
+once: gdb handles them in order, so stream output is attributed to the oldest
+command still waiting and each result is routed back to its caller by token. A
+command that resumes the program (``^running``) has no result of its own: it is done
+at the prompt after ``*stopped``, once libcython printed where it stopped.
+
+Blocking callers pump the output themselves in ``wait``, coroutines have the event
+loop read it whenever gdb's pty becomes readable (``wait_async``).
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pexpect
+
+import mi_parser as mi
+from mi_parser import MIParser, MIResponse
+
+# how long a waiting thread holds the read lock before letting others check their futures
+PUMP_SLICE = 0.1
+
+
+class CommandStats:
+    def __init__(self, command=None):
+        self.command = command
+        self.token = None
+        self.bytes_read = 0
+        self.chunks_read = 0
+        self.records_parsed = 0
+        self.wall_time = 0.0
+        self.timed_out = False
+
+    def as_dict(self):
+        return dict(
+            command=self.command,
+            token=self.token,
+            bytes_read=self.bytes_read,
+            chunks_read=self.chunks_read,
+            records_parsed=self.records_parsed,
+            wall_time=self.wall_time,
+            timed_out=self.timed_out
+        )
+
+
+class PendingCommand:
+    def __init__(self, token, command):
+        self.token = token
+        self.command = command
+        self.records = []
+        self.stats = CommandStats(command)
+        self.stats.token = token
+        self.future = Future()
+        self.sent_at = time.perf_counter()
+        self.waiting_for_stop = False
+        self.stopped = False
+        self.abandoned = False
+
+    def finish(self, timed_out=False):
+        self.stats.records_parsed = len(self.records)
+        self.stats.wall_time = time.perf_counter() - self.sent_at
+        self.stats.timed_out = timed_out
+        if not self.future.done():
+            self.future.set_result(MIResponse(self.records, self.stats))
+
+
+def quote_command(command):
+    """``command`` as an MI C string, on one line so gdb reads it as a single command."""
+    for character, escaped in (("\\", "\\\\"), ("\"", "\\\""), ("\n", "\\n"), ("\r", "\\r")):
+        command = command.replace(character, escaped)
+    return "\"" + command + "\""
+
+
+class CommandChannel:
+    chunk_size = 65536
+
+    def __init__(self, proc, parser=None):
+        self.proc = proc
+        self.parser = parser if parser is not None else MIParser()
+        self.in_flight = OrderedDict()
+        self.unclaimed = []
+        self.listeners = []
+        self.last_stats = None
+        self._next_token = 1
+        self._send_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._closed = False
+        self._async_waiters = 0
+
+    def wait_for_prompt(self, timeout):
+        """Read the startup output up to the first prompt, before any command is sent."""
+        deadline = time.perf_counter() + timeout
+        records = []
+        while time.perf_counter() < deadline and not self._closed:
+            for record in self._read_records(deadline - time.perf_counter()):
+                records.append(record)
+                if record.kind == mi.PROMPT:
+                    return MIResponse(records)
+        return MIResponse(records)
+
+    def submit(self, command):
+        """Send ``command`` without waiting, the returned future resolves to its MIResponse."""
+        with self._send_lock:
+            token = self._next_token
+            self._next_token += 1
+            pending = PendingCommand(token, command)
+            self.in_flight[token] = pending
+            if command.startswith("-"):
+                line = f"{token}{command}"
+            else:
+                line = f"{token}-interpreter-exec console {quote_command(command)}"
+            print("CMD to GDB: ", line)
+            self.proc.sendline(line)
+        return pending.future
+
+    def wait(self, futures, timeout):
+        """Drive the reader until every future is resolved or the deadline passes."""
+        deadline = time.perf_counter() + timeout
+        while not all(future.done() for future in futures):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or self._closed:
+                self._abandon(futures)
+                break
+            if self._read_lock.acquire(timeout=min(remaining, PUMP_SLICE)):
+                try:
+                    if not all(future.done() for future in futures):
+                        for record in self._read_records(min(remaining, PUMP_SLICE)):
+                            self._dispatch(record)
+                finally:
+                    self._read_lock.release()
+        return [future.result() for future in futures]
+
+    def execute(self, command, timeout):
+        return self.wait([self.submit(command)], timeout)[0]
+
+    def execute_many(self, commands, timeout):
+        """Pipeline ``commands``: all are sent before any reply is read."""
+        futures = [self.submit(command) for command in commands]
+        return self.wait(futures, timeout)
+
+    async def execute_async(self, command, timeout):
+        responses = await self.wait_async([self.submit(command)], timeout)
+        return responses[0]
+
+    async def execute_many_async(self, commands, timeout):
+        futures = [self.submit(command) for command in commands]
+        return await self.wait_async(futures, timeout)
+
+    async def wait_async(self, futures, timeout):
+        """
+        Like wait, but gdb's output is read by the event loop as it becomes readable,
+        so no thread is blocked while gdb works.
+        """
+        loop = asyncio.get_event_loop()
+        waiters = [asyncio.wrap_future(future, loop=loop) for future in futures]
+        self._start_reader(loop)
+        try:
+            await asyncio.wait(waiters, timeout=timeout)
+        finally:
+            self._stop_reader(loop)
+        if not all(future.done() for future in futures):
+            self._abandon(futures)
+        return [future.result() for future in futures]
+
+    def _start_reader(self, loop):
+        self._async_waiters += 1
+        if self._async_waiters == 1 and not self._closed:
+            loop.add_reader(self.proc.child_fd, self._on_readable, loop)
+
+    def _stop_reader(self, loop):
+        self._async_waiters -= 1
+        if self._async_waiters == 0:
+            loop.remove_reader(self.proc.child_fd)
+
+    def _on_readable(self, loop):
+        if not self._read_lock.acquire(blocking=False):
+            # a thread is in wait() and reads for us, look again once it had a go
+            loop.remove_reader(self.proc.child_fd)
+            loop.call_later(PUMP_SLICE / 10, self._resume_reader, loop)
+            return
+        try:
+            for record in self._read_records(0):
+                self._dispatch(record)
+        finally:
+            self._read_lock.release()
+        if self._closed:
+            loop.remove_reader(self.proc.child_fd)
+
+    def _resume_reader(self, loop):
+        if self._async_waiters > 0 and not self._closed:
+            loop.add_reader(self.proc.child_fd, self._on_readable, loop)
+
+    def close(self):
+        self._closed = True
+        for pending in list(self.in_flight.values()):
+            pending.finish(timed_out=True)
+        self.in_flight.clear()
+
+    def _read_records(self, timeout):
+        try:
+            chunk = self.proc.read_nonblocking(size=self.chunk_size, timeout=max(timeout, 0))
+        except pexpect.exceptions.TIMEOUT:
+            return []
+        except pexpect.exceptions.EOF:
+            print("gdb closed its output")
+            records = self.parser.flush()
+            self.close()
+            return records
+        oldest = self._oldest()
+        if oldest is not None:
+            oldest.stats.bytes_read += len(chunk)
+            oldest.stats.chunks_read += 1
+        return self.parser.feed(chunk)
+
+    def _oldest(self):
+        for pending in self.in_flight.values():
+            return pending
+        return None
+
+    def _dispatch(self, record):
+        if record.kind in mi.ASYNC_KINDS or record.kind == mi.OUTPUT:
+            for listener in self.listeners:
+                listener(record)
+        if record.kind == mi.PROMPT:
+            # libcython prints the source line of a stop after *stopped, the prompt ends it
+            oldest = self._oldest()
+            if oldest is not None and oldest.stopped:
+                self._complete(oldest)
+            return
+        pending = self.in_flight.get(record.token) if record.token is not None else None
+        if pending is None:
+            pending = self._oldest()
+        if pending is None:
+            self.unclaimed.append(record)
+            return
+        if record.kind == mi.RESULT:
+            # a later command's result means the stopped ones before it have all their output
+            for earlier in list(self.in_flight.values()):
+                if earlier is pending:
+                    break
+                if earlier.stopped:
+                    self._complete(earlier)
+        pending.records.append(record)
+        if record.kind == mi.RESULT:
+            if record.klass == "running":
+                # the command resumed the inferior, it's done once it stops again
+                pending.waiting_for_stop = True
+                return
+            self._complete(pending)
+        elif record.kind == mi.EXEC and record.klass == "stopped" and pending.waiting_for_stop:
+            pending.stopped = True
+
+    def _complete(self, pending):
+        self.in_flight.pop(pending.token, None)
+        pending.finish()
+        if not pending.abandoned:
+            self.last_stats = pending.stats
+
+    def _abandon(self, futures):
+        """
+        Resolve timed out commands with what was read so far. They stay in flight so a
+        late reply is still matched to them rather than to the next command.
+        """
+        for pending in self.in_flight.values():
+            if pending.future in futures and not pending.future.done():
+                pending.abandoned = True
+                print(f"Timed out waiting for gdb: {pending.command}")
+                pending.finish(timed_out=True)
+                self.last_stats = pending.stats
@@ -0,0 +1,766 @@
+"""
+gdb-side commands used by the Cython debug server.
+
+This file is sourced by the gdb command file written by ``make_command_file``,
+after ``Cython.Debugger.libcython`` has been loaded, so it runs inside gdb's own
+Python. The custom gdb build embeds Python 2, keep everything here Python 2 compatible.
+"""
+from __future__ import print_function
+
+import itertools
+import json
+import os
+import struct
+import time
+
+import gdb
+from Cython.Debugger import libcython, libpython
+
+MAX_REPR_LENGTH = 1024
+# variables are sent with a short repr, their contents are fetched with cy children
+PREVIEW_LENGTH = 120
+# what libpython's get_truncated_repr appends to a cut repr
+TRUNCATED_SUFFIX = "...(truncated)"
+
+
+def cython_lineno(command, frame):
+    # newer Cython versions map C lines to (source path, line) pairs
+    lineno = command.get_cython_lineno(frame)
+    if isinstance(lineno, tuple):
+        lineno = lineno[1]
+    return int(lineno)
+
+
+def source_line(filename, lineno):
+    try:
+        with open(filename) as f:
+            for i, line in enumerate(f, 1):
+                if i == lineno:
+                    return line.rstrip()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def c_lineno_for(cython_module, lineno):
+    """The first C line generated for ``lineno`` of the module, or None."""
+    if lineno in cython_module.lineno_cy2c:
+        return cython_module.lineno_cy2c[lineno]
+    return cython_module.lineno_cy2c.get((cython_module.filename, lineno))
+
+
+def python_type_name(value):
+    try:
+        return libpython.PyObjectPtr.from_pyobject_ptr(value).safe_tp_name()
+    except Exception:
+        return "Unknown"
+
+
+def python_repr(value):
+    try:
+        return libpython.PyObjectPtr.from_pyobject_ptr(value).get_truncated_repr(MAX_REPR_LENGTH)
+    except Exception:
+        return str(value)
+
+
+def truncated_repr(pyop, length):
+    """(repr of ``pyop`` cut to ``length``, whether it was cut), as get_truncated_repr."""
+    out = libpython.TruncatedStringIO(length)
+    try:
+        pyop.write_repr(out, set())
+    except libpython.StringTruncated:
+        return out.getvalue() + TRUNCATED_SUFFIX, True
+    return out.getvalue(), False
+
+
+def children_of(pyop):
+    """
+    (number of children, iterator of (name, PyObjectPtr)) for containers and objects
+    with a ``__dict__``, (None, None) for anything that can't be expanded.
+    """
+    if isinstance(pyop, (libpython.PyListObjectPtr, libpython.PyTupleObjectPtr)):
+        size = int(pyop.field('ob_size'))
+        return size, (("[%d]" % i, libpython.PyObjectPtr.from_pyobject_ptr(pyop[i])) for i in range(size))
+    if isinstance(pyop, libpython.PyDictObjectPtr):
+        return int(pyop.field('ma_used')), (
+            (key.get_truncated_repr(PREVIEW_LENGTH), value) for key, value in pyop.iteritems())
+    if isinstance(pyop, libpython.PySetObjectPtr):
+        return int(pyop.field('used')), (("{%d}" % i, key) for i, key in enumerate(pyop))
+    if isinstance(pyop, libpython.HeapTypeObjectPtr):
+        attributes = pyop.get_attr_dict()
+        if isinstance(attributes, libpython.PyDictObjectPtr):
+            return int(attributes.field('ma_used')), (
+                (str(key.proxyval(set())), value) for key, value in attributes.iteritems())
+    return None, None
+
+
+def describe_pyobject(name, pyop):
+    try:
+        child_count = children_of(pyop)[0]
+    except (RuntimeError, gdb.GdbError):
+        child_count = None
+    try:
+        preview, truncated = truncated_repr(pyop, PREVIEW_LENGTH)
+    except Exception:
+        preview, truncated = str(pyop.as_address()), False
+    return dict(
+        name=name,
+        type=pyop.safe_tp_name(),
+        value=preview,
+        # the server can't tell whether what was cut off changed
+        truncated=truncated,
+        child_count=child_count,
+        address="0x%x" % pyop.as_address()
+    )
+
+
+def describe_value(name, value):
+    """
+    Name, type and value of a variable, the same fields ``format_locals`` produces,
+    plus the object address and child count for Python objects.
+    """
+    type_name = str(value.type)
+    if libpython.pretty_printer_lookup(value) or ("Py" in type_name and "Object" in type_name):
+        try:
+            return describe_pyobject(name, libpython.PyObjectPtr.from_pyobject_ptr(value))
+        except Exception:
+            preview = python_repr(value)
+            return dict(name=name, type=python_type_name(value), value=preview,
+                        truncated=preview.endswith(TRUNCATED_SUFFIX))
+    return dict(name=name, type="cy %s" % type_name, value=str(value))
+
+
+class CySnapshot(libcython.CythonCommand):
+    """
+    Print the locals, globals and Cython backtrace of the selected frame as one
+    line of JSON, so the server needs a single round trip per stop. With a thread
+    number, the newest frame of that thread instead.
+
+        cy snapshot [THREAD]
+    """
+
+    name = 'cy snapshot'
+    command_class = gdb.COMMAND_STACK
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        selected_thread = gdb.selected_thread()
+        if not argv:
+            self.snapshot()
+            return
+        for thread in gdb.selected_inferior().threads():
+            if thread.num == int(argv[0]):
+                thread.switch()
+                try:
+                    self.snapshot()
+                finally:
+                    selected_thread.switch()
+                return
+        print(json.dumps(dict(error="No thread %s." % argv[0])))
+
+    def snapshot(self):
+        payload = dict(local_variables=[], global_variables=[], trace=[])
+        try:
+            frame = gdb.selected_frame()
+        except RuntimeError:
+            payload["error"] = "No frame is currently selected."
+            print(json.dumps(payload))
+            return
+        payload["thread_id"] = gdb.selected_thread().num
+        payload["process_id"] = gdb.selected_inferior().pid
+        if self.is_cython_function(frame):
+            cython_function = self.get_cython_function(frame)
+            payload["function_name"] = cython_function.name
+            payload["local_variables"] = self.collect_locals(cython_function)
+            payload["global_variables"] = self.collect_globals(cython_function)
+        payload["trace"] = self.collect_backtrace()
+        print(json.dumps(payload))
+
+    def collect_locals(self, cython_function):
+        if cython_function.is_initmodule_function:
+            return []
+        local_variables = []
+        for name, cyvar in sorted(cython_function.locals.items()):
+            try:
+                if not self.is_initialized(cython_function, cyvar.name):
+                    continue
+                value = gdb.parse_and_eval(cyvar.cname)
+            except (RuntimeError, gdb.GdbError):
+                continue
+            if not value.is_optimized_out:
+                local_variables.append(describe_value(cyvar.name, value))
+        return local_variables
+
+    def collect_globals(self, cython_function):
+        global_variables = []
+        seen = set()
+        try:
+            python_globals = self.get_cython_globals_dict()
+        except (RuntimeError, gdb.GdbError):
+            python_globals = {}
+        for name, value in sorted(python_globals.items()):
+            seen.add(name)
+            global_variables.append(describe_pyobject(name, value))
+        for name, cyvar in sorted(cython_function.module.globals.items()):
+            if name in seen:
+                continue
+            try:
+                value = gdb.parse_and_eval(cyvar.cname)
+            except RuntimeError:
+                continue
+            if not value.is_optimized_out:
+                global_variables.append(describe_value(cyvar.name, value))
+        return global_variables
+
+    def collect_backtrace(self):
+        """The frames ``cy bt`` prints, oldest first."""
+        selected_frame = gdb.selected_frame()
+        frame = selected_frame
+        while frame.older():
+            frame = frame.older()
+        trace = []
+        index = 0
+        while frame:
+            try:
+                relevant = self.is_relevant_function(frame)
+            except libcython.CyGDBError:
+                relevant = False
+            if relevant:
+                entry = self.describe_frame(frame, index)
+                if entry is not None:
+                    trace.append(entry)
+            index += 1
+            frame = frame.newer()
+        selected_frame.select()
+        return trace
+
+    def describe_frame(self, frame, index):
+        frame.select()
+        if self.is_cython_function(frame):
+            cython_function = self.get_cython_function(frame)
+            filename = cython_function.module.filename
+            lineno = cython_lineno(self, frame)
+            function_name = cython_function.name
+            function_cname = cython_function.cname
+        elif self.is_python_function(frame):
+            pyframe = libpython.Frame(frame).get_pyop()
+            if pyframe is None or pyframe.is_optimized_out():
+                return None
+            filename = pyframe.filename()
+            lineno = pyframe.current_line_num()
+            function_name = str(pyframe.co_name)
+            function_cname = 'PyEval_EvalFrameEx'
+        else:
+            sal = frame.find_sal()
+            if not sal or not sal.symtab:
+                return None
+            filename = sal.symtab.fullname()
+            lineno = sal.line
+            function_name = frame.name()
+            function_cname = function_name
+        try:
+            address = int(gdb.parse_and_eval(function_cname).address)
+        except (RuntimeError, TypeError, gdb.GdbError):
+            address = 0
+        entry = dict(
+            index=index,
+            filename=os.path.basename(filename),
+            lineno=str(lineno),
+            code=source_line(filename, lineno),
+            function_or_object="%s()" % function_name,
+            memory_address="0x%016x" % address,
+        )
+        if os.path.dirname(filename):
+            entry["file_parent"] = os.path.dirname(filename) + "/"
+        return entry
+
+
+class CyChildren(libcython.CythonCommand):
+    """
+    Print a page of the children of the Python object at ADDRESS as one line of JSON:
+    list items, dict entries, set members or instance attributes.
+
+        cy children ADDRESS [OFFSET [LIMIT]]
+    """
+
+    name = 'cy children'
+    command_class = gdb.COMMAND_DATA
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        address = int(argv[0], 0)
+        offset = int(argv[1]) if len(argv) > 1 else 0
+        limit = int(argv[2]) if len(argv) > 2 else 100
+        payload = dict(address="0x%x" % address, offset=offset, children=[])
+        try:
+            pointer = gdb.Value(address).cast(libpython.PyObjectPtr.get_gdb_type())
+            pyop = libpython.PyObjectPtr.from_pyobject_ptr(pointer)
+            payload["type"] = pyop.safe_tp_name()
+            child_count, children = children_of(pyop)
+        except (RuntimeError, gdb.GdbError) as e:
+            payload["error"] = str(e)
+            print(json.dumps(payload))
+            return
+        payload["child_count"] = child_count
+        if children is None:
+            payload["error"] = "%s can't be expanded" % payload["type"]
+        else:
+            for name, child in itertools.islice(children, offset, offset + limit):
+                payload["children"].append(describe_pyobject(name, child))
+        print(json.dumps(payload))
+
+
+# bytes handed to read_memory at a time by cy dump-memory
+DUMP_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def read_at(address, type_name):
+    return gdb.Value(address).cast(gdb.lookup_type(type_name).pointer()).dereference()
+
+
+def memviewslice_info(value):
+    """Layout of a Cython typed memoryview (a ``__Pyx_memviewslice`` struct)."""
+    memview = value['memview']
+    if int(memview) == 0:
+        raise ValueError("the memoryview isn't initialized")
+    view = memview.dereference()['view']
+    ndim = int(view['ndim'])
+    return dict(
+        kind="memoryview",
+        data="0x%x" % int(value['data']),
+        shape=[int(value['shape'][i]) for i in range(ndim)],
+        strides=[int(value['strides'][i]) for i in range(ndim)],
+        itemsize=int(view['itemsize']),
+        format=view['format'].string()
+    )
+
+
+def ndarray_info(address):
+    """
+    Layout of the NumPy array at ``address``. Uses the array structs from the debug
+    info of modules that cimport numpy, else the NumPy 1.x struct layout.
+    """
+    try:
+        array = read_at(address, 'PyArrayObject_fields')
+        descr = array['descr'].dereference()
+        data, ndim = int(array['data']), int(array['nd'])
+        dimensions, strides = array['dimensions'], array['strides']
+        kind, byteorder, elsize = int(descr['kind']), int(descr['byteorder']), int(descr['elsize'])
+    except RuntimeError:
+        header = gdb.lookup_type('PyObject').sizeof
+        pointer = gdb.lookup_type('void').pointer().sizeof
+        data = int(read_at(address + header, 'long'))
+        ndim = int(read_at(address + header + pointer, 'int'))
+        dimensions = read_at(int(read_at(address + header + 2 * pointer, 'long')), 'long').address
+        strides = read_at(int(read_at(address + header + 3 * pointer, 'long')), 'long').address
+        descr = int(read_at(address + header + 5 * pointer, 'long'))
+        kind = int(read_at(descr + header + pointer, 'char'))
+        byteorder = int(read_at(descr + header + pointer + 2, 'char'))
+        elsize = int(read_at(descr + header + pointer + 8, 'int'))
+    return dict(
+        kind="ndarray",
+        data="0x%x" % data,
+        shape=[int(dimensions[i]) for i in range(ndim)],
+        strides=[int(strides[i]) for i in range(ndim)],
+        itemsize=elsize,
+        dtype="%s%s%d" % (chr(byteorder & 0xff), chr(kind & 0xff), elsize)
+    )
+
+
+class CyBufferInfo(libcython.CythonCommand):
+    """
+    Print the data pointer, shape, strides and item type of a typed memoryview or
+    NumPy array as one line of JSON. NAME is a Cython variable of the selected frame,
+    a module global or a C expression.
+
+        cy buffer-info NAME
+    """
+
+    name = 'cy buffer-info'
+    command_class = gdb.COMMAND_DATA
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        name = args.strip()
+        payload = dict(name=name)
+        try:
+            payload.update(self.buffer_info(self.lookup(name)))
+        except (RuntimeError, ValueError, gdb.GdbError) as e:
+            payload["error"] = str(e)
+        print(json.dumps(payload))
+
+    def lookup(self, name):
+        frame = gdb.selected_frame()
+        if self.is_cython_function(frame):
+            cython_function = self.get_cython_function(frame)
+            for scope in (cython_function.locals, cython_function.module.globals):
+                if name in scope:
+                    return gdb.parse_and_eval(scope[name].cname)
+            python_globals = self.get_cython_globals_dict()
+            if name in python_globals:
+                return python_globals[name]._gdbval
+        return gdb.parse_and_eval(name)
+
+    def buffer_info(self, value):
+        if "memviewslice" in str(value.type.strip_typedefs()):
+            return memviewslice_info(value)
+        pointer = value.cast(libpython.PyObjectPtr.get_gdb_type())
+        type_name = libpython.PyObjectPtr.from_pyobject_ptr(pointer).safe_tp_name()
+        if type_name.split(".")[-1] != "ndarray":
+            raise ValueError("%s is neither a typed memoryview nor a NumPy array" % type_name)
+        return ndarray_info(int(pointer))
+
+
+class CyDumpMemory(libcython.CythonCommand):
+    """
+    Write LENGTH bytes of the inferior's memory starting at ADDRESS to PATH, with
+    bulk reads instead of printing values. Prints what was written as one line of JSON.
+
+        cy dump-memory ADDRESS LENGTH PATH
+    """
+
+    name = 'cy dump-memory'
+    command_class = gdb.COMMAND_DATA
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        address, length, path = gdb.string_to_argv(args)
+        address, length = int(address, 0), int(length)
+        start = time.time()
+        payload = dict(address="0x%x" % address, length=length, path=path)
+        inferior = gdb.selected_inferior()
+        try:
+            with open(path, "wb") as f:
+                for offset in range(0, length, DUMP_CHUNK_SIZE):
+                    f.write(inferior.read_memory(address + offset, min(DUMP_CHUNK_SIZE, length - offset)))
+        except (RuntimeError, IOError, OSError) as e:
+            payload["error"] = str(e)
+        payload["seconds"] = time.time() - start
+        print(json.dumps(payload))
+
+
+# {module name: set of .pyx lines} a CythonLineBreakpoint is allowed to stop on
+ACCEPTED_LINES = {}
+
+
+class CythonLineBreakpoint(gdb.Breakpoint):
+    """
+    Breakpoint on the C code of a ``.pyx`` line. gdb calls ``stop`` on every hit and
+    resumes straight away when it returns False, so stops that don't land on a
+    requested line never reach the server.
+    """
+
+    def __init__(self, command, cython_module, lineno, c_lineno):
+        gdb.Breakpoint.__init__(self, "%s:%s" % (cython_module.c_filename, c_lineno))
+        self.command = command
+        self.module_name = cython_module.name
+        self.lineno = lineno
+        self.c_lineno = c_lineno
+        self.skipped = 0
+
+    def stop(self):
+        try:
+            frame = gdb.newest_frame()
+            if self.command.is_cython_function(frame):
+                cython_function = self.command.get_cython_function(frame)
+                lineno = cython_lineno(self.command, frame)
+                if lineno in ACCEPTED_LINES.get(cython_function.module.name, ()):
+                    return True
+        except Exception:
+            # when in doubt stop, the server still checks where it ended up
+            return True
+        self.skipped += 1
+        return False
+
+
+class CyBreakFiltered(libcython.CythonCommand):
+    """
+    Set breakpoints on .pyx lines that only stop when the Cython code really is at
+    one of the requested lines. Prints what was set as one line of JSON.
+
+        cy break-filtered module:lineno...
+        cy break-filtered --clear
+    """
+
+    name = 'cy break-filtered'
+    command_class = gdb.COMMAND_BREAKPOINTS
+    completer_class = gdb.COMPLETE_NONE
+
+    breakpoints = []
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if argv == ["--clear"]:
+            self.clear()
+            print(json.dumps(dict(cleared=True)))
+            return
+        payload = dict(set=[], invalid=[])
+        for location in argv:
+            module_name, _, lineno = location.partition(":")
+            cython_module = self.cy.cython_namespace.get(module_name)
+            c_lineno = None
+            if cython_module is not None and lineno.isdigit():
+                c_lineno = c_lineno_for(cython_module, int(lineno))
+            if c_lineno is None:
+                payload["invalid"].append(location)
+                continue
+            breakpoint = CythonLineBreakpoint(self, cython_module, int(lineno), c_lineno)
+            self.breakpoints.append(breakpoint)
+            ACCEPTED_LINES.setdefault(module_name, set()).add(int(lineno))
+            payload["set"].append(dict(
+                module=module_name,
+                lineno=int(lineno),
+                c_lineno=c_lineno,
+                number=breakpoint.number
+            ))
+        print(json.dumps(payload))
+
+    def clear(self):
+        for breakpoint in self.breakpoints:
+            if breakpoint.is_valid():
+                breakpoint.delete()
+        del self.breakpoints[:]
+        ACCEPTED_LINES.clear()
+
+
+# the trace file format, keep in sync with trace_reader.py: a magic, then records that
+# start with their kind; strings (file and function names) are sent once and then
+# referred to by number
+TRACE_MAGIC = b"CYTRACE1"
+TRACE_STRING = struct.Struct("<cHH")
+TRACE_LINE = struct.Struct("<cHHIIdH")
+# flushing on every line would cost a write per hit, readers see lines this late at most
+TRACE_FLUSH_SECONDS = 0.5
+TRACE_VALUE_LENGTH = 200
+
+
+def cython_lines(cython_module):
+    """The .pyx lines of ``cython_module`` that have C code."""
+    return set(key[1] if isinstance(key, tuple) else key for key in cython_module.lineno_cy2c)
+
+
+def function_lines(cython_function):
+    """The lines of a function with C code: from its def to the next function of its module."""
+    cython_module = cython_function.module
+    end = min([function.lineno for function in cython_module.functions.values()
+               if function.lineno > cython_function.lineno] or [float("inf")])
+    return sorted(lineno for lineno in cython_lines(cython_module) if cython_function.lineno <= lineno < end)
+
+
+def trace_value(value):
+    type_name = str(value.type)
+    if libpython.pretty_printer_lookup(value) or ("Py" in type_name and "Object" in type_name):
+        try:
+            return libpython.PyObjectPtr.from_pyobject_ptr(value).get_truncated_repr(TRACE_VALUE_LENGTH)
+        except Exception:
+            pass
+    return str(value)[:TRACE_VALUE_LENGTH]
+
+
+class TraceFile(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(TRACE_MAGIC)
+        self.strings = {}
+        self.records = 0
+        self.last_flush = time.time()
+
+    def string(self, text):
+        number = self.strings.get(text)
+        if number is None:
+            number = self.strings[text] = len(self.strings)
+            data = text.encode("utf-8")
+            self.file.write(TRACE_STRING.pack(b"S", number, len(data)) + data)
+        return number
+
+    def line(self, filename, function_name, lineno, thread, timestamp, variables=None):
+        data = json.dumps(variables).encode("utf-8") if variables else b""
+        self.file.write(TRACE_LINE.pack(b"L", self.string(filename), self.string(function_name), lineno, thread,
+                                        timestamp, len(data)) + data)
+        self.records += 1
+        if timestamp - self.last_flush > TRACE_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        self.file.close()
+
+
+class TraceBreakpoint(gdb.Breakpoint):
+    """
+    Breakpoint on the C code of a traced .pyx line. ``stop`` appends a record to the
+    trace file and returns False, so the program runs on without the server hearing
+    of it.
+    """
+
+    def __init__(self, command, cython_function, lineno, c_lineno):
+        gdb.Breakpoint.__init__(self, "%s:%s" % (cython_function.module.c_filename, c_lineno), internal=True)
+        self.command = command
+        self.cython_function = cython_function
+        self.lineno = lineno
+
+    def stop(self):
+        trace = CyTraceStart.trace
+        if trace is None:
+            return False
+        try:
+            variables = None
+            if CyTraceStart.variables:
+                variables = self.collect_variables(CyTraceStart.variables)
+            trace.line(self.cython_function.module.filename, self.cython_function.name, self.lineno,
+                       gdb.selected_thread().num, time.time(), variables)
+        except Exception as e:
+            # a broken record must not stop the program, count it instead
+            CyTraceStart.errors.append(str(e))
+        return False
+
+    def collect_variables(self, names):
+        variables = {}
+        for name in names:
+            cyvar = self.cython_function.locals.get(name)
+            if cyvar is None:
+                continue
+            try:
+                value = gdb.parse_and_eval(cyvar.cname)
+            except (RuntimeError, gdb.GdbError):
+                continue
+            if not value.is_optimized_out:
+                variables[name] = trace_value(value)
+        return variables
+
+
+class CyTraceStart(libcython.CythonCommand):
+    """
+    Record every line the given Cython functions run to a binary trace file, without
+    stopping. Functions are ``module:function`` or plain function names; ``--locals``
+    adds the values of those locals to every record. Prints the traced lines as JSON.
+
+        cy trace-start PATH [--locals NAME,...] FUNCTION...
+    """
+
+    name = 'cy trace-start'
+    command_class = gdb.COMMAND_BREAKPOINTS
+    completer_class = gdb.COMPLETE_NONE
+
+    trace = None
+    variables = []
+    breakpoints = []
+    errors = []
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        variables = []
+        if "--locals" in argv:
+            index = argv.index("--locals")
+            variables = [name for name in argv[index + 1].split(",") if name]
+            del argv[index:index + 2]
+        if not argv:
+            print(json.dumps(dict(error="usage: cy trace-start PATH [--locals NAME,...] FUNCTION...")))
+            return
+        stop_trace()
+        payload = dict(path=argv[0], functions=[], invalid=[])
+        for spec in argv[1:]:
+            functions = self.find_functions(spec)
+            if not functions:
+                payload["invalid"].append(spec)
+            for cython_function in functions:
+                payload["functions"].append(self.add_function(cython_function))
+        CyTraceStart.variables = variables
+        CyTraceStart.errors = []
+        CyTraceStart.trace = TraceFile(argv[0])
+        print(json.dumps(payload))
+
+    def find_functions(self, spec):
+        module_name, _, function_name = spec.rpartition(":")
+        if module_name:
+            cython_module = self.cy.cython_namespace.get(module_name)
+            modules = [cython_module] if cython_module is not None else []
+        else:
+            modules = list(self.cy.cython_namespace.values())
+        return [function for cython_module in modules for function in cython_module.functions.values()
+                if function_name in (function.name, function.qualified_name)]
+
+    def add_function(self, cython_function):
+        lines = []
+        for lineno in function_lines(cython_function):
+            c_lineno = c_lineno_for(cython_function.module, lineno)
+            if c_lineno is None:
+                continue
+            self.breakpoints.append(TraceBreakpoint(self, cython_function, lineno, c_lineno))
+            lines.append(lineno)
+        return dict(module=cython_function.module.name, filename=cython_function.module.filename,
+                    function=cython_function.name, lines=lines)
+
+
+def stop_trace():
+    """Remove the trace breakpoints and close the trace, how many records it got."""
+    for breakpoint in CyTraceStart.breakpoints:
+        if breakpoint.is_valid():
+            breakpoint.delete()
+    del CyTraceStart.breakpoints[:]
+    trace, CyTraceStart.trace = CyTraceStart.trace, None
+    if trace is None:
+        return None
+    trace.close()
+    return dict(path=trace.path, records=trace.records, errors=CyTraceStart.errors[-10:],
+                error_count=len(CyTraceStart.errors))
+
+
+class CyTraceStop(libcython.CythonCommand):
+    """
+    Stop tracing and close the trace file. Prints the record count as JSON.
+
+        cy trace-stop
+    """
+
+    name = 'cy trace-stop'
+    command_class = gdb.COMMAND_BREAKPOINTS
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        print(json.dumps(stop_trace() or dict(error="No trace is running.")))
+
+
+class CyTraceFlush(libcython.CythonCommand):
+    """
+    Write out the records of the running trace. Prints the record count as JSON.
+
+        cy trace-flush
+    """
+
+    name = 'cy trace-flush'
+    command_class = gdb.COMMAND_BREAKPOINTS
+    completer_class = gdb.COMPLETE_NONE
+
+    def invoke(self, args, from_tty):
+        trace = CyTraceStart.trace
+        if trace is None:
+            print(json.dumps(dict(error="No trace is running.")))
+            return
+        trace.flush()
+        print(json.dumps(dict(path=trace.path, records=trace.records)))
+
+
+def flush_trace(event):
+    """Write out the running trace whenever the program stops or exits, the server reads it then."""
+    trace = CyTraceStart.trace
+    if trace is not None:
+        trace.flush()
+
+
+def register_commands():
+    for command in (CySnapshot, CyBreakFiltered, CyChildren, CyBufferInfo, CyDumpMemory, CyTraceStart,
+                    CyTraceStop, CyTraceFlush):
+        command.cy = libcython.cy
+        command.register()
+    gdb.events.stop.connect(flush_trace)
+    gdb.events.exited.connect(flush_trace)
+
+
+register_commands()
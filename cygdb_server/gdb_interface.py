@@ -1,9 +1,20 @@
 import ast
+import json
 from pathlib import Path
 
 import pexpect
 import regex as re
 
+import gdb_usage
+import metrics
+from breakpoints import Breakpoint, BreakpointRegistry
+from buffer_reader import BufferView, buffer_info_command, dump_command, dump_file, parse_gdb_json
+from frame_cache import FrameCache
+from gdb_channel import CommandChannel
+from line_index import LineIndexCache
+from metrics import PARSE_SECONDS, timed
+from trace_reader import parse_trace_reply, trace_start_command
+
 
 class Frame:
     def __init__(self, local_variables=None,
@@ -23,69 +34,73 @@ class Frame:
         self.trace = trace
         self.process_id = process_id
         self.thread_id = thread_id
+        self.breakpoint = None
+        self.breakpoint_hits = []
+        self.generation = None
+
+
+class HandleExpired(Exception):
+    pass
+
+
+class InvalidHandle(Exception):
+    pass
+
+
+# GENERATION-ADDRESS, as add_handles makes them
+HANDLE_PATTERN = re.compile(r"(\d+)-(0x[0-9a-fA-F]+)")
 
 
 class CygdbController:
     def __init__(self):
-        self.breakpoint_lines = {}
+        self.line_indexes = LineIndexCache()
         self.trace = []
         self.frame = None
-        self.breakpoints = []
+        self.breakpoints = BreakpointRegistry(self.line_indexes)
         self.current_breakpoint = 0
+        # stops the server had to continue past because they weren't on a breakpoint
+        self.bounces = 0
+        self.breakpoint_mode = "print"
+        self.debug_info = None
+        self.gdb = None
+        # bumped whenever the program runs, variable handles are only valid for one stop
+        self.generation = 0
+        self.frames = FrameCache()
+        # what the running cy trace-start reported: the traced functions and their lines
+        self.traced_functions = None
 
     def spawn_gdb(self, cmd):
         self.gdb = Process(cmd=cmd)
 
     def clear_all(self):
-        self.breakpoints = []
+        self.breakpoints.clear()
         self.current_breakpoint = 0
         self.trace = []
         self.frame = None
-        self.breakpoint_lines = {}
+        self.frames.clear()
+        self.line_indexes.clear()
 
     def exit_gdb(self):
         self.gdb.exit()
 
     def get_locals(self):
         resp = self.gdb.write("cy locals")
-        return self.format_pexpect_output(resp)
+        return resp.console_lines()
 
     def next(self):
+        self.invalidate_handles()
         resp = self.gdb.write("cy next")
-        resp = self.format_pexpect_output(resp)
-        return resp
+        return resp.console_lines()
 
     def correct_line_number(self, lineno, full_path, to_breakpoint=False):
-        full_path = Path(full_path)
-        lines = full_path.open().read().split("\n")
-        if not self.breakpoint_lines.get(full_path, False):
-            self.breakpoint_lines[full_path] = list(range(1, len(lines) + 1))
-        linenos = self.breakpoint_lines[full_path]
-        # pprint(linenos)
-        corrected_lineno = linenos.index(int(lineno))
-        print("corrected_lineno: ", corrected_lineno, full_path, lineno, to_breakpoint)
-        check = 0
-        for i in range(len(lines)):
-            if "breakpoint" not in str(linenos[i]):
-                check += 1
-            if linenos[i] == int(lineno):
-                check = str(check)
-                break
-        # return str(check)
-        print("check/old value: ", check)
-        if to_breakpoint:
-            corrected_lineno = corrected_lineno
-            # assert "breakpoint" in str(linenos[corrected_lineno]-1)
-            return str(corrected_lineno)
-        else:
-            return str(corrected_lineno)
+        return str(self.line_indexes.get(full_path).corrected(lineno))
 
     def add_print_to_file(self, filename="", lineno="", full_path=None):
         file_path = Path(full_path)
+        index = self.line_indexes.get(file_path)
         lines = file_path.open().read().split("\n")
-        lineno_corrected = self.correct_line_number(lineno, full_path)
-        lineno_int = max(int(lineno_corrected) - 1, 0)
-        code_on_line_to_break = lines[lineno_int + 1]
+        lineno_int = index.corrected(lineno)
+        code_on_line_to_break = lines[lineno_int]
         check_line = re.match(r"^\W+(\S+)", code_on_line_to_break)
         if check_line is None:
             return False
@@ -95,52 +110,340 @@ class CygdbController:
         else:
             leading_spaces = ""
         line_to_add = f"{leading_spaces}print()  # empty print to prevent Cython optimizing out this line"
-        lines.insert(lineno_int + 1, line_to_add)
-        self.breakpoint_lines[full_path].insert(lineno_int + 1, f"breakpoint-{lineno}")
-        # from pprint import pprint
-        # pprint(self.breakpoint_lines[full_path])
-        # lines_with_i = [[i + 1, line] for i, line in enumerate(lines)]
-        # pprint(lines_with_i)
+        lines.insert(lineno_int, line_to_add)
         text = "\n".join(lines)
         file_path.unlink(missing_ok=False)
         fp = file_path.open("w")
         fp.write(text)
         fp.close()
+        index.add_insertion(lineno)
+        index.refresh_stat()
         return True
 
+    def breakpoint_location(self, bp):
+        if bp.mode == "debug_info":
+            return f"{bp.filename}:{bp.resolved_lineno}"
+        return f"{bp.filename}:{self.correct_line_number(bp.lineno, bp.full_path)}"
+
     def add_breakpoints(self):
-        break_cmd = "cy break " + " ".join(
-            [f"{bp['filename']}:{self.correct_line_number(bp['lineno'], bp['full_path'])}" for bp in self.breakpoints])
-        resp = self.gdb.write(break_cmd)
-        # TODO Check the resp of adding breakpoint to verify set correctly
+        self.resolve_breakpoints()
+        locations = " ".join(
+            [self.breakpoint_location(bp) for bp in self.breakpoints if bp.mode == "print" or bp.resolved_lineno])
+        if not locations:
+            return
+        # cy break-filtered (gdb_extensions.py) resumes inside gdb when a stop isn't on a
+        # requested line, fall back to plain cy break if it isn't available
+        resp = self.gdb.write("cy break-filtered " + locations)
+        if resp.error is not None:
+            # every stop off a requested line is a bounce through the server from here on
+            print("cy break-filtered failed, falling back to cy break: ", resp.error)
+            metrics.BREAK_FILTERED_FALLBACKS.inc()
+            resp = self.gdb.write("cy break " + locations)
+            if resp.error is not None:
+                print("cy break failed: ", resp.error)
+            return
+        try:
+            invalid = json.loads(resp.stream_text()).get("invalid", [])
+        except ValueError:
+            invalid = []
+        if invalid:
+            print("cy break-filtered found no code for: ", " ".join(invalid))
+
+    def add_breakpoint(self, filename="", lineno="", full_path=""):
+        """
+        Add a breakpoint in the current breakpoint mode. In "debug_info" mode the source
+        is left alone and the line is resolved from the Cython debug info, so no rebuild
+        is needed. Returns False for lines that can't take a breakpoint.
+        """
+        if self.breakpoint_mode != "debug_info":
+            return self.add_prints_to_file(filename, lineno, full_path)
+        if len(str(filename)) == 0 or len(str(lineno)) == 0:
+            return False
+        bp = self.breakpoints.add(Breakpoint(
+            filename=Path(filename).stem,
+            lineno=lineno,
+            full_path=full_path,
+            mode="debug_info"
+        ))
+        return self.resolve_breakpoint(bp) is not False
+
+    def resolve_breakpoint(self, bp):
+        """
+        Resolved line for a debug info breakpoint, None while there is no debug info
+        yet (nothing compiled) and False if the module has no code for it.
+        """
+        module = self.debug_info.module(bp.filename) if self.debug_info is not None else None
+        if module is None:
+            return None if self.debug_info is None or not self.debug_info.files() else False
+        resolved = module.resolve(bp.lineno)
+        if resolved is None:
+            return False
+        bp.resolved_lineno = resolved[0]
+        self.breakpoints.invalidate()
+        return bp.resolved_lineno
+
+    def resolve_breakpoints(self):
+        for bp in self.breakpoints:
+            if bp.mode == "debug_info":
+                self.resolve_breakpoint(bp)
+
+    def replace_breakpoints(self, filename, linenos, full_path):
+        """
+        Swap the breakpoints of ``filename`` for ``linenos``. With a live gdb the new set
+        is applied straight away, without restarting or recompiling.
+        """
+        self.breakpoints.remove(filename)
+        valid = [lineno for lineno in linenos if self.add_breakpoint(filename, lineno, full_path)]
+        if self.gdb is not None:
+            self.gdb.write("cy break-filtered --clear")
+            self.add_breakpoints()
+        return valid
+
+    def reinject_prints(self):
+        """Put the breakpoint prints back into sources that were replaced, e.g. by a sync."""
+        reinjected = []
+        for bp in self.breakpoints:
+            if bp.mode != "print" or int(bp.lineno) in self.line_indexes.get(bp.full_path).insertions:
+                continue
+            try:
+                if self.add_print_to_file(bp.filename, bp.lineno, Path(bp.full_path)):
+                    reinjected.append(bp)
+            except ValueError as e:
+                # the line is gone from the new source
+                print(e)
+        self.breakpoints.invalidate()
+        return reinjected
+
+    def kill_inferior(self):
+        resp = self.gdb.write("kill")
+        return resp.console_lines()
+
+    def rerun(self, reimport=()):
+        """
+        Run the program again in the same gdb, keeping its symbols and breakpoints.
+        ``reimport`` are debug info files rebuilt since gdb loaded them, their C line
+        numbers moved so the breakpoints are set again as well.
+        """
+        if reimport:
+            self.gdb.write_many([f"cy import {path}" for path in reimport])
+            self.gdb.write_many(["cy break-filtered --clear", "delete"])
+            self.add_breakpoints()
+        self.trace = []
+        self.frame = None
+        self.current_breakpoint = 0
+        return self.run()
 
     def add_prints_to_file(self, filename="", lineno="", full_path=""):
         lineno = str(lineno)
-        stem = Path(filename).stem
         if len(filename) > 0 and len(lineno) > 0:
             valid_line = self.add_print_to_file(filename, lineno, Path(full_path))
             if not valid_line:
                 return valid_line
-            self.breakpoints.append(dict(
+            self.breakpoints.add(Breakpoint(
                 type="file",
                 filename=Path(filename).stem,
                 lineno=lineno,
                 full_path=full_path
             ))
-            lineno = self.correct_line_number(lineno, full_path)
         else:
             return False
         return True
 
-    def get_frame(self):
+    def get_frame(self, thread_id=None):
+        """
+        The frame of ``thread_id`` at the current stop, or of the thread the program
+        stopped in. Read from gdb once per stop, then from the cache.
+        """
+        frame = self.frames.get(self.generation, thread_id)
+        if frame is not None:
+            return frame
+        snapshot = self.snapshot(thread_id)
+        if snapshot is None:
+            frame = self.get_frame_from_commands()
+        else:
+            frame = self.frame_from_snapshot(snapshot)
+        return self.cache_frame(frame, thread_id)
+
+    async def get_frame_async(self, thread_id=None):
+        frame = self.frames.get(self.generation, thread_id)
+        if frame is not None:
+            return frame
+        snapshot = self.parse_snapshot(await self.gdb.write_async(self.snapshot_command(thread_id)))
+        if snapshot is None:
+            responses = await self.gdb.write_many_async(["cy locals", "cy bt", "cy globals"])
+            frame = self.frame_from_responses(*responses)
+        else:
+            frame = self.frame_from_snapshot(snapshot)
+        return self.cache_frame(frame, thread_id)
+
+    def cache_frame(self, frame, thread_id):
+        frame.generation = self.generation
+        self.add_user_lines(frame.trace or [])
+        self.frames.put(self.generation, thread_id, frame)
+        if thread_id is None:
+            self.frame = frame
+        return frame
+
+    def frame_from_snapshot(self, snapshot):
+        frame = Frame(function_name=snapshot.get("function_name"),
+                      process_id=snapshot.get("process_id"),
+                      thread_id=snapshot.get("thread_id"))
+        frame.local_variables = self.add_handles(snapshot["local_variables"])
+        frame.global_variables = self.add_handles(snapshot["global_variables"])
+        frame.trace = snapshot["trace"]
+        if frame.trace:
+            frame.filename = frame.trace[-1]["filename"]
+            frame.lineno = frame.trace[-1]["lineno"]
+        return frame
+
+    def add_user_lines(self, trace):
+        """
+        In print mode gdb reports lines of the source with the prints injected, give
+        every frame in such a file the line it has in the user's source too.
+        """
+        if self.breakpoint_mode != "print":
+            return
+        for entry in trace:
+            index = self.line_indexes.find(entry.get("filename"))
+            if index is not None and str(entry.get("lineno", "")).isdigit():
+                entry["user_lineno"] = str(index.user_lineno(entry["lineno"]))
+
+    def user_trace_line(self):
+        """
+        In print mode, ``user_line(filename, lineno)`` for trace_reader: the user's line
+        of a line gdb traced, None for an injected print. None in other modes.
+        """
+        if self.breakpoint_mode != "print":
+            return None
+        # /Trace reads without the session lock, don't iterate the cache while it changes
+        indexes = {path.name: index for path, index in list(self.line_indexes.indexes.items())}
+
+        def user_line(filename, lineno):
+            index = indexes.get(Path(filename).name)
+            if index is None:
+                return lineno
+            if index.is_injected(lineno):
+                return None
+            return index.user_lineno(lineno)
+        return user_line
+
+    def invalidate_handles(self):
+        self.generation += 1
+
+    def add_handles(self, variables):
+        """Give every expandable variable a handle for ``children``, valid until the program resumes."""
+        for variable in variables:
+            if variable.get("child_count") is not None and variable.get("address"):
+                variable["handle"] = f"{self.generation}-{variable['address']}"
+        return variables
+
+    def handle_address(self, handle):
+        match = HANDLE_PATTERN.fullmatch(handle)
+        if match is None:
+            raise InvalidHandle(f"invalid variable handle {handle!r}")
+        generation, address = match.groups()
+        if generation != str(self.generation):
+            raise HandleExpired(f"variable handle {handle} is from an earlier stop")
+        return address
+
+    def children(self, handle, offset=0, limit=100):
+        address = self.handle_address(handle)
+        return self.parse_children(self.gdb.write(f"cy children {address} {int(offset)} {int(limit)}"))
+
+    async def children_async(self, handle, offset=0, limit=100):
+        address = self.handle_address(handle)
+        return self.parse_children(await self.gdb.write_async(f"cy children {address} {int(offset)} {int(limit)}"))
+
+    def parse_children(self, resp):
+        if resp.error is not None:
+            return dict(error=resp.error, children=[])
+        children = json.loads(resp.stream_text())
+        self.add_handles(children["children"])
+        return children
+
+    def read_buffer(self, name, spec=None):
+        """
+        The typed memoryview or NumPy array ``name`` sliced by ``spec`` as a
+        (BufferView, bytes) pair. Two round trips however large the buffer is.
+        """
+        command = buffer_info_command(name)
+        view = BufferView.from_info(parse_gdb_json(self.gdb.write(command), command)).sliced(spec)
+        with dump_file() as path:
+            command = dump_command(view, path)
+            parse_gdb_json(self.gdb.write(command), command)
+            return view.rebased(view.extent()[0]), Path(path).read_bytes()
+
+    async def read_buffer_async(self, name, spec=None):
+        command = buffer_info_command(name)
+        view = BufferView.from_info(parse_gdb_json(await self.gdb.write_async(command), command)).sliced(spec)
+        with dump_file() as path:
+            command = dump_command(view, path)
+            parse_gdb_json(await self.gdb.write_async(command), command)
+            return view.rebased(view.extent()[0]), Path(path).read_bytes()
+
+    def start_trace(self, path, functions, variables=()):
+        """
+        Record every line of ``functions`` to ``path`` inside gdb without stopping, see
+        trace_reader.py. Returns the functions and lines traced and the specs not found.
+        """
+        command = trace_start_command(path, functions, variables)
+        payload = parse_trace_reply(self.gdb.write(command), command)
+        self.traced_functions = payload["functions"]
+        return payload
+
+    async def start_trace_async(self, path, functions, variables=()):
+        command = trace_start_command(path, functions, variables)
+        payload = parse_trace_reply(await self.gdb.write_async(command), command)
+        self.traced_functions = payload["functions"]
+        return payload
+
+    async def flush_trace_async(self):
+        """Write out the records of the running trace, the record count."""
+        return parse_trace_reply(await self.gdb.write_async("cy trace-flush"), "cy trace-flush")
+
+    async def stop_trace_async(self):
+        """Remove the trace breakpoints and close the file, the record count."""
+        return parse_trace_reply(await self.gdb.write_async("cy trace-stop"), "cy trace-stop")
+
+    def snapshot(self, thread_id=None):
+        """
+        Locals, globals, backtrace and Python types in one round trip, from the
+        ``cy snapshot`` command in gdb_extensions.py. None if gdb couldn't provide it.
+        """
+        return self.parse_snapshot(self.gdb.write(self.snapshot_command(thread_id)))
+
+    @staticmethod
+    def snapshot_command(thread_id=None):
+        return "cy snapshot" if thread_id is None else f"cy snapshot {int(thread_id)}"
+
+    @staticmethod
+    @timed(PARSE_SECONDS, stage="parse_snapshot")
+    def parse_snapshot(resp):
+        if resp.error is not None:
+            print("cy snapshot failed: ", resp.error)
+            return None
+        try:
+            snapshot = json.loads(resp.stream_text())
+        except ValueError as e:
+            print(e)
+            return None
+        if "error" in snapshot:
+            print("cy snapshot failed: ", snapshot["error"])
+            return None
+        return snapshot
+
+    def get_frame_from_commands(self):
+        return self.frame_from_responses(*self.gdb.write_many(["cy locals", "cy bt", "cy globals"]))
+
+    def frame_from_responses(self, locals_resp, bt_resp, globals_resp):
         frame = Frame()
-        frame.local_variables = self.format_locals(self.get_locals())
-        frame.trace = self.backtrace()
-        frame.global_variables = self.format_globals(self.get_globals())
-        self.frame = frame
-        return self.frame
+        frame.local_variables = self.format_locals(locals_resp.console_lines())
+        frame.trace = self.format_backtrace(bt_resp.console_lines())
+        frame.global_variables = self.format_globals(self.strip_globals_headings(globals_resp.console_lines()))
+        return frame
 
     @staticmethod
+    @timed(PARSE_SECONDS, stage="format_backtrace")
     def format_backtrace(resp):
         backtrace_stack = []
         trace_line_pattern = r"^(?:\W+)?(\w+)\W+(.*) in (.*) at (.*\/)?(.*):(\w+)(\W+(\w+)\W+(.*))?"
@@ -166,24 +469,22 @@ class CygdbController:
         return backtrace_stack
 
     def step(self):
+        self.invalidate_handles()
         resp = self.gdb.write("cy step")
-        resp = self.format_pexpect_output(resp)
-        return resp
+        return resp.console_lines()
 
     def backtrace(self):
         resp = self.gdb.write(f"cy bt")
-        resp = self.format_pexpect_output(resp)
-        resp = self.format_backtrace(resp)
-        return resp
+        return self.format_backtrace(resp.console_lines())
 
     def get_list(self):
         resp = self.gdb.write(f"cy list")
-        return self.format_pexpect_output(resp)
+        return resp.console_lines()
 
     def exec(self, cmd):
         resp = self.gdb.write(f"cy exec {cmd}")
-        resp = self.format_pexpect_output(resp)
-        return resp
+        # the executed code runs in the inferior, so what it prints is program output
+        return resp.console_lines() + resp.output_lines()
 
     def determine_python_type(self, name, value=None):
         var_type = "Unknown"
@@ -191,9 +492,11 @@ class CygdbController:
             class_pattern = r"^\<\w+ \'(.*)\'\>"
             resp = self.exec(f"type({name})")
             # assert len(resp) == 1
-            match = False
-            if len(resp) > 0:
-                match = re.match(class_pattern, resp[0])
+            match = None
+            for line in resp:
+                match = re.match(class_pattern, line)
+                if match:
+                    break
             if match:
                 var_type = f"{match.group(1)}"
             else:
@@ -215,58 +518,95 @@ class CygdbController:
                 raise Exception("Cannot read backtrace, something wrong with Gdb")
             else:
                 for trace in reversed(traces):
-                    for bp in self.breakpoints:
-                        file = bp["filename"]
-                        if trace["filename"] != file:
-                            continue
-                        correct_lineno = self.correct_line_number(bp['lineno'], bp['full_path'])
-                        if correct_lineno == trace["lineno"]:
-                            return
+                    bp = self.breakpoints.lookup(trace["filename"], trace["lineno"])
+                    if bp is not None:
+                        self.breakpoints.record_hit(bp)
+                        return
+                self.bounces += 1
+                metrics.BREAKPOINT_BOUNCES.inc()
                 self.gdb.write("cy cont")
 
     def check_correct_breakpoint(self, resp):
         iterations = 0
         while True and iterations < 50:
             iterations += 1
-            resp = self.format_pexpect_output(resp)
-            if len(resp) == 0:
-                raise Exception("Response from Gdb is blank")
-            elif resp[0] == "":
-                raise Exception("Response from Gdb is blank")
-
-            lineno = resp[0].split()[0]
-            for bp in self.breakpoints:
-                correct_lineno = self.correct_line_number(bp["lineno"], bp["full_path"])
-                if correct_lineno == lineno:
-                    return
+            if self.on_breakpoint(resp):
+                return
+            self.bounces += 1
+            metrics.BREAKPOINT_BOUNCES.inc()
             resp = self.gdb.write("cy cont")
 
+    async def check_correct_breakpoint_async(self, resp):
+        iterations = 0
+        while True and iterations < 50:
+            iterations += 1
+            if self.on_breakpoint(resp):
+                return
+            self.bounces += 1
+            metrics.BREAKPOINT_BOUNCES.inc()
+            resp = await self.gdb.write_async("cy cont")
+
+    def on_breakpoint(self, resp):
+        lines = resp.console_lines()
+        if len(lines) == 0:
+            raise Exception("Response from Gdb is blank")
+        lineno = lines[0].split()[0]
+        return bool(self.breakpoints.lookup_line(lineno))
+
+    def record_stop(self):
+        """Count the hit on the breakpoint at the innermost frame of the current stop."""
+        self.frame.breakpoint = None
+        for trace in reversed(self.frame.trace or []):
+            bp = self.breakpoints.lookup(trace["filename"], trace["lineno"])
+            if bp is not None:
+                self.breakpoints.record_hit(bp)
+                self.frame.breakpoint = bp.as_dict()
+                break
+        self.frame.breakpoint_hits = self.breakpoints.hits()
+
     def cont(self):
+        self.invalidate_handles()
         resp = self.gdb.write("cy cont")
         self.check_correct_breakpoint(resp)
         self.get_frame()
+        self.record_stop()
         print("trace", self.frame.trace)
         return self.frame.trace
 
     def run(self):
+        self.invalidate_handles()
         resp = self.gdb.write(f"cy run")
         self.check_correct_breakpoint(resp)
         self.get_frame()
+        self.record_stop()
         return self.frame.trace
 
-    @staticmethod
-    def format_pexpect_output(responses):
-        relevant_responses = []
-        for resp in responses:
-            if resp == "":
-                continue
-            if resp[0] == "~":
-                resp = resp.replace("~\"", "").replace("\\n\"", "")
-                relevant_responses.append(resp)
-            elif resp[0] == "<":
-                relevant_responses.append(resp)
-        return relevant_responses
+    async def cont_async(self):
+        return await self.resume_async("cy cont")
+
+    async def run_async(self):
+        return await self.resume_async("cy run")
+
+    async def resume_async(self, command):
+        """cont/run without blocking the event loop while the program runs."""
+        self.invalidate_handles()
+        resp = await self.gdb.write_async(command)
+        await self.check_correct_breakpoint_async(resp)
+        await self.get_frame_async()
+        self.record_stop()
+        return self.frame.trace
 
+    async def next_async(self):
+        return await self.step_async("cy next")
+
+    async def step_async(self, command="cy step"):
+        """Move to the next line (``cy next``) or into it (``cy step``), breakpoints don't matter."""
+        self.invalidate_handles()
+        await self.gdb.write_async(command)
+        await self.get_frame_async()
+        return self.frame.trace
+
+    @timed(PARSE_SECONDS, stage="format_locals")
     def format_locals(self, variable_list):
         new_variable_list = []
         for var in variable_list:
@@ -301,7 +641,10 @@ class CygdbController:
 
     def get_globals(self):
         resp = self.gdb.write("cy globals")
-        resp = self.format_pexpect_output(resp)
+        return self.strip_globals_headings(resp.console_lines())
+
+    @staticmethod
+    def strip_globals_headings(resp):
         try:
             resp.remove('Python globals:')
             resp.remove('C globals:')
@@ -309,6 +652,7 @@ class CygdbController:
             pass
         return resp
 
+    @timed(PARSE_SECONDS, stage="format_globals")
     def format_globals(self, global_list):
         new_global_list = []
         for var in global_list:
@@ -337,75 +681,106 @@ class CygdbController:
 
     def command(self, cmd):
         resp = self.gdb.write(cmd)
-        return self.format_pexpect_output(resp)
+        return resp.console_lines()
+
+
+# Per-command deadlines in seconds, commands that run the inferior can take a while
+# to reach the next stop. Anything not listed uses Process.default_timeout.
+COMMAND_TIMEOUTS = {
+    "cy run": 120,
+    "cy cont": 120,
+    "cy next": 60,
+    "cy step": 60,
+}
 
 
 class Process:
+    chunk_size = 65536
+    default_timeout = 30
+    startup_timeout = 120
+
     def __init__(self, cmd):
         if type(cmd) == list:
             cmd = " ".join(cmd)
         self.cmd = cmd
+        self.last_stats = None
         self.start_process(cmd)
 
     def start_process(self, cmd):
-        self.proc = pexpect.spawn(cmd)
-        self.write()
+        # without echo the commands we send never come back mixed into the output
+        self.proc = pexpect.spawn(cmd, echo=False)
+        # pexpect sleeps 50ms before every send by default, which made up most of a round trip
+        self.proc.delaybeforesend = None
+        self.channel = CommandChannel(self.proc)
+        self.startup_response = self.channel.wait_for_prompt(self.startup_timeout)
 
     def exit(self):
+        self.channel.close()
         self.proc.close(force=True)
 
     def start_new_process(self):
         self.exit()
         self.start_process(self.cmd)
 
-    def write(self, command=None, first=False):
-        if command:
-            print("CMD to GDB: ", command)
-            self.proc.sendline(command)
-        resp = b""
-        while True:
-            try:
-                letter = self.proc.read_nonblocking(size=1, timeout=5)
-            except pexpect.exceptions.TIMEOUT as e:
-                print(e)
-                break
-            resp += letter
-            if b"(gdb) \r\n" in resp[-8:]:
-                if first:
-                    first = False
-                    continue
-                break
-        resp = resp.decode()
-        resp = resp.replace("\\e", "").replace("[94m", "").replace("[39;49;00m", "").replace(
-            "[96m", "").replace("[92m", "").replace("[33m", "").replace("[90m", "").strip("\\n")
-        return_count = resp.count("\r\n")
-        new_line_count = resp.count("\\n")
-        # print(resp)
-        if return_count > new_line_count:
-            resp = resp.split("\r\n")
-        else:
-            resp = resp.split("\\n")
+    def command_timeout(self, command):
+        for prefix, timeout in COMMAND_TIMEOUTS.items():
+            if command.startswith(prefix):
+                return timeout
+        return self.default_timeout
+
+    def write(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.command_timeout(command)
+        resp = self.channel.execute(command, timeout)
+        self.report(resp)
+        gdb_usage.record([resp])
+        return resp
+
+    def write_many(self, commands, timeout=None):
+        """Send all ``commands`` at once and wait for every reply, in order."""
+        if timeout is None:
+            timeout = max(self.command_timeout(command) for command in commands)
+        responses = self.channel.execute_many(commands, timeout)
+        for resp in responses:
+            self.report(resp)
+        gdb_usage.record(responses)
+        return responses
+
+    async def write_async(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.command_timeout(command)
+        resp = await self.channel.execute_async(command, timeout)
+        self.report(resp)
+        gdb_usage.record([resp])
         return resp
 
+    async def write_many_async(self, commands, timeout=None):
+        if timeout is None:
+            timeout = max(self.command_timeout(command) for command in commands)
+        responses = await self.channel.execute_many_async(commands, timeout)
+        for resp in responses:
+            self.report(resp)
+        gdb_usage.record(responses)
+        return responses
+
+    def report(self, resp):
+        stats = resp.stats
+        self.last_stats = stats
+        metrics.observe_command(stats)
+        print(f"gdb replied to {stats.command!r} in {stats.wall_time:.3f}s "
+              f"({stats.bytes_read} bytes, {stats.chunks_read} chunks)")
+
 
 if __name__ == '__main__':
     cmd = "/usr/local/bin/gdb --nx --quiet --interpreter=mi3 -command working_folder2/cython_debug/gdb_configuration_file --args /usr/bin/python3.8-dbg working_folder2/main.py"
 
     proc = Process(cmd)
-    resp = proc.write("cy break demo:16")
-    assert len(resp) > 7
-    resp2 = proc.write("cy break demo:18")
-    assert len(resp) > 7
-    resp3 = proc.write("cy break demo:20")
-    assert len(resp) > 7
-    resp4 = proc.write("cy break demo:22")
-    assert len(resp) > 7
-    resp5 = proc.write("cy run")
-    assert len(resp) > 7
-    resp6 = proc.write("cy cont")
-    assert len(resp) > 7
-    resp7 = proc.write("cy cont")
-    assert len(resp) > 7
-    resp8 = proc.write("cy cont")
-    assert len(resp) > 7
-    p = 0
+    for lineno in (16, 18, 20, 22):
+        resp = proc.write(f"cy break demo:{lineno}")
+        assert resp.error is None, resp.error
+    for command in ("cy run", "cy cont", "cy cont", "cy cont"):
+        resp = proc.write(command)
+        assert resp.error is None and not resp.stats.timed_out, resp.error
+        # the first console line of a stop is the source line it stopped on
+        print(command, resp.console_lines()[:1])
+    proc.exit()
@@ -0,0 +1,121 @@
+"""
+gdb processes started ahead of ``/Launch``.
+
+Starting gdb means loading libcython/libpython, reading the debug interpreter's
+symbols and ``cy import``-ing every debug info file. The pool does that in the
+background for the command the next launch will use, keyed by the command and the
+state of the files it loads, so a launch only has to set breakpoints and run.
+"""
+import atexit
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+def fingerprint(cmd, paths):
+    """Hash of ``cmd`` and the size/mtime of every file gdb loads on startup."""
+    digest = hashlib.sha256(" ".join(cmd).encode() if type(cmd) == list else cmd.encode())
+    for path in sorted(Path(path).as_posix() for path in paths):
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+        except FileNotFoundError:
+            digest.update(f"{path}:missing".encode())
+    return digest.hexdigest()
+
+
+class GdbPool:
+    def __init__(self, size=1):
+        self.size = size
+        self.cmd = None
+        self.key = None
+        self.idle = []
+        self.stats = dict(hits=0, misses=0, spawned=0, discarded=0)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._filling = False
+        atexit.register(self.close)
+
+    def prepare(self, cmd, key):
+        """Keep ``size`` processes ready for ``cmd``, dropping ones started for anything else."""
+        with self._lock:
+            if key != self.key:
+                self._discard(self.idle)
+                self.idle = []
+            self.cmd, self.key = cmd, key
+        self.refill()
+
+    def acquire(self, cmd, key, timeout=None):
+        """
+        A started gdb for ``cmd``, or None when there isn't one. A gdb that is already
+        starting for it is waited for, it will be ready sooner than a new one.
+        """
+        with self._lock:
+            process = None
+            while key == self.key and process is None:
+                if not self.idle:
+                    if not self._filling or not self._changed.wait(timeout):
+                        break
+                    continue
+                candidate = self.idle.pop(0)
+                if candidate.proc.isalive():
+                    process = candidate
+                else:
+                    self._discard([candidate])
+            self.stats["hits" if process is not None else "misses"] += 1
+        self.prepare(cmd, key)
+        return process
+
+    def invalidate(self):
+        """Forget every idle process, e.g. after a rebuild changed the debug info."""
+        with self._lock:
+            self._discard(self.idle)
+            self.idle = []
+            self.key = None
+
+    def refill(self):
+        with self._lock:
+            if self._filling or self.key is None or self.size <= 0:
+                return
+            self._filling = True
+        threading.Thread(target=self._fill, name="gdb-pool", daemon=True).start()
+
+    def _fill(self):
+        try:
+            from gdb_interface import Process
+            while True:
+                with self._lock:
+                    if self.key is None or len(self.idle) >= self.size:
+                        return
+                    cmd, key = self.cmd, self.key
+                try:
+                    process = Process(cmd=cmd)
+                except Exception as e:
+                    print(f"gdb pool: failed to start {cmd!r}: {e!r}")
+                    return
+                with self._lock:
+                    self.stats["spawned"] += 1
+                    if key == self.key:
+                        self.idle.append(process)
+                        self._changed.notify_all()
+                        continue
+                    self._discard([process])
+        finally:
+            with self._lock:
+                self._filling = False
+                self._changed.notify_all()
+
+    def _discard(self, processes):
+        for process in processes:
+            self.stats["discarded"] += 1
+            try:
+                process.exit()
+            except Exception as e:
+                print(f"gdb pool: failed to stop a gdb: {e!r}")
+
+    def close(self):
+        self.invalidate()
+
+    def as_dict(self):
+        return dict(size=self.size, idle=len(self.idle), **self.stats)
@@ -0,0 +1,51 @@
+"""
+gdb work done on behalf of the current request.
+
+The HTTP middleware starts a ``GdbUsage`` for every request and every ``Process``
+write adds to it, so responses can report how many round trips to gdb they took
+and how much output was parsed for them. The usage travels in a context variable,
+which follows the request into the coroutines and threadpool calls serving it.
+"""
+import contextvars
+
+
+class GdbUsage:
+    def __init__(self):
+        self.round_trips = 0
+        self.commands = 0
+        self.bytes_read = 0
+        self.records_parsed = 0
+        self.seconds = 0.0
+
+    def add(self, responses):
+        """One round trip that got ``responses``, one per command sent."""
+        self.round_trips += 1
+        self.commands += len(responses)
+        for resp in responses:
+            self.bytes_read += resp.stats.bytes_read
+            self.records_parsed += resp.stats.records_parsed
+        # pipelined commands share the wait, the slowest one is the round trip's time
+        self.seconds += max((resp.stats.wall_time for resp in responses), default=0.0)
+
+    def headers(self):
+        return {
+            "X-Gdb-Round-Trips": str(self.round_trips),
+            "X-Gdb-Commands": str(self.commands),
+            "X-Gdb-Bytes-Read": str(self.bytes_read),
+            "X-Gdb-Seconds": f"{self.seconds:.6f}",
+        }
+
+
+current_usage = contextvars.ContextVar("gdb_usage", default=None)
+
+
+def start():
+    usage = GdbUsage()
+    current_usage.set(usage)
+    return usage
+
+
+def record(responses):
+    usage = current_usage.get()
+    if usage is not None:
+        usage.add(responses)
@@ -0,0 +1,143 @@
+"""
+Long running server work (compiling, pip install) as background jobs.
+
+A job runs on its own thread and can be polled by id while it runs. The processes
+it starts are attached to it, so cancelling a job stops them too. State changes,
+output lines and progress events are also passed to the runner's ``notify``.
+"""
+import os
+import signal
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, kind, session_id=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.session_id = session_id
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.output = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.processes = []
+        self.future = Future()
+        self.notify = None
+        self._lock = threading.Lock()
+
+    def attach(self, proc):
+        """Stop ``proc`` when the job is cancelled."""
+        with self._lock:
+            self.processes.append(proc)
+            if self.cancelled:
+                stop_process(proc)
+
+    def log(self, line):
+        self.output.append(line)
+        self.event("job-output", dict(line=line))
+
+    def event(self, name, payload=None):
+        if self.notify is not None:
+            self.notify(self, name, dict(payload or {}, job_id=self.job_id, kind=self.kind))
+
+    def cancel(self):
+        with self._lock:
+            if self.state in (FINISHED, FAILED, CANCELLED):
+                return False
+            self.cancelled = True
+            for proc in self.processes:
+                stop_process(proc)
+        return True
+
+    def as_dict(self, include_output=False):
+        resp = dict(
+            job_id=self.job_id,
+            kind=self.kind,
+            session_id=self.session_id,
+            state=self.state,
+            created=self.created,
+            seconds=None if self.started is None else (self.finished or time.time()) - self.started,
+            error=self.error,
+            result=self.result
+        )
+        if include_output:
+            resp["output"] = "".join(self.output)
+        return resp
+
+
+def stop_process(proc):
+    if proc.poll() is not None:
+        return
+    try:
+        # processes are started in their own session, take their children down too
+        os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        proc.terminate()
+
+
+class JobRunner:
+    def __init__(self, max_workers=4, keep=100, notify=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.keep = keep
+        self.notify = notify
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, function, session_id=None):
+        """Run ``function(job)`` in the background, its return value becomes the result."""
+        job = Job(kind, session_id)
+        job.notify = self.notify
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._prune()
+        self.executor.submit(self._run, job, function)
+        return job
+
+    def _run(self, job, function):
+        job.started = time.time()
+        if job.cancelled:
+            job.state = CANCELLED
+            job.finished = job.started
+            job.event("job", dict(state=job.state))
+            job.future.set_result(job)
+            return
+        job.state = RUNNING
+        job.event("job", dict(state=job.state))
+        try:
+            job.result = function(job)
+            job.state = CANCELLED if job.cancelled else FINISHED
+        except Exception as e:
+            traceback.print_exc()
+            job.error = repr(e)
+            job.state = CANCELLED if job.cancelled else FAILED
+        finally:
+            job.finished = time.time()
+            job.event("job", dict(state=job.state, error=job.error))
+            job.future.set_result(job)
+
+    def _prune(self):
+        done = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in done[:max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs[job_id]
+
+    def as_list(self):
+        with self._lock:
+            return [job.as_dict() for job in self.jobs.values()]
@@ -0,0 +1,133 @@
+"""
+Line numbers of a ``.pyx`` before and after breakpoint prints are injected.
+
+``add_print_to_file`` inserts a ``print()`` line in front of every breakpoint so
+Cython can't optimize the line away, which shifts every line below it. The index
+keeps the sorted user line numbers that had a print inserted in front of them, so
+both directions are a bisect instead of a scan over the whole file.
+"""
+import time
+from bisect import bisect_right, insort
+from pathlib import Path
+
+import metrics
+
+
+class LineIndex:
+    def __init__(self, path, stats):
+        self.path = Path(path)
+        self.stats = stats
+        self.insertions = []
+        self.version = 0
+        self.line_count = 0
+        self.mtime_ns = None
+        self.size = None
+        self.load()
+
+    def load(self):
+        start = time.perf_counter()
+        with self.path.open() as f:
+            self.line_count = f.read().count("\n") + 1
+        seconds = time.perf_counter() - start
+        self.stats["file_reads"] += 1
+        self.stats["read_seconds"] += seconds
+        metrics.LINE_INDEX_READS.inc()
+        metrics.LINE_INDEX_READ_SECONDS.inc(seconds)
+        self.insertions = []
+        self.version += 1
+        self.refresh_stat()
+
+    def refresh_stat(self):
+        """Remember the file's current mtime/size, call after changing the file ourselves."""
+        stat = self.path.stat()
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+
+    def is_stale(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return True
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+    def check_lineno(self, lineno):
+        if not 1 <= lineno <= self.line_count:
+            raise ValueError(f"{self.path.name} has no line {lineno}")
+
+    def corrected(self, lineno):
+        """
+        The line number (after injection) of the line just before user line ``lineno``,
+        which is the injected print when that line has a breakpoint.
+        """
+        self.stats["lookups"] += 1
+        metrics.LINE_INDEX_LOOKUPS.inc()
+        lineno = int(lineno)
+        self.check_lineno(lineno)
+        return lineno - 1 + bisect_right(self.insertions, lineno)
+
+    def injected_lineno(self, lineno):
+        """Where user line ``lineno`` ended up after injection."""
+        return self.corrected(lineno) + 1
+
+    def user_lineno(self, injected_lineno):
+        """
+        The user line number for a line number after injection. An injected print maps
+        to the line it was inserted in front of.
+        """
+        self.stats["lookups"] += 1
+        metrics.LINE_INDEX_LOOKUPS.inc()
+        injected_lineno = int(injected_lineno)
+        low, high = 1, self.line_count
+        while low < high:
+            middle = (low + high) // 2
+            if middle + bisect_right(self.insertions, middle) < injected_lineno:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def is_injected(self, injected_lineno):
+        """Whether a line number after injection is one of the injected prints."""
+        return int(injected_lineno) != self.injected_lineno(self.user_lineno(injected_lineno))
+
+    def add_insertion(self, lineno):
+        insort(self.insertions, int(lineno))
+        self.version += 1
+
+
+class LineIndexCache:
+    """One LineIndex per file, rebuilt when the file changes behind our back."""
+
+    def __init__(self):
+        self.indexes = {}
+        self.stats = dict(
+            file_reads=0,
+            read_seconds=0.0,
+            lookups=0,
+            hits=0,
+            invalidations=0,
+        )
+
+    def get(self, path):
+        path = Path(path)
+        index = self.indexes.get(path)
+        if index is not None and not index.is_stale():
+            self.stats["hits"] += 1
+            metrics.LINE_INDEX_HITS.inc()
+            return index
+        if index is not None:
+            self.stats["invalidations"] += 1
+            metrics.LINE_INDEX_INVALIDATIONS.inc()
+        index = LineIndex(path, self.stats)
+        self.indexes[path] = index
+        return index
+
+    def find(self, filename):
+        """The index of a file already indexed, by its name as gdb reports it, or None."""
+        for path, index in self.indexes.items():
+            if path.name == filename:
+                return index
+        return None
+
+    def clear(self):
+        self.indexes = {}
@@ -0,0 +1,255 @@
+"""
+Counters and histograms of where a session's time goes, served at ``/metrics`` in
+the Prometheus text format.
+
+gdb commands are timed by ``Process``, the parse stages by the ``timed`` decorator,
+builds and HTTP handlers by the server. Every observation in seconds is also added
+to the trace of the current request when the slow operation log is on
+(``CYGDB_SLOW_LOG``), so a slow request is logged with what it spent its time on.
+"""
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, from a cached /Frame to a long cy run
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 1000)
+BYTES_BUCKETS = (0, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines += self.samples()
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        return [f"{self.name}{format_labels(dict(zip(self.label_names, key)))} {format_value(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per label values: [count per bucket, sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total, count = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = counts, total + value, count + 1
+        if self.name.endswith("_seconds"):
+            trace_span(self.name, value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        values = self.values.get(self.key(labels))
+        return values[2] if values else 0
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self.values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(dict(labels, le=format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+GDB_COMMAND_SECONDS = REGISTRY.histogram("cygdb_gdb_command_seconds", "Wall time of gdb commands, by command",
+                                         ["command"])
+GDB_BYTES_READ = REGISTRY.counter("cygdb_gdb_bytes_read_total", "Bytes of gdb output read, by command", ["command"])
+GDB_TIMEOUTS = REGISTRY.counter("cygdb_gdb_timeouts_total", "gdb commands that timed out, by command", ["command"])
+PARSE_SECONDS = REGISTRY.histogram("cygdb_parse_seconds", "Time spent parsing gdb output, by stage", ["stage"])
+BUILD_SECONDS = REGISTRY.histogram("cygdb_build_seconds", "Wall time of builds and their stages", ["stage"])
+BUILDS = REGISTRY.counter("cygdb_builds_total", "Builds, by result", ["result"])
+BUILT_MODULES = REGISTRY.counter("cygdb_build_modules_total", "Modules built or taken from the build cache",
+                                 ["status"])
+BREAKPOINT_BOUNCES = REGISTRY.counter("cygdb_breakpoint_bounces_total",
+                                      "Stops continued past because they weren't on a breakpoint")
+BREAK_FILTERED_FALLBACKS = REGISTRY.counter("cygdb_break_filtered_fallbacks_total",
+                                            "Times cy break-filtered failed and plain cy break was used")
+LINE_INDEX_READS = REGISTRY.counter("cygdb_line_index_reads_total", ".pyx files read to index their lines")
+LINE_INDEX_READ_SECONDS = REGISTRY.counter("cygdb_line_index_read_seconds_total",
+                                           "Time spent reading .pyx files to index their lines")
+LINE_INDEX_LOOKUPS = REGISTRY.counter("cygdb_line_index_lookups_total", "Line number translations")
+LINE_INDEX_HITS = REGISTRY.counter("cygdb_line_index_hits_total", "Line indexes reused from the cache")
+LINE_INDEX_INVALIDATIONS = REGISTRY.counter("cygdb_line_index_invalidations_total",
+                                            "Line indexes rebuilt because their file changed")
+HTTP_SECONDS = REGISTRY.histogram("cygdb_http_request_seconds", "HTTP handler wall time",
+                                  ["handler", "method", "status"])
+HTTP_ROUND_TRIPS = REGISTRY.histogram("cygdb_http_gdb_round_trips", "gdb round trips per HTTP request", ["handler"],
+                                      COUNT_BUCKETS)
+HTTP_BYTES_READ = REGISTRY.histogram("cygdb_http_gdb_bytes_read", "Bytes of gdb output read per HTTP request",
+                                     ["handler"], BYTES_BUCKETS)
+
+
+def command_name(command):
+    """The label for a gdb command: ``cy children 0x10 0 100`` -> ``cy children``."""
+    words = command.split()
+    return " ".join(words[:2]) if words[:1] == ["cy"] else " ".join(words[:1])
+
+
+def observe_command(stats):
+    command = command_name(stats.command or "")
+    GDB_COMMAND_SECONDS.observe(stats.wall_time, command=command)
+    GDB_BYTES_READ.inc(stats.bytes_read, command=command)
+    if stats.timed_out:
+        GDB_TIMEOUTS.inc(command=command)
+
+
+def timed(histogram, **labels):
+    """Decorator observing the wall time of every call."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def start_trace():
+    spans = []
+    current_trace.set(spans)
+    return spans
+
+
+def trace_span(name, seconds, labels):
+    spans = current_trace.get()
+    if spans is not None:
+        spans.append(dict(name=name, seconds=round(seconds, 6), **labels))
+
+
+class SlowLog:
+    """JSON lines of the requests that took longer than ``threshold`` seconds, with their spans."""
+
+    def __init__(self, path, threshold=1.0):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get("CYGDB_SLOW_LOG")
+        if not path:
+            return None
+        return cls(path, float(os.environ.get("CYGDB_SLOW_SECONDS", 1.0)))
+
+    def write(self, name, seconds, spans, **details):
+        if seconds < self.threshold:
+            return False
+        line = json.dumps(dict(time=time.time(), name=name, seconds=round(seconds, 6), spans=spans, **details))
+        with self._lock:
+            with open(self.path, "a") as fp:
+                fp.write(line + "\n")
+        return True
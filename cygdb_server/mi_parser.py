@@ -0,0 +1,279 @@
+"""
+Incremental parser for the GDB/MI output of ``gdb --interpreter=mi3``.
+
+Raw bytes from gdb are fed in as they arrive and complete lines are turned into
+typed records. See https://sourceware.org/gdb/onlinedocs/gdb/GDB_002fMI-Output-Syntax.html
+"""
+import re
+
+RESULT = "result"
+EXEC = "exec"
+STATUS = "status"
+NOTIFY = "notify"
+CONSOLE = "console"
+TARGET = "target"
+LOG = "log"
+PROMPT = "prompt"
+OUTPUT = "output"
+
+RECORD_KINDS = {
+    "^": RESULT,
+    "*": EXEC,
+    "+": STATUS,
+    "=": NOTIFY,
+    "~": CONSOLE,
+    "@": TARGET,
+    "&": LOG,
+}
+ASYNC_KINDS = (EXEC, STATUS, NOTIFY)
+STREAM_KINDS = (CONSOLE, TARGET, LOG)
+
+C_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "\"": "\"",
+    "\\": "\\",
+    "e": "\x1b",
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "v": "\v",
+}
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+CSTRING_SPECIAL_PATTERN = re.compile(r"[\\\"]")
+OCTAL_PATTERN = re.compile(r"[0-7]{1,3}")
+
+
+class MIParseError(ValueError):
+    pass
+
+
+class MIRecord:
+    def __init__(self, kind, token=None, klass=None, results=None, text=None):
+        self.kind = kind
+        self.token = token
+        self.klass = klass
+        self.results = results if results is not None else {}
+        self.text = text
+
+    def __repr__(self):
+        if self.kind in STREAM_KINDS or self.kind == OUTPUT:
+            return f"MIRecord({self.kind}, {self.text!r})"
+        return f"MIRecord({self.kind}, token={self.token}, klass={self.klass}, results={self.results})"
+
+
+def strip_ansi(text):
+    return ANSI_ESCAPE_PATTERN.sub("", text)
+
+
+def parse_cstring(line, pos):
+    """
+    Parse the C string starting at ``line[pos]`` (which must be a double quote).
+    Returns the unescaped value and the position after the closing quote. Octal
+    escapes are collected as bytes so multi-byte UTF-8 characters survive.
+    """
+    if line[pos] != "\"":
+        raise MIParseError(f"Expected '\"' at {pos}: {line!r}")
+    pieces = []
+    octal_bytes = bytearray()
+    pos += 1
+    while True:
+        match = CSTRING_SPECIAL_PATTERN.search(line, pos)
+        if match is None:
+            raise MIParseError(f"Unterminated string: {line!r}")
+        special = match.start()
+        if special > pos:
+            if octal_bytes:
+                pieces.append(octal_bytes.decode(errors="replace"))
+                octal_bytes = bytearray()
+            pieces.append(line[pos:special])
+        if line[special] == "\"":
+            pos = special + 1
+            break
+        octal = OCTAL_PATTERN.match(line, special + 1)
+        if octal is not None:
+            octal_bytes.append(int(octal.group(0), 8) & 0xFF)
+            pos = octal.end()
+            continue
+        if octal_bytes:
+            pieces.append(octal_bytes.decode(errors="replace"))
+            octal_bytes = bytearray()
+        escaped = line[special + 1:special + 2]
+        pieces.append(C_ESCAPES.get(escaped, escaped))
+        pos = special + 2
+    if octal_bytes:
+        pieces.append(octal_bytes.decode(errors="replace"))
+    return "".join(pieces), pos
+
+
+def parse_value(line, pos):
+    char = line[pos:pos + 1]
+    if char == "\"":
+        return parse_cstring(line, pos)
+    if char == "{":
+        if line[pos + 1:pos + 2] == "}":
+            return {}, pos + 2
+        return parse_results(line, pos + 1, "}")
+    if char == "[":
+        return parse_list(line, pos + 1)
+    raise MIParseError(f"Unexpected {char!r} at {pos}: {line!r}")
+
+
+def parse_list(line, pos):
+    if line[pos:pos + 1] == "]":
+        return [], pos + 1
+    # a list holds either bare values or name=value results
+    if line[pos:pos + 1] in ("\"", "{", "["):
+        values = []
+        while True:
+            value, pos = parse_value(line, pos)
+            values.append(value)
+            if line[pos:pos + 1] == ",":
+                pos += 1
+                continue
+            if line[pos:pos + 1] == "]":
+                return values, pos + 1
+            raise MIParseError(f"Expected ',' or ']' at {pos}: {line!r}")
+    results = []
+    while True:
+        name, value, pos = parse_result(line, pos)
+        results.append({name: value})
+        if line[pos:pos + 1] == ",":
+            pos += 1
+            continue
+        if line[pos:pos + 1] == "]":
+            return results, pos + 1
+        raise MIParseError(f"Expected ',' or ']' at {pos}: {line!r}")
+
+
+def parse_result(line, pos):
+    equals = line.find("=", pos)
+    if equals == -1:
+        raise MIParseError(f"Expected '=' after {pos}: {line!r}")
+    name = line[pos:equals]
+    value, pos = parse_value(line, equals + 1)
+    return name, value, pos
+
+
+def parse_results(line, pos, closing=None):
+    """
+    Parse ``name=value`` pairs up to ``closing`` (or the end of the line). Repeated
+    names, e.g. several ``bkpt=`` entries, are gathered into a list.
+    """
+    results = {}
+    repeated = set()
+    while pos < len(line):
+        name, value, pos = parse_result(line, pos)
+        if name in repeated:
+            results[name].append(value)
+        elif name in results:
+            results[name] = [results[name], value]
+            repeated.add(name)
+        else:
+            results[name] = value
+        char = line[pos:pos + 1]
+        if char == ",":
+            pos += 1
+        elif closing is not None and char == closing:
+            return results, pos + 1
+        elif char == "":
+            break
+        else:
+            raise MIParseError(f"Unexpected {char!r} at {pos}: {line!r}")
+    if closing is not None:
+        raise MIParseError(f"Missing {closing!r}: {line!r}")
+    return results, pos
+
+
+def parse_line(line):
+    """Parse one line of MI output, anything that isn't MI is the inferior's own output."""
+    if line.rstrip() == "(gdb)":
+        return MIRecord(PROMPT)
+    pos = 0
+    while pos < len(line) and line[pos].isdigit():
+        pos += 1
+    kind = RECORD_KINDS.get(line[pos:pos + 1])
+    if kind is None or (pos > 0 and kind in STREAM_KINDS):
+        return MIRecord(OUTPUT, text=line)
+    token = int(line[:pos]) if pos > 0 else None
+    try:
+        if kind in STREAM_KINDS:
+            text, _ = parse_cstring(line, pos + 1)
+            return MIRecord(kind, text=text)
+        comma = line.find(",", pos + 1)
+        if comma == -1:
+            return MIRecord(kind, token=token, klass=line[pos + 1:])
+        results, _ = parse_results(line, comma + 1)
+        return MIRecord(kind, token=token, klass=line[pos + 1:comma], results=results)
+    except MIParseError:
+        return MIRecord(OUTPUT, text=line)
+
+
+class MIParser:
+    """
+    Feed raw bytes with ``feed`` and get back the records for every line completed
+    so far. Partial lines are kept until the rest arrives.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+
+    def feed(self, data):
+        self._pending += data
+        last_newline = self._pending.rfind(b"\n")
+        if last_newline == -1:
+            return []
+        complete = self._pending[:last_newline]
+        del self._pending[:last_newline + 1]
+        records = []
+        for raw_line in complete.split(b"\n"):
+            line = raw_line.decode(errors="replace").rstrip("\r")
+            if line == "":
+                continue
+            records.append(parse_line(line))
+        return records
+
+    def flush(self):
+        """Parse whatever is left over, e.g. when gdb exits without a final newline."""
+        if not self._pending:
+            return []
+        self._pending += b"\n"
+        return self.feed(b"")
+
+
+class MIResponse:
+    """All the records gdb produced for one command."""
+
+    def __init__(self, records=None, stats=None):
+        self.records = records if records is not None else []
+        self.stats = stats
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def result(self):
+        for record in reversed(self.records):
+            if record.kind == RESULT:
+                return record
+        return None
+
+    @property
+    def error(self):
+        result = self.result
+        if result is not None and result.klass == "error":
+            return result.results.get("msg", "")
+        return None
+
+    def stream_text(self, kind=CONSOLE):
+        return strip_ansi("".join(record.text for record in self.records if record.kind == kind))
+
+    def console_lines(self):
+        return [line for line in self.stream_text(CONSOLE).split("\n") if line.strip() != ""]
+
+    def output_lines(self):
+        return [strip_ansi(record.text) for record in self.records if record.kind == OUTPUT]
+
+    def async_records(self):
+        return [record for record in self.records if record.kind in ASYNC_KINDS]
@@ -0,0 +1,183 @@
+"""
+Build the Cython extensions of a project in parallel, one module per worker process.
+
+Run with the debug interpreter from the project folder:
+
+    python3.8-dbg parallel_build.py --workers 4 [--only demo.pyx ...]
+
+The extensions and cythonize options are taken from the project's ``setup.py`` by
+running it with ``cythonize`` and ``setup`` replaced by recorders. Every module is
+then cythonized, compiled and linked on its own, and a line starting with
+EVENT_PREFIX and a JSON payload is written as each module starts and finishes, with
+the time spent in each stage. The events go to ``--events-fd`` when the caller passes
+a pipe, so compiler output on stdout/stderr can't end up in the middle of one, and to
+stdout otherwise.
+"""
+import argparse
+import glob
+import json
+import os
+import runpy
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+EVENT_PREFIX = "CYGDB-BUILD "
+# exit status when setup.py can't be understood, the caller falls back to build_ext
+UNSUPPORTED = 3
+
+
+# where emit writes, set from --events-fd
+events = sys.stdout
+
+
+def emit(event, **payload):
+    payload["event"] = event
+    events.write(EVENT_PREFIX + json.dumps(payload) + "\n")
+    events.flush()
+
+
+class SetupRecorder:
+    def __init__(self):
+        self.module_list = None
+        self.cythonize_kwargs = {}
+
+    def cythonize(self, module_list, *args, **kwargs):
+        self.module_list = module_list
+        self.cythonize_kwargs = kwargs
+        return module_list
+
+    def setup(self, *args, **kwargs):
+        pass
+
+
+def load_extensions(setup_path):
+    """Run setup.py with recorders in place and return its extensions and cythonize options."""
+    import Cython.Build
+    import distutils.core
+    import setuptools
+    from setuptools import Extension
+
+    recorder = SetupRecorder()
+    originals = (Cython.Build.cythonize, setuptools.setup, distutils.core.setup, sys.argv)
+    Cython.Build.cythonize = recorder.cythonize
+    setuptools.setup = distutils.core.setup = recorder.setup
+    sys.argv = [str(setup_path)]
+    try:
+        runpy.run_path(str(setup_path), run_name="__main__")
+    finally:
+        Cython.Build.cythonize, setuptools.setup, distutils.core.setup, sys.argv = originals
+
+    if recorder.module_list is None:
+        return None, {}
+    module_list = recorder.module_list
+    if not isinstance(module_list, (list, tuple)):
+        module_list = [module_list]
+    extensions = []
+    for module in module_list:
+        if isinstance(module, str):
+            for path in sorted(glob.glob(module, recursive=True)):
+                name = ".".join(Path(path).with_suffix("").parts)
+                extensions.append(Extension(name, [path]))
+        else:
+            extensions.append(module)
+    return extensions, recorder.cythonize_kwargs
+
+
+def build_module(extension, cythonize_kwargs):
+    from Cython.Build import cythonize
+    from setuptools.dist import Distribution
+    from setuptools.command.build_ext import build_ext
+
+    timings = dict(cythonize=0.0, compile=0.0, link=0.0)
+
+    class TimedBuildExt(build_ext):
+        def build_extension(self, ext):
+            compile_, link = self.compiler.compile, self.compiler.link_shared_object
+
+            def timed_compile(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return compile_(*args, **kwargs)
+                finally:
+                    timings["compile"] += time.perf_counter() - start
+
+            def timed_link(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return link(*args, **kwargs)
+                finally:
+                    timings["link"] += time.perf_counter() - start
+
+            self.compiler.compile, self.compiler.link_shared_object = timed_compile, timed_link
+            try:
+                return build_ext.build_extension(self, ext)
+            finally:
+                self.compiler.compile, self.compiler.link_shared_object = compile_, link
+
+    start = time.perf_counter()
+    try:
+        cythonized = cythonize([extension], force=True, **cythonize_kwargs)
+        timings["cythonize"] = time.perf_counter() - start
+        distribution = Distribution(dict(ext_modules=cythonized))
+        command = TimedBuildExt(distribution)
+        command.inplace = 1
+        command.force = 1
+        command.ensure_finalized()
+        command.run()
+    except BaseException as e:
+        return dict(name=extension.name, success=False, error=repr(e),
+                    seconds=time.perf_counter() - start, **timings)
+    return dict(name=extension.name, success=True, seconds=time.perf_counter() - start, **timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="source files of the modules to build, all of them by default")
+    parser.add_argument("--setup", default="setup.py")
+    parser.add_argument("--events-fd", type=int, default=None, help="write the events to this file descriptor")
+    args = parser.parse_args()
+    global events
+    if args.events_fd is not None:
+        events = os.fdopen(args.events_fd, "w")
+
+    start = time.perf_counter()
+    try:
+        extensions, cythonize_kwargs = load_extensions(Path(args.setup))
+    except Exception as e:
+        emit("unsupported", error=repr(e))
+        return UNSUPPORTED
+    if extensions is None:
+        emit("unsupported", error="setup.py doesn't call cythonize")
+        return UNSUPPORTED
+    if args.only is not None:
+        only = set(os.path.normpath(source) for source in args.only)
+        extensions = [extension for extension in extensions
+                      if any(os.path.normpath(source) in only for source in extension.sources)]
+
+    results = []
+    workers = max(1, min(args.workers or 1, len(extensions) or 1))
+    emit("plan", modules=[extension.name for extension in extensions], workers=workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for extension in extensions:
+            futures[pool.submit(build_module, extension, cythonize_kwargs)] = extension
+            emit("started", name=extension.name)
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = dict(name=futures[future].name, success=False, error=repr(e))
+            results.append(result)
+            emit("module", **result)
+
+    success = all(result["success"] for result in results)
+    emit("done", success=success, seconds=time.perf_counter() - start, modules=results)
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Independent debug sessions served by one server.
+
+Every session has its own working folder, breakpoints and gdb. The default session
+is the one the un-prefixed routes use and is never evicted; other sessions are
+created on request, up to ``max_sessions``, and closed once idle for ``idle_timeout``
+seconds.
+"""
+import asyncio
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+DEFAULT_SESSION = "default"
+# how often a coroutine waiting for a busy session checks it again
+LOCK_POLL = 0.01
+# session ids name a folder under the sessions folder
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class InvalidSessionError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, session_id, server, working_folder):
+        self.session_id = session_id
+        self.server = server
+        self.working_folder = working_folder
+        self.created = time.time()
+        self.last_used = self.created
+        # one request at a time per session, the controller and its gdb aren't thread safe
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def as_dict(self):
+        return dict(
+            session_id=self.session_id,
+            working_folder=str(self.working_folder),
+            created=self.created,
+            idle_seconds=time.time() - self.last_used,
+            debugging=self.server is not None and self.server.cygdb is not None
+                      and self.server.cygdb.gdb is not None
+        )
+
+
+class SessionRegistry:
+    def __init__(self, make_server, sessions_folder, max_sessions=4, idle_timeout=1800):
+        """``make_server(working_folder)`` builds the CythonServer of a new session."""
+        self.make_server = make_server
+        self.sessions_folder = Path(sessions_folder)
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def add(self, session_id, server, working_folder):
+        with self._lock:
+            session = Session(session_id, server, working_folder)
+            self.sessions[session_id] = session
+            return session
+
+    def create(self, session_id=None):
+        self.evict_idle()
+        session_id = session_id or uuid.uuid4().hex[:12]
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            raise InvalidSessionError(f"invalid session id {session_id!r}, use up to 64 letters, digits, _ and -")
+        with self._lock:
+            if session_id in self.sessions:
+                raise ValueError(f"session {session_id} already exists")
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionLimitError(f"at most {self.max_sessions} sessions can be open")
+            working_folder = self.sessions_folder / session_id / "working_folder"
+            session = Session(session_id, None, working_folder)
+            # requests for the session wait until its server is ready
+            session.lock.acquire()
+            self.sessions[session_id] = session
+        try:
+            session.server = self.make_server(working_folder)
+        except Exception:
+            with self._lock:
+                self.sessions.pop(session_id, None)
+            raise
+        finally:
+            session.lock.release()
+        return session
+
+    def get(self, session_id):
+        """The session, or KeyError. Using a session keeps it from being evicted."""
+        self.evict_idle()
+        with self._lock:
+            session = self.sessions[session_id]
+        session.touch()
+        return session
+
+    def remove(self, session_id):
+        if session_id == DEFAULT_SESSION:
+            raise ValueError("the default session can't be removed")
+        with self._lock:
+            session = self.sessions.pop(session_id)
+        with session.lock:
+            self.close(session)
+
+    def close(self, session):
+        try:
+            session.server.close()
+        finally:
+            folder = (self.sessions_folder / session.session_id).resolve()
+            if self.sessions_folder.resolve() in folder.parents:
+                shutil.rmtree(folder, ignore_errors=True)
+            else:
+                print(f"not removing {folder}, it isn't in {self.sessions_folder}")
+
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle = [session for session_id, session in self.sessions.items()
+                    if session_id != DEFAULT_SESSION and now - session.last_used > self.idle_timeout]
+            for session in idle:
+                del self.sessions[session.session_id]
+        for session in idle:
+            print(f"closing session {session.session_id}, idle for {now - session.last_used:.0f}s")
+            with session.lock:
+                self.close(session)
+        return [session.session_id for session in idle]
+
+    def as_list(self):
+        with self._lock:
+            return [session.as_dict() for session in self.sessions.values()]
+
+
+@asynccontextmanager
+async def locked(session):
+    """Hold the session's lock without blocking the event loop while waiting for it."""
+    while not session.lock.acquire(blocking=False):
+        await asyncio.sleep(LOCK_POLL)
+    try:
+        yield session.server
+    finally:
+        session.lock.release()
@@ -0,0 +1,87 @@
+"""
+Server initialization that runs after the port is bound.
+
+Each stage runs in order on a background thread and records how long it took, so
+``/hello`` answers straight away while the folder sync, interpreter discovery and
+heavy imports happen, and ``/ready`` reports how far they got.
+"""
+import importlib
+import os
+import shutil
+import threading
+import time
+import traceback
+
+
+def find_executable(names, fallbacks=(), env_variable=None):
+    """The first of ``$env_variable``, existing ``fallbacks`` and ``names`` on PATH."""
+    if env_variable and os.environ.get(env_variable):
+        return os.environ[env_variable]
+    for path in fallbacks:
+        if os.path.exists(path):
+            return path
+    for name in names:
+        path = shutil.which(name)
+        if path:
+            return path
+    return fallbacks[0] if fallbacks else None
+
+
+def preload(*modules):
+    for module in modules:
+        importlib.import_module(module)
+
+
+class Startup:
+    def __init__(self):
+        self.stages = []
+        self.status = {}
+        self.started = None
+        self._thread = None
+        self._done = threading.Event()
+
+    def add_stage(self, name, function):
+        self.stages.append((name, function))
+        self.status[name] = dict(state="pending", seconds=None, error=None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self.run, name="startup", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        try:
+            for name, function in self.stages:
+                status = self.status[name]
+                status["state"] = "running"
+                start = time.perf_counter()
+                try:
+                    status["result"] = function()
+                    status["state"] = "done"
+                except Exception as e:
+                    traceback.print_exc()
+                    status["state"] = "failed"
+                    status["error"] = repr(e)
+                status["seconds"] = time.perf_counter() - start
+                print(f"startup stage {name}: {status['state']} in {status['seconds']:.3f}s")
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until every stage ran, starting them if that didn't happen yet."""
+        self.start()
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self):
+        return self._done.is_set() and all(status["state"] == "done" for status in self.status.values())
+
+    def as_dict(self):
+        return dict(
+            ready=self.ready,
+            finished=self._done.is_set(),
+            seconds=None if self.started is None else time.perf_counter() - self.started,
+            stages=[dict(name=name, **self.status[name]) for name, _ in self.stages]
+        )
@@ -0,0 +1,51 @@
+from breakpoints import Breakpoint, BreakpointRegistry
+from line_index import LineIndexCache
+
+
+def test_lookup_follows_injected_lines(tmp_path):
+    path = tmp_path / "demo.pyx"
+    path.write_text("\n".join(f"    x = {i}" for i in range(1, 41)))
+    line_indexes = LineIndexCache()
+    registry = BreakpointRegistry(line_indexes)
+
+    first = registry.add(Breakpoint("demo", 22, path))
+    assert registry.lookup("demo.pyx", "21") is first
+    line_indexes.get(path).add_insertion(22)
+    second = registry.add(Breakpoint("demo", 25, path))
+    line_indexes.get(path).add_insertion(25)
+
+    assert registry.lookup("demo.pyx", "22") is first
+    assert registry.lookup("demo", "26") is second
+    assert registry.lookup("other.pyx", "22") is None
+    assert registry.lookup_line("26") == [second]
+
+
+def test_record_hit(tmp_path):
+    path = tmp_path / "demo.pyx"
+    path.write_text("x = 1\ny = 2\n")
+    registry = BreakpointRegistry(LineIndexCache())
+    breakpoint = registry.add(Breakpoint("demo", 2, path))
+    registry.record_hit(breakpoint)
+    registry.record_hit(breakpoint)
+    hits = registry.hits()
+    assert hits[0]["hit_count"] == 2
+    assert hits[0]["last_hit"] is not None
+
+
+def test_reinject_prints_after_sync(tmp_path):
+    from folder_sync import sync_folder
+    from gdb_interface import CygdbController
+
+    source, working = tmp_path / "project", tmp_path / "working"
+    source.mkdir()
+    (source / "demo.pyx").write_text("\n".join(f"    x = {i}" for i in range(1, 30)))
+    sync_folder(source, working)
+    cygdb = CygdbController()
+    for lineno in (5, 9):
+        cygdb.add_prints_to_file("demo.pyx", lineno, working / "demo.pyx")
+    injected = (working / "demo.pyx").read_text()
+
+    sync_folder(source, working, keep_build_outputs=True)
+    assert len(cygdb.reinject_prints()) == 2
+    assert (working / "demo.pyx").read_text() == injected
+    assert cygdb.breakpoints.lookup("demo", "10").lineno == "9"
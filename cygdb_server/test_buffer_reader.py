@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+
+import buffer_reader
+from buffer_reader import BufferReadError, BufferView, numpy_dtype, read_npy_header, write_npy
+
+
+def view_of(array):
+    """A BufferView over ``array`` as gdb would report it, plus the memory it lies in."""
+    base = array.base if array.base is not None else array
+    info = dict(data=hex(array.ctypes.data), shape=list(array.shape), strides=list(array.strides),
+                itemsize=array.itemsize, format=array.dtype.char)
+    view = BufferView.from_info(info)
+    start = base.ctypes.data
+    return view.rebased(start - view.data), base.tobytes()
+
+
+def test_dtypes_from_memoryview_formats_and_ndarray_descrs():
+    assert numpy_dtype(dict(format="d", itemsize=8)) == "<f8"
+    assert numpy_dtype(dict(format=">i", itemsize=4)) == ">i4"
+    assert numpy_dtype(dict(format="B", itemsize=1)) == "<u1"
+    assert numpy_dtype(dict(dtype="=f4", itemsize=4)) == "<f4"
+    with pytest.raises(BufferReadError):
+        numpy_dtype(dict(format="T{d:x:d:y:}", itemsize=16))
+
+
+def test_strided_slices_match_numpy():
+    array = np.arange(60, dtype=np.float64).reshape(6, 10)
+    view, raw = view_of(array)
+    for spec, expected in [("", array), ("1:5:2", array[1:5:2]), ("::-1,3", array[::-1, 3]),
+                           ("2,1:9:3", array[2, 1:9:3]), ("-1", array[-1]), ("4:2", array[4:2])]:
+        sliced = view.sliced(spec)
+        first, end = sliced.extent()
+        assert sliced.shape == list(expected.shape)
+        assert sliced.rebased(first).to_bytes(raw[first:end]) == expected.tobytes()
+    with pytest.raises(BufferReadError):
+        view.sliced("7")
+    with pytest.raises(BufferReadError):
+        view.sliced("1,2,3")
+
+
+def test_only_the_memory_of_the_slice_is_read():
+    view = BufferView(0x1000, "<f8", [1000], [8]).sliced("100:200:10")
+    assert view.extent() == (800, 800 + 90 * 8 + 8)
+
+
+def test_stats_with_and_without_numpy(monkeypatch):
+    array = np.array([3.0, np.nan, -1.5, 7.0, np.nan])
+    view, raw = view_of(array)
+    expected = dict(count=5, nan_count=2, min=-1.5, max=7.0, mean=pytest.approx(8.5 / 3))
+    assert view.stats(raw) == expected
+    monkeypatch.setattr(buffer_reader, "numpy", None)
+    monkeypatch.setattr(buffer_reader, "numpy_imported", True)
+    assert view.stats(raw) == expected
+    assert view.sliced("::2").to_bytes(raw) == array[::2].tobytes()
+
+
+def test_npy_files_load_with_numpy(tmp_path):
+    array = np.arange(24, dtype=np.int32).reshape(4, 6)
+    view, raw = view_of(array)
+    view = view.sliced(":,::-2")
+    path = tmp_path / "x.npy"
+    assert write_npy(path, view, raw) == array[:, ::-2].nbytes
+    assert read_npy_header(path) == ("<i4", [4, 3])
+    assert (np.load(path) == array[:, ::-2]).all()
+    assert math.prod(view.shape) == view.size
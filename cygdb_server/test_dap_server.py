@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+
+import mi_parser as mi
+from dap_server import DebugAdapter, ProtocolError, encode_message, read_message
+from gdb_interface import CygdbController, Frame
+from sessions import Session
+
+SNAPSHOT = dict(
+    local_variables=[dict(name="i", type="cy int", value="3"),
+                     dict(name="xs", type="list", value="[1, 2]", child_count=2, address="0x10")],
+    global_variables=[dict(name="N", type="int", value="10", child_count=None, address="0x20")],
+    trace=[dict(index=0, filename="main.py", lineno="3", function_or_object="<module>()"),
+           dict(index=4, filename="demo.pyx", lineno="16", function_or_object="run()", file_parent="/w/")],
+    thread_id=1
+)
+CHILDREN = dict(address="0x10", offset=0, child_count=2, children=[
+    dict(name="[0]", type="int", value="1", child_count=None, address="0x30"),
+    dict(name="[1]", type="int", value="2", child_count=None, address="0x40")])
+
+
+class FakeGdb:
+    def __init__(self):
+        self.commands = []
+
+    async def write_async(self, command, timeout=None):
+        self.commands.append(command)
+        payload = SNAPSHOT if command == "cy snapshot" else CHILDREN if command.startswith("cy children") else {}
+        return mi.MIResponse([mi.MIRecord(mi.CONSOLE, text=json.dumps(payload) + "\n"),
+                              mi.MIRecord(mi.RESULT, klass="done")])
+
+
+class FakeServer:
+    def __init__(self):
+        self.cygdb = None
+        self.calls = []
+
+    def file_to_debug(self, path):
+        self.calls.append(("file_to_debug", path))
+
+    def set_breakpoints(self, source, lines, mode):
+        self.calls.append(("set_breakpoints", source, lines, mode))
+        return dict(source=source, breakpoints=lines, valid_breakpoints=lines[:1])
+
+    def new_controller(self, mode):
+        return CygdbController()
+
+    async def run_debugger_async(self):
+        self.cygdb.gdb = FakeGdb()
+        self.cygdb.invalidate_handles()
+        return dict(ended=False)
+
+
+def test_message_framing():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_message(dict(seq=1, type="request", command="threads")) * 2)
+        reader.feed_eof()
+        return [await read_message(reader) for _ in range(3)]
+
+    first, second, end = asyncio.run(main())
+    assert first == second == dict(seq=1, type="request", command="threads")
+    assert end is None
+
+    async def unframed(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_message(reader)
+
+    for data in (b'Content-Type: application/json\r\n\r\n{"seq": 1}', b"Content-Length: x\r\n\r\n{}"):
+        with pytest.raises(ProtocolError):
+            asyncio.run(unframed(data))
+
+
+def test_stack_frames_are_on_the_user_lines():
+    # print mode, a print was injected above demo.pyx line 16
+    frame = Frame(trace=[dict(filename="demo.pyx", lineno="17", user_lineno="16", function_or_object="run()",
+                              file_parent="/w/")])
+    adapter = DebugAdapter(None, lambda data: None)
+    adapter.session = Session("default", FakeServer(), "/w")
+
+    async def current_frame():
+        return frame
+    adapter.current_frame = current_frame
+    stack_frames = asyncio.run(adapter.on_stackTrace({}))["stackFrames"]
+    assert [stack_frame["line"] for stack_frame in stack_frames] == [16]
+
+
+def test_stop_is_inspected_from_one_snapshot():
+    server = FakeServer()
+    session = Session("default", server, "/w")
+    sent = []
+
+    async def get_session(session_id):
+        return session
+
+    async def main():
+        adapter = DebugAdapter(get_session, lambda data: sent.append(data))
+        requests = [
+            ("initialize", {}),
+            ("launch", dict(program="/editor/project/main.py", projectRoot="/editor/project", compile=False)),
+            ("setBreakpoints", dict(source=dict(path="/editor/project/demo.pyx"),
+                                    breakpoints=[dict(line=16), dict(line=99)])),
+            ("configurationDone", {}),
+        ]
+        for seq, (command, arguments) in enumerate(requests, 1):
+            await adapter.handle(dict(seq=seq, type="request", command=command, arguments=arguments))
+        await adapter.run_task
+        for seq, (command, arguments) in enumerate([
+                ("stackTrace", dict(threadId=1)),
+                ("scopes", dict(frameId=0)),
+                ("variables", dict(variablesReference=1)),
+                ("variables", dict(variablesReference=2)),
+                ("variables", dict(variablesReference=1000))], 10):
+            await adapter.handle(dict(seq=seq, type="request", command=command, arguments=arguments))
+
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"".join(sent))
+        reader.feed_eof()
+        messages = []
+        while True:
+            message = await read_message(reader)
+            if message is None:
+                return messages
+            messages.append(message)
+
+    messages = asyncio.run(main())
+    assert all(message["success"] for message in messages if message["type"] == "response")
+    assert [message.get("event") for message in messages if message["type"] == "event"] == ["initialized", "stopped"]
+    responses = {message["request_seq"]: message["body"] for message in messages if message["type"] == "response"}
+
+    assert server.calls == [("file_to_debug", "main.py"), ("set_breakpoints", "demo.pyx", [16, 99], "debug_info")]
+    assert responses[3]["breakpoints"] == [dict(verified=True, line=16), dict(verified=False, line=99)]
+    assert [frame["name"] for frame in responses[10]["stackFrames"]] == ["run()", "<module>()"]
+    assert responses[10]["stackFrames"][0]["line"] == 16
+    assert [scope["variablesReference"] for scope in responses[11]["scopes"]] == [1, 2]
+    xs = responses[12]["variables"][1]
+    assert xs["variablesReference"] == 1000 and xs["indexedVariables"] == 2
+    assert responses[13]["variables"][0]["variablesReference"] == 0
+    assert [child["value"] for child in responses[14]["variables"]] == ["1", "2"]
+    # the whole stop took one snapshot, only expanding xs went back to gdb
+    assert server.cygdb.gdb.commands == ["cy snapshot", "cy children 0x10 0 100"]
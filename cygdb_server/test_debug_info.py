@@ -0,0 +1,27 @@
+from debug_info import DebugInfo
+
+DEBUG_INFO = """<cython_debug>
+  <Module name="demo" filename="/w/demo.pyx" c_filename="/w/demo.c">
+    <Functions>
+      <Function name="setup" qualified_name="demo.setup" cname="__pyx_f_4demo_setup" lineno="3"/>
+      <Function name="run" qualified_name="demo.run" cname="__pyx_f_4demo_run" lineno="10"/>
+    </Functions>
+    <LineNumberMapping>
+      <LineNumber cython_lineno="3" c_linenos="100"/>
+      <LineNumber cython_lineno="4" c_linenos="105 106"/>
+      <LineNumber cython_lineno="7" c_linenos="120"/>
+      <LineNumber cython_lineno="10" c_linenos="200"/>
+      <LineNumber cython_lineno="12" c_linenos="210"/>
+    </LineNumberMapping>
+  </Module>
+</cython_debug>
+"""
+
+
+def test_trace_functions_before_gdb_runs(tmp_path):
+    (tmp_path / "cython_debug_info_demo").write_text(DEBUG_INFO)
+    debug_info = DebugInfo(tmp_path)
+    assert debug_info.trace_functions(["demo:setup", "run", "missing"]) == dict(
+        functions=[dict(module="demo", filename="/w/demo.pyx", function="setup", lines=[3, 4, 7]),
+                   dict(module="demo", filename="/w/demo.pyx", function="run", lines=[10, 12])],
+        invalid=["missing"])
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+from events import EventBus
+
+
+def test_stream_filters_sessions_and_replays():
+    bus = EventBus()
+    bus.publish("stop", "default", dict(ended=True))
+
+    async def read(count, **kwargs):
+        stream = bus.stream("default", **kwargs)
+        chunks = [await stream.__anext__() for _ in range(count + 1)]
+        await stream.aclose()
+        return chunks[1:]
+
+    async def main():
+        reader = asyncio.ensure_future(read(2))
+        await asyncio.sleep(0.01)
+        thread = threading.Thread(target=lambda: [bus.publish("output", "other", dict(text="x")),
+                                                  bus.publish("job", None, dict(state="running")),
+                                                  bus.publish("output", "default", dict(text="hi"))])
+        thread.start()
+        thread.join()
+        return await reader, await read(1, last_event_id=3)
+
+    live, replayed = asyncio.run(main())
+    assert [chunk.split("\n")[1] for chunk in live] == ["event: job", "event: output"]
+    assert '"text": "hi"' in live[1]
+    assert replayed[0].startswith("id: 4\n")
@@ -0,0 +1,80 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+import metrics
+from breakpoints import Breakpoint
+from fake_gdb import Recorder, Replayer, Transcript
+from gdb_interface import CygdbController
+
+HERE = Path(__file__).resolve().parent
+TRANSCRIPT = HERE / "transcripts" / "demo_project.json"
+PYX = HERE.parent / "demo_project" / "monte_carlo_simulation.pyx"
+
+
+def test_recorder_splits_exchanges_like_the_command_channel(tmp_path):
+    recorder = Recorder(tmp_path / "session.json")
+    recorder.feed_output('=thread-group-added,id="i1"\n(gdb) \n')
+    recorder.feed_input('1-interpreter-exec console "cy run"\n2-interpreter-exec console "cy loc')
+    recorder.feed_output('1^running\n*running,thread-id="all"\nhello\n*stopped,reason="breakpoint-hit"\n')
+    recorder.feed_output('~"37    x = 1\\n"\n(gdb) \n')
+    recorder.feed_input('als"\n')
+    recorder.feed_output('~"i = 0\\n"\n2^done\n(gdb) \n')
+
+    transcript = Transcript.load(tmp_path / "session.json")
+    assert transcript.startup == ['=thread-group-added,id="i1"']
+    assert transcript.exchanges == [
+        dict(command="cy run", output=['^running', '*running,thread-id="all"', "hello",
+                                       '*stopped,reason="breakpoint-hit"', '~"37    x = 1\\n"']),
+        dict(command="cy locals", output=['~"i = 0\\n"', "^done"]),
+    ]
+
+
+def test_replayer_answers_with_the_token_it_was_sent():
+    transcript = Transcript(exchanges=[dict(command="cy locals", output=['~"i = 0\\n"', "^done"]),
+                                       dict(command="cy locals", output=['~"i = 1\\n"', "^done"])])
+    out = io.StringIO()
+    Replayer(transcript, repeat=2, out=out).run([
+        '7-interpreter-exec console "cy locals"\n',
+        '8-interpreter-exec console "cy locals"\n',
+        '9-interpreter-exec console "cy locals"\n',
+        '10-interpreter-exec console "cy nonsense"\n',
+        "11-gdb-exit\n",
+    ])
+    lines = out.getvalue().split("\n")
+    assert lines[:4] == ["(gdb) ", '~"i = 0\\n"', '~"i = 0\\n"', "7^done"]
+    assert lines[9:12] == ['~"i = 1\\n"', '~"i = 1\\n"', "9^done"]
+    assert lines[13].startswith("10^error")
+    assert lines[15] == "11^exit"
+
+
+@pytest.fixture
+def cygdb():
+    cygdb = CygdbController()
+    bp = cygdb.breakpoints.add(Breakpoint("monte_carlo_simulation", 37, PYX, mode="debug_info"))
+    bp.resolved_lineno = 37
+    cygdb.spawn_gdb(f"{sys.executable} {HERE / 'fake_gdb.py'} --nx --interpreter=mi3 --transcript {TRANSCRIPT}")
+    yield cygdb
+    cygdb.exit_gdb()
+
+
+def test_controller_against_a_recorded_session(cygdb):
+    fallbacks = metrics.BREAK_FILTERED_FALLBACKS.value()
+    cygdb.add_breakpoints()
+    # the transcript has no cy break-filtered, the fallback to cy break is counted
+    assert metrics.BREAK_FILTERED_FALLBACKS.value() == fallbacks + 1
+    trace = cygdb.run()
+    assert (trace[-1]["filename"], trace[-1]["lineno"]) == ("monte_carlo_simulation.pyx", "37")
+    frame = cygdb.frame
+    assert frame.breakpoint["lineno"] == "37" and frame.breakpoint["hit_count"] == 1
+    local_variables = {variable["name"]: variable for variable in frame.local_variables}
+    assert local_variables["i"]["value"] == "0"
+    assert local_variables["rand_arr_x"]["type"] == "numpy.ndarray"
+    assert "np" in {variable["name"] for variable in frame.global_variables}
+
+    cygdb.cont()
+    assert cygdb.frame.generation == frame.generation + 1
+    assert {variable["name"]: variable["value"] for variable in cygdb.frame.local_variables}["i"] == "1"
+    assert cygdb.breakpoints.hits()[0]["hit_count"] == 2
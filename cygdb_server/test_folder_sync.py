@@ -0,0 +1,68 @@
+import os
+
+from folder_sync import sync_folder
+
+
+def test_sync_copies_only_changes(tmp_path):
+    source, destination = tmp_path / "project", tmp_path / "working"
+    (source / "data").mkdir(parents=True)
+    (source / "demo.pyx").write_text("x = 1\n")
+    (source / "other.pyx").write_text("y = 1\n")
+    (source / "data" / "big.bin").write_bytes(b"0" * 1000)
+    (source / "old.py").write_text("pass\n")
+
+    report = sync_folder(source, destination)
+    assert report.as_dict()["files_synced"] == 4
+    assert report.bytes_copied == 1000 + 6 + 6 + 5
+
+    # build outputs of both modules, and a file that has since been removed from the project
+    for name in ("demo.c", "demo.cpython-38d-x86_64-linux-gnu.so", "other.c"):
+        (destination / name).write_text("built")
+    (destination / "cython_debug").mkdir()
+    (destination / "cython_debug" / "cython_debug_info_demo").write_text("<xml/>")
+    (source / "old.py").unlink()
+    (source / "demo.pyx").write_text("x = 2\n")
+
+    report = sync_folder(source, destination)
+    assert report.copied == ["demo.pyx"]
+    assert report.bytes_copied == 6
+    assert sorted(report.deleted) == ["demo.c", "demo.cpython-38d-x86_64-linux-gnu.so", "old.py"]
+    assert (destination / "other.c").exists()
+    assert (destination / "cython_debug" / "cython_debug_info_demo").exists()
+    assert (destination / "demo.pyx").read_text() == "x = 2\n"
+
+
+def test_sync_hashes_same_size_files(tmp_path):
+    source, destination = tmp_path / "project", tmp_path / "working"
+    source.mkdir()
+    (source / "demo.pyx").write_text("x = 1\n")
+    sync_folder(source, destination)
+
+    os.utime(destination / "demo.pyx", ns=(0, 0))
+    report = sync_folder(source, destination)
+    assert report.copied == []
+    assert report.hashed == 1
+
+    (destination / "demo.pyx").write_text("x = 3\n")
+    os.utime(destination / "demo.pyx", ns=(0, 0))
+    report = sync_folder(source, destination)
+    assert report.copied == ["demo.pyx"]
+    assert (destination / "demo.pyx").read_text() == "x = 1\n"
+
+
+def test_sync_keeps_what_the_server_wrote(tmp_path):
+    source, destination = tmp_path / "project", tmp_path / "working"
+    source.mkdir()
+    (source / "demo.pyx").write_text("x = 1\n")
+    sync_folder(source, destination)
+    (destination / "traces").mkdir()
+    (destination / "traces" / "default.cytrace").write_bytes(b"CYTRACE1")
+    (destination / "buffers").mkdir()
+    (destination / "buffers" / "rand_arr_x.npy").write_bytes(b"\x93NUMPY")
+
+    # /Restart after the .pyx was edited
+    (source / "demo.pyx").write_text("x = 2\n")
+    report = sync_folder(source, destination)
+    assert report.deleted == []
+    assert (destination / "traces" / "default.cytrace").read_bytes() == b"CYTRACE1"
+    assert (destination / "buffers" / "rand_arr_x.npy").exists()
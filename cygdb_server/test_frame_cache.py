@@ -0,0 +1,49 @@
+from frame_cache import FrameCache, frame_delta
+from gdb_interface import Frame
+
+
+def make_frame(generation, local_variables, global_variables, trace):
+    frame = Frame(trace=trace)
+    frame.local_variables = local_variables
+    frame.global_variables = global_variables
+    frame.generation = generation
+    return frame
+
+
+def test_cache_keeps_the_latest_generations():
+    cache = FrameCache(size=2)
+    for generation in range(3):
+        cache.put(generation, None, make_frame(generation, [], [], []))
+    assert cache.get(0) is None
+    assert cache.get(2).generation == 2
+    assert cache.get(2, thread_id=4) is None
+    assert cache.as_dict() == dict(size=2, frames=2, hits=1, misses=2)
+
+
+def test_delta_has_only_what_changed():
+    trace = [dict(filename="demo.pyx", lineno="16")]
+    old = make_frame(3, [dict(name="i", type="cy int", value="1"),
+                         dict(name="xs", type="list", value="[1]", child_count=1, address="0x10", handle="3-0x10"),
+                         dict(name="tmp", type="cy int", value="0")],
+                     [dict(name="N", type="int", value="10")], trace)
+    new = make_frame(4, [dict(name="i", type="cy int", value="2"),
+                         dict(name="xs", type="list", value="[1]", child_count=1, address="0x10", handle="4-0x10")],
+                     [dict(name="N", type="int", value="10")], list(trace))
+    delta = frame_delta(old, new)
+    assert delta["since"] == 3 and delta["generation"] == 4
+    assert delta["local_variables"] == dict(changed=[dict(name="i", type="cy int", value="2")],
+                                            removed=["tmp"], handles={"xs": "4-0x10"})
+    assert delta["global_variables"] == dict(changed=[], removed=[], handles={})
+    assert "trace" not in delta
+
+
+def test_truncated_previews_count_as_changed():
+    preview = "[" + "0, " * 40 + "...(truncated)"
+    xs = dict(name="xs", type="list", value=preview, truncated=True, child_count=1000, address="0x10")
+    n = dict(name="n", type="cy int", value="1000", truncated=False)
+    old = make_frame(3, [dict(xs, handle="3-0x10"), n], [], [])
+    # xs[999] changed, the preview is the same
+    new = make_frame(4, [dict(xs, handle="4-0x10"), dict(n)], [], [])
+    delta = frame_delta(old, new)
+    assert delta["local_variables"]["changed"] == [dict(xs, handle="4-0x10")]
+    assert delta["local_variables"]["handles"] == {}
@@ -0,0 +1,50 @@
+import pexpect
+
+from gdb_channel import CommandChannel, quote_command
+
+
+class FakeProc:
+    def __init__(self, chunks):
+        self.chunks = [chunk.encode() for chunk in chunks]
+        self.sent = []
+
+    def sendline(self, line):
+        self.sent.append(line)
+
+    def read_nonblocking(self, size, timeout):
+        if not self.chunks:
+            raise pexpect.exceptions.TIMEOUT("no output")
+        return self.chunks.pop(0)
+
+
+def test_resumed_command_keeps_the_stop_line_printed_after_stopped():
+    # libcython prints the source line once gdb.execute("cont") returned, after *stopped
+    channel = CommandChannel(FakeProc([
+        '1^running\n*running,thread-id="all"\n(gdb) \nprogram output\n',
+        '*stopped,reason="breakpoint-hit",thread-id="1"\n',
+        '~"37            x = (rand_arr_x_memview[i]) * diameter\\n"\n(gdb) \n',
+        '~"{\\"trace\\": []}\\n"\n2^done\n(gdb) \n',
+    ]))
+    cont, snapshot = channel.execute_many(["cy cont", "cy snapshot"], timeout=1)
+    assert cont.console_lines() == ["37            x = (rand_arr_x_memview[i]) * diameter"]
+    assert cont.output_lines() == ["program output"]
+    assert not cont.stats.timed_out
+    assert snapshot.stream_text() == '{"trace": []}\n'
+
+
+def test_next_result_ends_a_stopped_command():
+    channel = CommandChannel(FakeProc([
+        '1^running\n*stopped,reason="end-stepping-range"\n~"12    y = 2\\n"\n',
+        '~"i = 0\\n"\n2^done\n(gdb) \n',
+    ]))
+    step, locals_ = channel.execute_many(["cy step", "cy locals"], timeout=1)
+    assert step.console_lines()[0] == "12    y = 2" and not step.stats.timed_out
+    assert locals_.result.klass == "done"
+
+
+def test_commands_are_sent_on_one_line():
+    assert quote_command('cy exec print("a\\\\b")') == '"cy exec print(\\"a\\\\\\\\b\\")"'
+    assert quote_command("cy exec x\n-gdb-exit\r") == '"cy exec x\\n-gdb-exit\\r"'
+    proc = FakeProc(['1^done\n(gdb) \n'])
+    CommandChannel(proc).execute_many(["cy exec x\n-gdb-exit"], timeout=1)
+    assert len(proc.sent) == 1 and "\n" not in proc.sent[0]
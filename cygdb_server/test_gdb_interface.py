@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import mi_parser as mi
+from gdb_interface import CygdbController, HandleExpired, InvalidHandle
+
+
+class FakeGdb:
+    def __init__(self, payload):
+        self.payload = payload
+        self.commands = []
+
+    def write(self, command, timeout=None):
+        self.commands.append(command)
+        return mi.MIResponse([mi.MIRecord(mi.CONSOLE, text=json.dumps(self.payload) + "\n"),
+                              mi.MIRecord(mi.RESULT, klass="done")])
+
+
+def test_variable_handles_expire_on_resume():
+    cygdb = CygdbController()
+    cygdb.gdb = FakeGdb(dict(address="0x10", offset=0, child_count=2, children=[
+        dict(name="[0]", type="int", value="1", child_count=None, address="0x20"),
+        dict(name="[1]", type="list", value="[]", child_count=0, address="0x30"),
+    ]))
+    frame = cygdb.frame_from_snapshot(dict(
+        local_variables=[dict(name="xs", type="list", value="[1, []]", child_count=2, address="0x10"),
+                         dict(name="i", type="cy int", value="3")],
+        global_variables=[],
+        trace=[]
+    ))
+    handle = frame.local_variables[0]["handle"]
+    assert "handle" not in frame.local_variables[1]
+
+    children = cygdb.children(handle, offset=0, limit=2)
+    assert cygdb.gdb.commands == ["cy children 0x10 0 2"]
+    assert "handle" not in children["children"][0]
+    assert children["children"][1]["handle"].endswith("-0x30")
+
+    cygdb.invalidate_handles()
+    with pytest.raises(HandleExpired):
+        cygdb.children(handle)
+    for handle in (f"{cygdb.generation}-0x10 0 1\ncy kill", f"{cygdb.generation}-rand_arr_x", "0x10", ""):
+        with pytest.raises(InvalidHandle):
+            cygdb.children(handle)
+    assert len(cygdb.gdb.commands) == 1
+
+
+def test_frames_are_read_once_per_stop():
+    cygdb = CygdbController()
+    cygdb.gdb = FakeGdb(dict(local_variables=[dict(name="i", type="cy int", value="3")],
+                             global_variables=[], trace=[], thread_id=1))
+    frame = cygdb.get_frame()
+    assert cygdb.get_frame() is frame is cygdb.frame
+    assert frame.generation == 0 and frame.thread_id == 1
+    assert cygdb.gdb.commands == ["cy snapshot"]
+
+    cygdb.get_frame(thread_id=2)
+    assert cygdb.gdb.commands[-1] == "cy snapshot 2"
+    assert cygdb.frame is frame
+
+    cygdb.invalidate_handles()
+    assert cygdb.get_frame() is not frame
+    assert cygdb.frames.get(0) is frame
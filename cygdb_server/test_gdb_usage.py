@@ -0,0 +1,32 @@
+import asyncio
+import contextvars
+
+import gdb_usage
+import mi_parser as mi
+from gdb_channel import CommandStats
+
+
+def response(bytes_read, wall_time):
+    stats = CommandStats("cy snapshot")
+    stats.bytes_read, stats.records_parsed, stats.wall_time = bytes_read, 2, wall_time
+    return mi.MIResponse([], stats)
+
+
+def test_usage_follows_the_request_context():
+    gdb_usage.record([response(10, 0.1)])
+
+    async def request():
+        usage = gdb_usage.start()
+        gdb_usage.record([response(100, 0.2)])
+        # the server runs blocking gdb work in threads with a copy of the request's context
+        await asyncio.get_event_loop().run_in_executor(
+            None, contextvars.copy_context().run, gdb_usage.record, [response(50, 0.5), response(30, 0.1)])
+        return usage
+
+    async def main():
+        # each request counts its own work only
+        return await asyncio.gather(request(), request())
+
+    first, second = asyncio.run(main())
+    assert first.headers() == second.headers() == {
+        "X-Gdb-Round-Trips": "2", "X-Gdb-Commands": "3", "X-Gdb-Bytes-Read": "180", "X-Gdb-Seconds": "0.700000"}
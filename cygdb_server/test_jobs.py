@@ -0,0 +1,39 @@
+import subprocess as sp
+import sys
+import time
+
+from jobs import CANCELLED, FAILED, FINISHED, JobRunner
+
+
+def test_job_result_and_failure():
+    runner = JobRunner(max_workers=2)
+    job = runner.submit("add", lambda job: 1 + 1)
+    job.future.result(timeout=5)
+    assert job.state == FINISHED
+    assert job.result == 2
+
+    job = runner.submit("fail", lambda job: 1 / 0)
+    job.future.result(timeout=5)
+    assert job.state == FAILED
+    assert "ZeroDivisionError" in job.error
+    assert runner.get(job.job_id) is job
+
+
+def test_cancel_stops_the_process():
+    runner = JobRunner(max_workers=1)
+
+    def sleep(job):
+        proc = sp.Popen([sys.executable, "-c", "import time; print('started', flush=True); time.sleep(60)"],
+                        stdout=sp.PIPE, start_new_session=True)
+        job.attach(proc)
+        job.log(proc.stdout.readline().decode())
+        return proc.wait()
+
+    job = runner.submit("sleep", sleep)
+    while not job.output:
+        time.sleep(0.01)
+    assert job.cancel()
+    job.future.result(timeout=5)
+    assert job.state == CANCELLED
+    assert job.result != 0
+    assert not job.cancel()
@@ -0,0 +1,60 @@
+import os
+
+import metrics
+from line_index import LineIndexCache
+
+
+def write_lines(path, count):
+    path.write_text("\n".join(f"    x = {i}" for i in range(1, count + 1)))
+
+
+def test_corrected_matches_injected_labels(tmp_path):
+    path = tmp_path / "demo.pyx"
+    write_lines(path, 40)
+    index = LineIndexCache().get(path)
+    # the list of labels add_print_to_file used to keep, one per line of the changed file
+    labels = list(range(1, 41))
+    for lineno in (22, 25, 8, 25):
+        position = labels.index(lineno)
+        assert index.corrected(lineno) == position
+        labels.insert(position, f"breakpoint-{lineno}")
+        index.add_insertion(lineno)
+    for lineno in range(1, 41):
+        assert index.corrected(lineno) == labels.index(lineno)
+        assert index.user_lineno(labels.index(lineno) + 1) == lineno
+    for position, label in enumerate(labels):
+        if isinstance(label, str):
+            assert index.user_lineno(position + 1) == int(label.split("-")[1])
+
+
+def test_index_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "demo.pyx"
+    write_lines(path, 10)
+    cache = LineIndexCache()
+    index = cache.get(path)
+    index.add_insertion(5)
+    assert cache.get(path) is index
+    assert cache.stats["file_reads"] == 1
+
+    write_lines(path, 12)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    fresh = cache.get(path)
+    assert fresh is not index
+    assert fresh.insertions == []
+    assert fresh.line_count == 12
+    assert cache.stats["invalidations"] == 1
+
+
+def test_injected_prints_are_told_apart(tmp_path):
+    path = tmp_path / "demo.pyx"
+    write_lines(path, 10)
+    cache = LineIndexCache()
+    index = cache.get(path)
+    for lineno in (3, 7):
+        index.add_insertion(lineno)
+    lookups = metrics.LINE_INDEX_LOOKUPS.value()
+    # 1 2 print 3 4 5 6 print 7 8 9 10
+    assert [lineno for lineno in range(1, 13) if index.is_injected(lineno)] == [3, 8]
+    assert metrics.LINE_INDEX_LOOKUPS.value() > lookups
+    assert cache.find("demo.pyx") is index and cache.find("other.pyx") is None
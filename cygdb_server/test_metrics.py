@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import metrics
+from metrics import Registry, SlowLog, command_name, timed
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    commands = registry.counter("gdb_commands_total", "Commands", ["command"])
+    seconds = registry.histogram("gdb_seconds", "Wall time", ["command"], buckets=(0.1, 1))
+    commands.inc(command="cy cont")
+    commands.inc(2, command='say "hi"')
+    seconds.observe(0.05, command="cy cont")
+    seconds.observe(0.5, command="cy cont")
+    seconds.observe(5, command="cy cont")
+
+    assert registry.render().split("\n") == [
+        "# HELP gdb_commands_total Commands",
+        "# TYPE gdb_commands_total counter",
+        'gdb_commands_total{command="cy cont"} 1',
+        'gdb_commands_total{command="say \\"hi\\""} 2',
+        "# HELP gdb_seconds Wall time",
+        "# TYPE gdb_seconds histogram",
+        'gdb_seconds_bucket{command="cy cont",le="0.1"} 1',
+        'gdb_seconds_bucket{command="cy cont",le="1"} 2',
+        'gdb_seconds_bucket{command="cy cont",le="+Inf"} 3',
+        'gdb_seconds_sum{command="cy cont"} 5.55',
+        'gdb_seconds_count{command="cy cont"} 3',
+        "",
+    ]
+    with pytest.raises(ValueError):
+        commands.inc(stage="parse")
+
+
+def test_timed_calls_end_up_in_the_trace(tmp_path):
+    seconds = Registry().histogram("parse_seconds", "Parsing", ["stage"])
+
+    @timed(seconds, stage="locals")
+    def parse(text):
+        return text.split()
+
+    spans = metrics.start_trace()
+    assert parse("a b") == ["a", "b"]
+    assert seconds.count(stage="locals") == 1
+    assert [(span["name"], span["stage"]) for span in spans] == [("parse_seconds", "locals")]
+
+    log = SlowLog(tmp_path / "slow.jsonl", threshold=0.5)
+    assert not log.write("get_frame", 0.1, spans)
+    assert log.write("continue_debugger", 2.0, spans, status=200)
+    entry = json.loads((tmp_path / "slow.jsonl").read_text())
+    assert entry["name"] == "continue_debugger" and entry["spans"] == spans and entry["status"] == 200
+
+
+def test_command_labels_stay_few():
+    assert command_name("cy children 0x7ffff 0 100") == "cy children"
+    assert command_name("cy exec type(rand_arr_x)") == "cy exec"
+    assert command_name("-gdb-exit") == "-gdb-exit"
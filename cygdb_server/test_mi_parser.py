@@ -0,0 +1,42 @@
+from mi_parser import MIParser, MIResponse, parse_line, parse_cstring
+
+
+def test_parse_result_record():
+    record = parse_line('12^done,bkpt={number="1",locs=[{line="22"},{line="23"}]},bkpt={number="2"}')
+    assert record.kind == "result"
+    assert record.token == 12
+    assert record.klass == "done"
+    assert record.results["bkpt"][0]["locs"] == [{"line": "22"}, {"line": "23"}]
+    assert record.results["bkpt"][1] == {"number": "2"}
+
+
+def test_parse_async_records():
+    stopped = parse_line('*stopped,reason="breakpoint-hit",frame={addr="0x1",args=[]},thread-id="1"')
+    assert stopped.kind == "exec"
+    assert stopped.klass == "stopped"
+    assert stopped.results["frame"] == {"addr": "0x1", "args": []}
+    assert parse_line('=thread-group-added,id="i1"').kind == "notify"
+    assert parse_line("*running").klass == "running"
+
+
+def test_parse_cstring_escapes():
+    value, end = parse_cstring(r'"a\tb \"q\" caf\303\251\n"', 0)
+    assert value == 'a\tb "q" café\n'
+    assert end == len(r'"a\tb \"q\" caf\303\251\n"')
+
+
+def test_feed_partial_lines():
+    parser = MIParser()
+    assert parser.feed(b'~"  22    x = 1\\n"\r\n^do') != []
+    records = parser.feed(b'ne\r\n(gdb) \r\nprogram output\r\n')
+    assert [record.kind for record in records] == ["result", "prompt", "output"]
+    assert records[2].text == "program output"
+
+
+def test_console_lines_strip_ansi():
+    parser = MIParser()
+    records = parser.feed(b'~"\\033[94m22\\033[39;49;00m    x = 1\\n"\n~"\\n"\n^done\n(gdb) \n')
+    response = MIResponse(records)
+    assert response.console_lines() == ["22    x = 1"]
+    assert response.result.klass == "done"
+    assert response.error is None
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from parallel_build import EVENT_PREFIX, load_extensions
+
+
+def test_load_extensions_records_setup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.pyx").write_text("x = 1\n")
+    (tmp_path / "b.pyx").write_text("y = 2\n")
+    setup_py = tmp_path / "setup.py"
+    setup_py.write_text(
+        "from Cython.Build import cythonize\n"
+        "from setuptools import setup, Extension\n"
+        "setup(ext_modules=cythonize([Extension('a', ['a.pyx']), 'b.pyx'], gdb_debug=True))\n"
+    )
+    extensions, cythonize_kwargs = load_extensions(setup_py)
+    assert [extension.name for extension in extensions] == ["a", "b"]
+    assert cythonize_kwargs == dict(gdb_debug=True)
+
+
+def test_load_extensions_without_cythonize(tmp_path):
+    setup_py = tmp_path / "setup.py"
+    setup_py.write_text("from setuptools import setup\nsetup(name='plain')\n")
+    extensions, _ = load_extensions(setup_py)
+    assert extensions is None
+
+
+def test_events_have_their_own_pipe(tmp_path):
+    # compiler output on stdout can't break an event line in two
+    pytest.importorskip("Cython")
+    (tmp_path / "a.pyx").write_text("print('building a')\nx = 1\n")
+    (tmp_path / "setup.py").write_text(
+        "from Cython.Build import cythonize\n"
+        "from setuptools import setup\n"
+        "setup(ext_modules=cythonize(['a.pyx']))\n"
+    )
+    read_events, write_events = os.pipe()
+    proc = subprocess.run([sys.executable, str(Path(__file__).with_name("parallel_build.py")), "--workers", "1",
+                           "--events-fd", str(write_events)], cwd=tmp_path, pass_fds=(write_events,),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    os.close(write_events)
+    with os.fdopen(read_events) as pipe:
+        events = [json.loads(line[len(EVENT_PREFIX):]) for line in pipe]
+    assert proc.returncode == 0, proc.stdout.decode()
+    assert EVENT_PREFIX.encode() not in proc.stdout
+    assert [event["event"] for event in events] == ["plan", "started", "module", "done"]
+    assert events[2]["name"] == "a" and events[2]["success"]
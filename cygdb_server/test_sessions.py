@@ -0,0 +1,47 @@
+import pytest
+
+from sessions import DEFAULT_SESSION, InvalidSessionError, SessionLimitError, SessionRegistry
+
+
+class FakeServer:
+    def __init__(self, working_folder):
+        self.working_folder = working_folder
+        self.cygdb = None
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_limit_and_idle_eviction(tmp_path):
+    registry = SessionRegistry(FakeServer, tmp_path, max_sessions=2, idle_timeout=60)
+    registry.add(DEFAULT_SESSION, FakeServer("working_folder"), "working_folder")
+    session = registry.create("a")
+    assert session.server.working_folder == tmp_path / "a" / "working_folder"
+    with pytest.raises(SessionLimitError):
+        registry.create("b")
+
+    session.last_used -= 120
+    registry.sessions[DEFAULT_SESSION].last_used -= 120
+    assert registry.evict_idle() == ["a"]
+    assert session.server.closed
+    assert registry.get(DEFAULT_SESSION).session_id == DEFAULT_SESSION
+    with pytest.raises(KeyError):
+        registry.get("a")
+    registry.create("b")
+
+
+def test_session_ids_stay_in_the_sessions_folder(tmp_path):
+    sessions_folder = tmp_path / "sessions"
+    (tmp_path / "working_folder").mkdir()
+    (tmp_path / "working_folder" / "demo.pyx").write_text("x = 1\n")
+    registry = SessionRegistry(FakeServer, sessions_folder)
+    for session_id in ("..", "../working_folder", "a/b", "a b", "x" * 65):
+        with pytest.raises(InvalidSessionError):
+            registry.create(session_id)
+    assert registry.sessions == {}
+
+    # a session that got in some other way still can't remove what's outside
+    registry.add("..", FakeServer(sessions_folder / ".."), sessions_folder / "..")
+    registry.remove("..")
+    assert (tmp_path / "working_folder" / "demo.pyx").exists()
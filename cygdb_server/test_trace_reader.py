@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from gdb_interface import CygdbController
+from trace_reader import (TRACE_LINE, TRACE_MAGIC, TRACE_STRING, TraceError, TraceReader, summarize,
+                          trace_start_command)
+
+PYX = "/w/monte_carlo_simulation.pyx"
+
+
+def string(number, text):
+    return TRACE_STRING.pack(b"S", number, len(text)) + text.encode()
+
+
+def line(lineno, thread=1, timestamp=0.0, variables=None):
+    data = json.dumps(variables).encode() if variables else b""
+    return TRACE_LINE.pack(b"L", 0, 1, lineno, thread, timestamp, len(data)) + data
+
+
+def test_stream_a_trace_while_it_is_written(tmp_path):
+    path = tmp_path / "session.cytrace"
+    path.write_bytes(TRACE_MAGIC + string(0, PYX) + string(1, "estimate_pi_cy") + line(36, timestamp=1.0))
+    reader = TraceReader(path)
+    records, offset = reader.read()
+    assert records == [dict(filename=PYX, function="estimate_pi_cy", lineno=36, thread=1, time=1.0)]
+
+    # gdb flushed half of the next record
+    record = line(37, thread=2, timestamp=1.5, variables=dict(i="0"))
+    with open(path, "ab") as fp:
+        fp.write(record[:10])
+    assert reader.read(offset) == ([], offset)
+    with open(path, "ab") as fp:
+        fp.write(record[10:] + line(40, timestamp=2.0))
+    records, offset = reader.read(offset, limit=1)
+    assert [(r["lineno"], r["thread"], r.get("locals")) for r in records] == [(37, 2, dict(i="0"))]
+
+    # a new reader starting in the middle learns the names from the start of the file
+    assert [r["lineno"] for r in TraceReader(path).read(offset)[0]] == [40]
+    with pytest.raises(TraceError):
+        TraceReader(path).read(offset - 3)
+
+
+def test_summary_and_coverage(tmp_path):
+    path = tmp_path / "session.cytrace"
+    path.write_bytes(TRACE_MAGIC + string(0, PYX) + string(1, "estimate_pi_cy") +
+                     b"".join(line(lineno, thread=1 + lineno % 2, timestamp=lineno / 10)
+                              for lineno in (36, 37, 38, 40, 37, 38, 40)))
+    functions = [dict(module="monte_carlo_simulation", filename=PYX, function="estimate_pi_cy",
+                      lines=[36, 37, 38, 40, 41])]
+    summary = summarize(path, functions)
+    assert summary["records"] == 7 and summary["threads"] == {"1": 5, "2": 2}
+    assert summary["lines"][0] == dict(filename=PYX, function="estimate_pi_cy", lineno=37, count=2)
+    assert summary["coverage"] == [dict(module="monte_carlo_simulation", function="estimate_pi_cy", lines=5,
+                                        covered=4, percent=80.0, missed=[41])]
+
+
+def test_print_mode_traces_are_on_the_user_lines(tmp_path):
+    pyx = tmp_path / "monte_carlo_simulation.pyx"
+    pyx.write_text("".join(f"line {lineno}\n" for lineno in range(1, 41)))
+    cygdb = CygdbController()
+    # a print injected in front of user line 37: 37 is the print, 38 user line 37
+    cygdb.line_indexes.get(pyx).add_insertion(37)
+    path = tmp_path / "session.cytrace"
+    path.write_bytes(TRACE_MAGIC + string(0, str(pyx)) + string(1, "estimate_pi_cy") +
+                     b"".join(line(lineno) for lineno in (36, 37, 38, 39, 37, 38)))
+    functions = [dict(module="monte_carlo_simulation", filename=str(pyx), function="estimate_pi_cy",
+                      lines=[36, 37, 38, 39, 41])]
+
+    summary = summarize(path, functions, cygdb.user_trace_line())
+    assert summary["records"] == 4
+    assert [(entry["lineno"], entry["count"]) for entry in summary["lines"]] == [(37, 2), (36, 1), (38, 1)]
+    assert summary["coverage"][0]["lines"] == 4 and summary["coverage"][0]["missed"] == [40]
+
+    cygdb.breakpoint_mode = "debug_info"
+    assert cygdb.user_trace_line() is None
+    assert summarize(path, functions, cygdb.user_trace_line())["records"] == 6
+
+
+def test_trace_start_command():
+    assert trace_start_command("/w/t.cytrace", ["demo:estimate_pi_cy"], ["i", "x"]) == \
+        "cy trace-start /w/t.cytrace --locals i,x demo:estimate_pi_cy"
+    with pytest.raises(TraceError):
+        trace_start_command("/w/t.cytrace", [])
+    with pytest.raises(TraceError):
+        trace_start_command("/w/t.cytrace", ["f"], ["i\ncy kill"])
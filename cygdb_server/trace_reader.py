@@ -0,0 +1,201 @@
+"""
+Trace files written by ``cy trace-start`` (gdb_extensions.py): every line the traced
+Cython functions ran, recorded inside gdb without stopping the program.
+
+The file is append-only: the magic, then records that start with their kind. A
+string record gives a file or function name its number; a line record has the file
+and function numbers, line, thread, timestamp and optionally the selected locals as
+JSON. ``TraceReader`` decodes it incrementally from any offset it handed out, so a
+trace can be streamed while the program still writes it.
+
+gdb records the lines of the source it compiled. In print mode that source has the
+breakpoint prints injected, ``user_records`` and ``user_functions`` map its lines back
+with a ``user_line(filename, lineno)`` function that returns None for the prints.
+"""
+import json
+import struct
+from collections import Counter
+
+# keep in sync with gdb_extensions.py
+TRACE_MAGIC = b"CYTRACE1"
+TRACE_STRING = struct.Struct("<cHH")
+TRACE_LINE = struct.Struct("<cHHIIdH")
+TRACE_SUFFIX = ".cytrace"
+DECODE_CHUNK = 10000
+
+
+class TraceError(Exception):
+    pass
+
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        self.strings = {}
+        # strings are known for everything before this offset
+        self.scanned = len(TRACE_MAGIC)
+
+    def read(self, offset=0, limit=None):
+        """
+        (line records from ``offset`` on, offset of the next one). Only offsets this
+        reader returned, or 0, are record boundaries. A record still being written is
+        left for the next read.
+        """
+        base, offset, data = self._load(offset)
+        records, end = self._decode(data, base, offset - base, len(data), limit)
+        return records, base + end
+
+    def iter_records(self, offset=0, chunk=DECODE_CHUNK):
+        """Every line record from ``offset`` on, decoded a chunk at a time."""
+        base, offset, data = self._load(offset)
+        position = offset - base
+        while True:
+            records, position = self._decode(data, base, position, len(data), chunk)
+            if not records:
+                return
+            yield from records
+
+    def _load(self, offset):
+        offset = max(offset, len(TRACE_MAGIC))
+        # strings are all known up to self.scanned, only read from there or from offset
+        base = min(offset, self.scanned)
+        with open(self.path, "rb") as fp:
+            magic = fp.read(len(TRACE_MAGIC))
+            fp.seek(base)
+            data = fp.read()
+        if magic != TRACE_MAGIC[:len(magic)]:
+            raise TraceError(f"{self.path} is not a trace file")
+        if offset > base:
+            self._decode(data, base, 0, offset - base, None)
+        return base, offset, data
+
+    def _decode(self, data, base, offset, end, limit):
+        """Records of ``data[offset:end]``, ``data`` being the file from ``base`` on."""
+        records = []
+        while offset < end and (limit is None or len(records) < limit):
+            kind = data[offset:offset + 1]
+            if kind == b"S":
+                if offset + TRACE_STRING.size > len(data):
+                    break
+                _, number, length = TRACE_STRING.unpack_from(data, offset)
+                start = offset + TRACE_STRING.size
+                if start + length > len(data):
+                    break
+                self.strings[number] = data[start:start + length].decode("utf-8", errors="replace")
+                offset = start + length
+            elif kind == b"L":
+                if offset + TRACE_LINE.size > len(data):
+                    break
+                _, filename, function, lineno, thread, timestamp, length = TRACE_LINE.unpack_from(data, offset)
+                start = offset + TRACE_LINE.size
+                if start + length > len(data):
+                    break
+                try:
+                    record = dict(filename=self.strings[filename], function=self.strings[function], lineno=lineno,
+                                  thread=thread, time=timestamp)
+                except KeyError:
+                    raise TraceError(f"offset {base + offset} of {self.path} isn't the start of a record")
+                if length:
+                    record["locals"] = json.loads(data[start:start + length].decode("utf-8", errors="replace"))
+                records.append(record)
+                offset = start + length
+            else:
+                raise TraceError(f"offset {base + offset} of {self.path} isn't the start of a record")
+            self.scanned = max(self.scanned, base + offset)
+        return records, offset
+
+
+def trace_start_command(path, functions, variables=()):
+    """``cy trace-start`` for ``functions`` (``module:function`` or names), recording ``variables``."""
+    words = [str(path)] + list(functions) + list(variables)
+    if not functions or any(not word or any(c.isspace() or c in "\"'," for c in word) for word in words):
+        raise TraceError(f"invalid trace of {list(functions)} with locals {list(variables)} to {path}")
+    command = f"cy trace-start {path}"
+    if variables:
+        command += " --locals " + ",".join(variables)
+    return command + " " + " ".join(functions)
+
+
+def parse_trace_reply(resp, command):
+    if resp.error is not None:
+        raise TraceError(f"{command} failed: {resp.error}")
+    try:
+        payload = json.loads(resp.stream_text())
+    except ValueError:
+        raise TraceError(f"{command} printed no JSON: {resp.stream_text()!r}")
+    if "error" in payload:
+        raise TraceError(payload["error"])
+    return payload
+
+
+def user_records(records, user_line):
+    """``records`` on the user's lines, without those of the injected prints."""
+    for record in records:
+        lineno = user_line(record["filename"], record["lineno"])
+        if lineno is not None:
+            record["lineno"] = lineno
+            yield record
+
+
+def user_functions(functions, user_line):
+    """The traced ``functions`` with the user's lines."""
+    return [dict(function, lines=sorted({user_line(function["filename"], lineno) for lineno in function["lines"]}
+                                        - {None}))
+            for function in functions]
+
+
+def read_trace(path):
+    return TraceReader(path).read()[0]
+
+
+class TraceSummary:
+    """Line frequencies, per-thread counts and coverage, added up a chunk of records at a time."""
+
+    def __init__(self):
+        self.frequencies = Counter()
+        self.threads = Counter()
+        self.records = 0
+        self.first = None
+        self.last = None
+
+    def add(self, records):
+        for record in records:
+            self.frequencies[record["filename"], record["function"], record["lineno"]] += 1
+            self.threads[record["thread"]] += 1
+            self.records += 1
+            if self.first is None:
+                self.first = record["time"]
+            self.last = record["time"]
+
+    def as_dict(self, functions=()):
+        """``functions`` are the traced ones as ``cy trace-start`` reported them."""
+        summary = dict(
+            records=self.records,
+            seconds=self.last - self.first if self.records else 0.0,
+            threads={str(thread): count for thread, count in sorted(self.threads.items())},
+            lines=[dict(filename=filename, function=function, lineno=lineno, count=count)
+                   for (filename, function, lineno), count in self.frequencies.most_common()],
+            coverage=[],
+        )
+        for function in functions:
+            hit = [lineno for lineno in function["lines"]
+                   if (function["filename"], function["function"], lineno) in self.frequencies]
+            summary["coverage"].append(dict(
+                module=function["module"],
+                function=function["function"],
+                lines=len(function["lines"]),
+                covered=len(hit),
+                percent=round(100.0 * len(hit) / len(function["lines"]), 1) if function["lines"] else None,
+                missed=sorted(set(function["lines"]) - set(hit)),
+            ))
+        return summary
+
+
+def summarize(path, functions=(), user_line=None):
+    records = TraceReader(path).iter_records()
+    if user_line is not None:
+        records = user_records(records, user_line)
+        functions = user_functions(functions, user_line)
+    summary = TraceSummary()
+    summary.add(records)
+    return summary.as_dict(functions)